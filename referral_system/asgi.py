@@ -14,3 +14,7 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'referral_system.settings')
 
 application = get_asgi_application()
+
+from users.db import warm_up_connections  # noqa: E402
+
+warm_up_connections()
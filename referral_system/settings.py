@@ -51,8 +51,11 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'users.middleware.MetricsMiddleware',
+    'users.middleware.PerformanceMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
+    'users.middleware.SessionRefreshMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
@@ -78,11 +81,35 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'referral_system.wsgi.application'
+ASGI_APPLICATION = 'referral_system.asgi.application'
+
+# 'wsgi' - синхронные воркеры gunicorn, 'asgi' - воркеры uvicorn
+# и асинхронные представления аутентификации и профиля (users/async_views.py)
+SERVER_MODE = os.environ.get('SERVER_MODE', 'wsgi')
+ASYNC_VIEWS = SERVER_MODE == 'asgi'
 
 
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+DATABASE_SETTINGS = {
+    # 'postgresql' или 'sqlite' (файл DB_NAME, для локальных замеров и отладки)
+    'engine': os.environ.get('DB_ENGINE', 'postgresql'),
+    # 'persistent' - соединение потока переиспользуется conn_max_age секунд,
+    # 'pool' - пул соединений psycopg 3 на процесс (uv sync --extra pool)
+    'connection_mode': os.environ.get('DB_CONNECTION_MODE', 'persistent'),
+    # Под ASGI запросы выполняются в разных потоках, и постоянные соединения
+    # потоков не закрывались бы, поэтому там по умолчанию используйте пул
+    'conn_max_age': int(os.environ.get('DB_CONN_MAX_AGE', 0 if ASYNC_VIEWS else 60)),
+    'health_checks': os.environ.get('DB_CONN_HEALTH_CHECKS', 'true').lower() == 'true',
+    # Соединений на процесс: max_size * воркеры * реплики должно быть меньше max_connections PostgreSQL
+    'pool_min_size': int(os.environ.get('DB_POOL_MIN_SIZE', 2)),
+    'pool_max_size': int(os.environ.get('DB_POOL_MAX_SIZE', 10)),
+    'pool_timeout': float(os.environ.get('DB_POOL_TIMEOUT', 10)),
+    # Открывать соединения при старте воркера, а не в первом запросе
+    'warmup': os.environ.get('DB_WARMUP', 'true').lower() == 'true',
+}
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.postgresql',
@@ -91,10 +118,63 @@ DATABASES = {
         'PASSWORD': os.environ.get('DB_PASSWORD', 'postgres'),
         'HOST': os.environ.get('DB_HOST', 'db'),
         'PORT': os.environ.get('DB_PORT', '5432'),
+        'CONN_MAX_AGE': DATABASE_SETTINGS['conn_max_age'],
+        # Перед переиспользованием соединение проверяется, разорванное открывается заново
+        'CONN_HEALTH_CHECKS': DATABASE_SETTINGS['health_checks'],
+    }
+}
+
+if DATABASE_SETTINGS['engine'] == 'sqlite':
+    DATABASES['default'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.environ.get('DB_NAME', BASE_DIR / 'db.sqlite3'),
+        'CONN_MAX_AGE': DATABASE_SETTINGS['conn_max_age'],
+        'CONN_HEALTH_CHECKS': DATABASE_SETTINGS['health_checks'],
+        'OPTIONS': {
+            # Параллельные записи ждут блокировку вместо ошибки "database is locked"
+            'timeout': 20,
+            'transaction_mode': 'IMMEDIATE',
+            'init_command': 'PRAGMA journal_mode=WAL;',
+        },
+    }
+elif DATABASE_SETTINGS['connection_mode'] == 'pool':
+    # Пул сам переиспользует соединения и проверяет их при выдаче,
+    # поэтому постоянные соединения Django с ним не совмещаются
+    DATABASES['default']['CONN_MAX_AGE'] = 0
+    DATABASES['default']['OPTIONS'] = {
+        'pool': {
+            'min_size': DATABASE_SETTINGS['pool_min_size'],
+            'max_size': DATABASE_SETTINGS['pool_max_size'],
+            'timeout': DATABASE_SETTINGS['pool_timeout'],
+        },
+    }
+
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', 'referral-system'),
     }
 }
 
 
+LOG_SETTINGS = {
+    # 'queue' - обработчики пишут в фоновом потоке процесса через очередь,
+    # 'sync' - запись в файл и консоль прямо в потоке запроса
+    'mode': os.environ.get('LOG_MODE', 'queue'),
+    # 'text' или 'json' (одна запись - один JSON-объект в строке)
+    'format': os.environ.get('LOG_FORMAT', 'text'),
+    # Отдельный файл на процесс ({pid} - id процесса): ротация общего файла
+    # несколькими воркерами gunicorn не согласована, и записи терялись бы.
+    # Для общего файла без {pid} задайте LOG_MAX_BYTES=0 и ротацию logrotate
+    'file': os.environ.get('LOG_FILE', 'referral_system-{pid}.log'),
+    # 0 - без ротации внутри процесса (WatchedFileHandler, внешняя ротация)
+    'max_bytes': int(os.environ.get('LOG_MAX_BYTES', 10 * 1024 * 1024)),
+    'backup_count': int(os.environ.get('LOG_BACKUP_COUNT', 5)),
+    'queue_size': 10000,
+}
+
+LOG_FORMATTER = 'json' if LOG_SETTINGS['format'] == 'json' else 'verbose'
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
@@ -107,16 +187,30 @@ LOGGING = {
             'format': '{levelname} {message}',
             'style': '{',
         },
+        'json': {
+            '()': 'users.log_handlers.JsonFormatter',
+        },
     },
     'handlers': {
         'console': {
             'class': 'logging.StreamHandler',
-            'formatter': 'verbose',
+            'formatter': LOG_FORMATTER,
         },
         'file': {
-            'class': 'logging.FileHandler',
-            'filename': 'referral_system.log',
-            'formatter': 'verbose',
+            '()': 'users.log_handlers.build_file_handler',
+            'filename': LOG_SETTINGS['file'],
+            'max_bytes': LOG_SETTINGS['max_bytes'],
+            'backup_count': LOG_SETTINGS['backup_count'],
+            'log_format': LOG_SETTINGS['format'],
+        },
+        'queue': {
+            '()': 'users.log_handlers.BackgroundQueueHandler',
+            'filename': LOG_SETTINGS['file'],
+            'max_bytes': LOG_SETTINGS['max_bytes'],
+            'backup_count': LOG_SETTINGS['backup_count'],
+            'log_format': LOG_SETTINGS['format'],
+            'console': True,
+            'queue_size': LOG_SETTINGS['queue_size'],
         },
     },
     'root': {
@@ -125,7 +219,7 @@ LOGGING = {
     },
     'loggers': {
         'users': {
-            'handlers': ['console', 'file'],
+            'handlers': ['queue'] if LOG_SETTINGS['mode'] == 'queue' else ['console', 'file'],
             'level': 'INFO',
             'propagate': False,
         },
@@ -183,28 +277,191 @@ REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [],
     'DEFAULT_PERMISSION_CLASSES': [],
     'DEFAULT_SCHEMA_CLASS': 'rest_framework.schemas.coreapi.AutoSchema',
-    'EXCEPTION_HANDLER': 'users.exceptions.custom_exception_handler'
+    'EXCEPTION_HANDLER': 'users.exceptions.custom_exception_handler',
+    # orjson, если установлен (uv sync --extra json), иначе JSONEncoder DRF
+    'DEFAULT_RENDERER_CLASSES': [
+        'users.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    # IP клиента берется из X-Forwarded-For, добавленного nginx
+    'NUM_PROXIES': int(os.environ.get('NUM_PROXIES', 1)),
 }
 
+# Swagger UI и ReDoc загружают схему из файла, собранного build_openapi_schema
+# (см. users/openapi.py), а не генерируют ее заново на каждый запрос
+SWAGGER_SETTINGS = {
+    'SPEC_URL': 'openapi-schema',
+}
+REDOC_SETTINGS = {
+    'SPEC_URL': 'openapi-schema',
+}
+
+SESSION_BACKENDS = {
+    # Подписанная cookie без обращений к БД
+    'signed_cookies': 'django.contrib.sessions.backends.signed_cookies',
+    # БД с кешем перед ней (см. CACHES)
+    'cached_db': 'django.contrib.sessions.backends.cached_db',
+    'db': 'django.contrib.sessions.backends.db',
+}
+SESSION_ENGINE = SESSION_BACKENDS[os.environ.get('SESSION_BACKEND', 'signed_cookies')]
 SESSION_COOKIE_AGE = 24 * 60 * 60  # 24 часа
-SESSION_SAVE_EVERY_REQUEST = True
+SESSION_SAVE_EVERY_REQUEST = False
+
+SESSION_SETTINGS = {
+    # Скользящее продление сессии не чаще одного раза за интервал
+    'refresh_interval_seconds': int(os.environ.get('SESSION_REFRESH_INTERVAL_SECONDS', 60 * 60)),
+}
 
 INVITE_CODE_SETTINGS = {
     'length': 6,
-    'charset': string.ascii_uppercase + string.ascii_lowercase + string.digits,
-    'max_attempts': 10
+    # Инвайт-коды не зависят от регистра и хранятся в верхнем регистре.
+    # Смена charset меняет пространство кодов режима 'sequence' (см. backfill_invite_codes --all)
+    'charset': string.ascii_uppercase + string.digits,
+    'max_attempts': 10,
+    # 'random' - случайный код с проверкой уникальности,
+    # 'sequence' - код из последовательности PostgreSQL через обратимую перестановку
+    'mode': os.environ.get('INVITE_CODE_MODE', 'random'),
+    # Смена секрета меняет соответствие значений последовательности и кодов
+    'secret': os.environ.get('INVITE_CODE_SECRET', SECRET_KEY),
+    'sequence_block_size': int(os.environ.get('INVITE_CODE_SEQUENCE_BLOCK_SIZE', 100)),
+}
+
+INVITE_CODE_CACHE_SETTINGS = {
+    # Кеш инвайт-код -> id пользователя в памяти каждого воркера
+    'enabled': os.environ.get('INVITE_CODE_CACHE_ENABLED', 'true').lower() == 'true',
+    'max_size': int(os.environ.get('INVITE_CODE_CACHE_SIZE', 10000)),
+    'ttl_seconds': int(os.environ.get('INVITE_CODE_CACHE_TTL_SECONDS', 300)),
+    # Несуществующие коды: за это время код, выданный другим воркером, станет виден
+    'negative_ttl_seconds': int(os.environ.get('INVITE_CODE_CACHE_NEGATIVE_TTL_SECONDS', 30)),
 }
 
 VERIFICATION_CODE_SETTINGS = {
     'length': 4,
     'numeric_only': True,
     'charset': string.digits,
-    'max_attempts': 10,
-    'expiration_minutes': int(os.environ.get("VERIFICATION_CODE_EXPIRATION_MINUTES", 5))
+    'expiration_minutes': int(os.environ.get("VERIFICATION_CODE_EXPIRATION_MINUTES", 5)),
+    # 'reuse' - повторная отправка в пределах порога возвращает действующий код,
+    # 'rotate' - каждая отправка выдает новый код
+    'resend_mode': os.environ.get("VERIFICATION_CODE_RESEND_MODE", "reuse"),
+    'reuse_threshold_seconds': int(os.environ.get("VERIFICATION_CODE_REUSE_THRESHOLD_SECONDS", 120)),
+    'extend_on_reuse': os.environ.get("VERIFICATION_CODE_EXTEND_ON_REUSE", "true").lower() == "true",
+}
+
+REFERRAL_SETTINGS = {
+    # Сколько последних рефералов показывать прямо в профиле
+    'profile_preview_size': 10,
+    'page_size': 50,
+    'max_page_size': 200,
+    # Предел глубины при перестройке замыкания дерева рефералов
+    'max_tree_depth': 1000,
+}
+
+PROFILE_CACHE_SETTINGS = {
+    # Сброс версии профиля должен быть виден всем воркерам, поэтому по умолчанию
+    # кеш включен только при общем кеше (Redis, Memcached), а не locmem
+    'enabled': os.environ.get(
+        'PROFILE_CACHE_ENABLED', str('locmem' not in CACHES['default']['BACKEND'])
+    ).lower() == 'true',
+    'cache_alias': 'default',
+    'ttl_seconds': int(os.environ.get('PROFILE_CACHE_TTL_SECONDS', 300)),
+    # Версия живет дольше данных: ETag не меняется, пока профиль не изменился
+    'version_ttl_seconds': 24 * 60 * 60,
+}
+
+LEADERBOARD_SETTINGS = {
+    'default_limit': 10,
+    'max_limit': 100,
+    'cache_alias': 'default',
+    # Рейтинг кешируется целиком: топ и распределение счетчиков для расчета места
+    'cache_ttl_seconds': int(os.environ.get('LEADERBOARD_CACHE_TTL_SECONDS', 30)),
+    'reconcile_interval_minutes': int(os.environ.get('LEADERBOARD_RECONCILE_INTERVAL_MINUTES', 60)),
+    'reconcile_batch_size': 10000,
+}
+
+CODE_DELIVERY_SETTINGS = {
+    # 'outbox' - код ставится в очередь и отправляется фоновым диспетчером,
+    # 'sync' - код отправляется прямо в запросе (старое поведение)
+    'mode': os.environ.get('CODE_DELIVERY_MODE', 'outbox'),
+    'sender': os.environ.get('CODE_DELIVERY_SENDER', 'users.delivery.FakeCodeSender'),
+    'sender_options': {
+        'min_latency': float(os.environ.get('FAKE_SMS_MIN_LATENCY', 1)),
+        'max_latency': float(os.environ.get('FAKE_SMS_MAX_LATENCY', 2)),
+    },
+    'batch_size': int(os.environ.get('CODE_DELIVERY_BATCH_SIZE', 100)),
+    'max_attempts': 3,
+    # Сообщение в статусе 'sending' дольше этого срока считается брошенным
+    # упавшим диспетчером и забирается на отправку снова
+    'claim_timeout_seconds': int(os.environ.get('CODE_DELIVERY_CLAIM_TIMEOUT_SECONDS', 60)),
+    'max_batches_per_run': 50,
+    'dispatch_interval_seconds': int(os.environ.get('CODE_DELIVERY_DISPATCH_INTERVAL_SECONDS', 2)),
+    'retention_hours': 24,
+}
+
+RATE_LIMIT_SETTINGS = {
+    'enabled': os.environ.get('RATE_LIMIT_ENABLED', 'true').lower() == 'true',
+    # 'memory' - token bucket в памяти процесса (лимит действует на каждый воркер),
+    # 'cache' - скользящее окно в CACHES, общее для воркеров при Redis или Memcached
+    'backend': os.environ.get('RATE_LIMIT_BACKEND', 'memory'),
+    'cache_alias': 'default',
+    # Предел числа ключей backend 'memory', после которого наполнившиеся ведра удаляются
+    'max_keys': 100000,
+    # Формат DRF: число запросов / s, m, h или d
+    'rates': {
+        'send_code_phone': os.environ.get('RATE_LIMIT_SEND_CODE_PHONE', '3/m'),
+        'send_code_ip': os.environ.get('RATE_LIMIT_SEND_CODE_IP', '30/m'),
+        # Статус доставки выдает, запрашивался ли код для номера: лимит против перебора
+        'delivery_status_ip': os.environ.get('RATE_LIMIT_DELIVERY_STATUS_IP', '30/m'),
+    },
+}
+
+IDEMPOTENCY_SETTINGS = {
+    'enabled': os.environ.get('IDEMPOTENCY_ENABLED', 'true').lower() == 'true',
+    # 'db' - ответы в таблице referral_idempotency_records, общие для воркеров,
+    # 'memory' - в памяти процесса (повтор, попавший на другой воркер, выполняется заново)
+    'backend': os.environ.get('IDEMPOTENCY_BACKEND', 'db'),
+    # Клиенты повторяют запросы в течение минут, дольше ответы не нужны.
+    # Срок не превышает жизни кода верификации (VERIFICATION_CODE_EXPIRATION_MINUTES)
+    'ttl_seconds': int(os.environ.get('IDEMPOTENCY_TTL_SECONDS', 300)),
+    # Срок резервирования ключа выполняющимся запросом: после падения воркера
+    # ключ снова можно занять через это время, а не через ttl_seconds
+    'pending_ttl_seconds': int(os.environ.get('IDEMPOTENCY_PENDING_TTL_SECONDS', 30)),
+    # Предел числа ключей backend 'memory', после которого просроченные ответы удаляются
+    'max_keys': 100000,
+}
+
+PERFORMANCE_SETTINGS = {
+    'enabled': os.environ.get('PERF_ENABLED', 'true').lower() == 'true',
+    # Доля замеряемых запросов: запросы вне выборки не оборачиваются
+    'sample_rate': float(os.environ.get('PERF_SAMPLE_RATE', 0.1)),
+    'server_timing': os.environ.get('PERF_SERVER_TIMING', 'true').lower() == 'true',
+    # Больше запросов к БД на запрос - предупреждение в журнале
+    'query_budget': int(os.environ.get('PERF_QUERY_BUDGET', 10)),
+    # Бюджеты отдельных маршрутов по имени из urls.py
+    'query_budgets': {},
+}
+
+METRICS_SETTINGS = {
+    'enabled': os.environ.get('METRICS_ENABLED', 'true').lower() == 'true',
+    # Bearer-токен для /metrics и /api/health/db/, пустой - без проверки (закрывайте их на прокси)
+    'token': os.environ.get('METRICS_TOKEN', ''),
+    # Каталоги mmap-файлов процессов (PROMETHEUS_MULTIPROC_DIR веб-сервера и планировщика),
+    # пустой список - метрики только текущего процесса
+    'multiprocess_dirs': [
+        path for path in os.environ.get(
+            'METRICS_MULTIPROCESS_DIRS', os.environ.get('PROMETHEUS_MULTIPROC_DIR', '')
+        ).split(',') if path
+    ],
+}
+
+CLEANUP_SETTINGS = {
+    'batch_size': int(os.environ.get('CLEANUP_BATCH_SIZE', 5000)),
+    'time_budget_seconds': int(os.environ.get('CLEANUP_TIME_BUDGET_SECONDS', 60)),
+    'max_batches_per_second': 10,
 }
 
 SCHEDULER_SETTINGS = {
     'cleanup_interval_minutes': 10,  
+    'session_cleanup_interval_minutes': 60,
     'max_workers': 2,
 }
 
@@ -3,21 +3,21 @@ from django.urls import path, include
 from django.views.generic import TemplateView
 from rest_framework import permissions
 from drf_yasg.views import get_schema_view
-from drf_yasg import openapi
+from users import views as users_views
+from users.openapi import API_INFO, CachedSchemaGenerator
 
 schema_view = get_schema_view(
-    openapi.Info(
-        title="Referral System API",
-        default_version='v1',
-        description="API for referral system with phone authentication",
-    ),
+    API_INFO,
     public=True,
     permission_classes=[permissions.AllowAny],
+    generator_class=CachedSchemaGenerator,
 )
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('users.urls')),
+    path('metrics', users_views.metrics, name='metrics'),
+    path('openapi.json', users_views.openapi_schema, name='openapi-schema'),
     path('swagger/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
     path('redoc/', schema_view.with_ui('redoc', cache_timeout=0), name='schema-redoc'),
     path('', TemplateView.as_view(template_name='phone_input.html'), name='phone-input'),
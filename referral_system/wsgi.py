@@ -14,3 +14,7 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'referral_system.settings')
 
 application = get_wsgi_application()
+
+from users.db import warm_up_connections  # noqa: E402
+
+warm_up_connections()
@@ -2,5 +2,11 @@
 
 /usr/local/bin/wait-for-it.sh referring_db:5432 --timeout=30 --strict -- echo "Database is up and ready"
 
+if [ -n "$PROMETHEUS_MULTIPROC_DIR" ]; then
+    # Файлы метрик прошлого запуска: счетчики начинаются заново
+    rm -rf "$PROMETHEUS_MULTIPROC_DIR"
+    mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+fi
+
 echo "Start APScheduler..."
 uv run manage.py cleanup_expired_codes || echo "Failed to start APScheduler"
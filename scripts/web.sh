@@ -2,11 +2,25 @@
 
 /usr/local/bin/wait-for-it.sh referring_db:5432 --timeout=30 --strict -- echo "Database is up and ready"
 
+if [ -n "$PROMETHEUS_MULTIPROC_DIR" ]; then
+    # Файлы метрик прошлого запуска: счетчики начинаются заново
+    rm -rf "$PROMETHEUS_MULTIPROC_DIR"
+    mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+fi
+
 echo "Run Django migrations..."
 uv run manage.py migrate || echo "No migrations to apply"
 
 echo "Collecting static files..."
 uv run manage.py collectstatic --noinput --clear || echo "No static files to collect"
 
-echo "Starting Django application..."
-uv run gunicorn referral_system.wsgi --bind 0.0.0.0:8000 --workers 4 --timeout 30 || echo "Failed to start Gunicorn"
\ No newline at end of file
+echo "Building OpenAPI schema..."
+uv run manage.py build_openapi_schema || echo "Failed to build OpenAPI schema, it will be generated by each worker"
+
+if [ "${SERVER_MODE:-wsgi}" = "asgi" ]; then
+    echo "Starting Django application (ASGI)..."
+    uv run gunicorn referral_system.asgi:application --worker-class uvicorn_worker.UvicornWorker --bind 0.0.0.0:8000 --workers 4 --timeout 30 || echo "Failed to start Gunicorn"
+else
+    echo "Starting Django application..."
+    uv run gunicorn referral_system.wsgi --bind 0.0.0.0:8000 --workers 4 --timeout 30 || echo "Failed to start Gunicorn"
+fi
\ No newline at end of file
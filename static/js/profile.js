@@ -46,6 +46,9 @@ $(document).ready(function() {
     }
 });
 
+// Последний полученный профиль: при ответе 304 отрисовывается он
+let cachedProfile = null;
+
 function loadProfile() {
     const profileDiv = $('#profileData');
     profileDiv.html(`
@@ -60,10 +63,17 @@ function loadProfile() {
     $.ajax({
         url: '/api/profile/',
         method: 'GET',
+        // jQuery отправляет If-None-Match с ETag прошлого ответа, неизмененный профиль приходит 304 без тела
+        ifModified: true,
         headers: {
             'X-CSRFToken': getCookie('csrftoken')
         },
-        success: function(data) {
+        success: function(data, textStatus) {
+            if (textStatus === 'notmodified' && cachedProfile) {
+                data = cachedProfile;
+            } else {
+                cachedProfile = data;
+            }
             renderProfile(data, profileDiv);
         },
         error: function(xhr) {
@@ -107,7 +117,7 @@ function renderProfile(data, container) {
                 </p>
                 <p>
                     <strong><i class="fas fa-users me-2"></i>Количество рефералов:</strong> 
-                    ${data.referrals.length}
+                    ${data.referral_count}
                 </p>
             </div>
         </div>
@@ -115,20 +125,25 @@ function renderProfile(data, container) {
         <hr class="my-4">
         
         <h5>
-            <i class="fas fa-user-friends me-2"></i>Ваши рефералы (${data.referrals.length})
+            <i class="fas fa-user-friends me-2"></i>Ваши рефералы (${data.referral_count})
         </h5>
     `;
     
     if (data.referrals.length > 0) {
-        profileHtml += '<ul class="list-group">';
+        profileHtml += '<ul class="list-group" id="referralList">';
         data.referrals.forEach(function(referral) {
-            profileHtml += `
-                <li class="list-group-item">
-                    <i class="fas fa-user me-2"></i>${referral}
-                </li>
-            `;
+            profileHtml += renderReferral(referral);
         });
         profileHtml += '</ul>';
+        if (data.referral_count > data.referrals.length) {
+            profileHtml += `
+                <div class="d-grid mt-2">
+                    <button type="button" class="btn btn-outline-primary" id="loadReferrals">
+                        <i class="fas fa-chevron-down me-2"></i>Показать всех рефералов
+                    </button>
+                </div>
+            `;
+        }
     } else {
         profileHtml += `
             <div class="alert alert-info fade-in">
@@ -139,6 +154,48 @@ function renderProfile(data, container) {
     }
     
     container.html(profileHtml);
+    
+    $('#loadReferrals').click(function() {
+        $('#referralList').empty();
+        loadReferrals('/api/profile/referrals/');
+    });
+}
+
+function renderReferral(phoneNumber) {
+    return `
+        <li class="list-group-item">
+            <i class="fas fa-user me-2"></i>${phoneNumber}
+        </li>
+    `;
+}
+
+function loadReferrals(url) {
+    const button = $('#loadReferrals');
+    button.prop('disabled', true);
+    
+    $.ajax({
+        url: url,
+        method: 'GET',
+        success: function(page) {
+            const list = $('#referralList');
+            page.results.forEach(function(referral) {
+                list.append(renderReferral(referral.phone_number));
+            });
+            
+            if (page.next) {
+                button.html('<i class="fas fa-chevron-down me-2"></i>Показать ещё');
+                button.prop('disabled', false);
+                button.off('click').click(function() {
+                    loadReferrals(page.next);
+                });
+            } else {
+                button.remove();
+            }
+        },
+        error: function() {
+            button.prop('disabled', false);
+        }
+    });
 }
 
 function showMessage(container, type, message) {
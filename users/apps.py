@@ -6,4 +6,9 @@ logger = logging.getLogger(__name__)
 
 class UsersConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
-    name = 'users'
\ No newline at end of file
+    name = 'users'
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+        from .middleware import install_query_counter
+        connection_created.connect(install_query_counter, dispatch_uid='users.install_query_counter')
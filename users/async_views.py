@@ -0,0 +1,349 @@
+"""
+Асинхронные представления аутентификации и профиля для режима SERVER_MODE=asgi.
+Формат запросов и ответов совпадает с представлениями из views.py.
+"""
+import json
+import logging
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import IntegrityError
+from django.http import HttpResponse, HttpResponseNotModified
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+from rest_framework import status
+from .models import User, VerificationCode, CodeGenerationError, ReferralCycleError
+from .delivery import adeliver_code
+from .exceptions import RateLimitExceeded
+from .idempotency import aclaim_response, arun_idempotent, idempotency_key
+from .invite_cache import invalidate_invite_codes
+from .metrics import CODES_SENT, CODE_VERIFICATIONS, INVITE_ACTIVATIONS
+from .profile_cache import aget_profile, aprofile_version, aset_profile, etag_matches, profile_cache_headers, profile_etag
+from .ratelimit import acheck_send_code_rate
+from .renderers import dumps
+from .serializers import (
+    PhoneSerializer,
+    CodeSerializer,
+    ActivateInviteSerializer,
+    user_auth_data,
+    user_profile_data,
+)
+from .utils import create_error_response
+
+logger = logging.getLogger(__name__)
+
+
+def json_response(data, status_code=status.HTTP_200_OK, headers=None):
+    return HttpResponse(dumps(data), status=status_code, headers=headers, content_type='application/json')
+
+
+def parse_json_body(request):
+    """Тело запроса как словарь или None, если это не JSON-объект"""
+    try:
+        data = json.loads(request.body or b'{}')
+    except (ValueError, UnicodeDecodeError):
+        return None
+    return data if isinstance(data, dict) else None
+
+
+def validation_error_response(errors):
+    error_details = {}
+    for field, field_errors in errors.items():
+        error_details[field] = field_errors[0] if isinstance(field_errors, list) and field_errors else str(field_errors)
+
+    return create_error_response(
+        status.HTTP_400_BAD_REQUEST,
+        'Неверные данные запроса',
+        'VALIDATION_ERROR',
+        error_details
+    )
+
+
+def rate_limited_response(exc):
+    """Тот же ответ 429, что custom_exception_handler формирует для DRF-представлений"""
+    response = json_response(exc.get_error_data(), exc.status_code)
+    response['Retry-After'] = str(exc.wait)
+    return response
+
+
+def not_authenticated_response():
+    return create_error_response(
+        status.HTTP_401_UNAUTHORIZED,
+        'Необходима аутентификация',
+        'NOT_AUTHENTICATED'
+    )
+
+
+async def profile_data(user):
+    """Данные профиля: превью рефералов читается асинхронно"""
+    referrals = []
+    if user.referral_count:
+        referrals = [phone_number async for phone_number in user.referral_preview()]
+    return user_profile_data(user, referrals)
+
+
+@csrf_exempt
+@require_POST
+async def send_code(request):
+    """
+    Отправка кода верификации на номер телефона
+    """
+    data = parse_json_body(request)
+    if data is None:
+        return validation_error_response({'non_field_errors': ['Ожидается JSON-объект']})
+
+    serializer = PhoneSerializer(data=data)
+    if not serializer.is_valid():
+        logger.warning("Невалидные данные при отправке кода: %s", serializer.errors)
+        return validation_error_response(serializer.errors)
+
+    phone_number = serializer.validated_data['phone_number']
+    idempotency = idempotency_key(request, 'send_code', phone_number)
+    replay = await aclaim_response(idempotency)
+    if replay is not None:
+        logger.info("Повтор запроса кода для %s по ключу идемпотентности", phone_number)
+        return replay
+    return await arun_idempotent(idempotency, _send_code, request, phone_number)
+
+
+async def _send_code(request, phone_number):
+    """Выдача и доставка кода для проверенного номера"""
+    try:
+        await acheck_send_code_rate(request, phone_number)
+    except RateLimitExceeded as e:
+        logger.warning("Превышен лимит отправки кодов (%s) для %s", e.scope, phone_number)
+        return rate_limited_response(e)
+
+    verification_code = await VerificationCode.acreate_code(phone_number)
+    CODES_SENT.labels('reused' if verification_code.reused else 'created').inc()
+    logger.info(
+        "%s код верификации %s для номера %s",
+        "Повторно отправлен" if verification_code.reused else "Создан",
+        verification_code.code, phone_number
+    )
+
+    delivery = await adeliver_code(phone_number, verification_code.code)
+    logger.debug("Доставка кода для %s: %s", phone_number, delivery.status)
+
+    return json_response({
+        'message': 'Код успешно отправлен',
+        'phone_number': phone_number,
+        'code': verification_code.code,
+        'delivery_status': delivery.status
+    })
+
+
+@csrf_exempt
+@require_POST
+async def verify_code(request):
+    """
+    Верификация кода и создание/аутентификация пользователя
+    """
+    data = parse_json_body(request)
+    if data is None:
+        CODE_VERIFICATIONS.labels('VALIDATION_ERROR').inc()
+        return validation_error_response({'non_field_errors': ['Ожидается JSON-объект']})
+
+    serializer = CodeSerializer(data=data)
+    if not serializer.is_valid():
+        logger.warning("Невалидные данные при верификации кода: %s", serializer.errors)
+        CODE_VERIFICATIONS.labels('VALIDATION_ERROR').inc()
+        return validation_error_response(serializer.errors)
+
+    phone_number = serializer.validated_data['phone_number']
+    code = serializer.validated_data['code']
+
+    # Сырые DELETE ... RETURNING и upsert пользователя не имеют асинхронного API ORM
+    consumed = await sync_to_async(VerificationCode.consume)(phone_number, code)
+    if consumed is None:
+        logger.warning("Попытка использования неверного кода для %s", phone_number)
+        CODE_VERIFICATIONS.labels('INVALID_CODE').inc()
+        return create_error_response(
+            status.HTTP_400_BAD_REQUEST,
+            'Неверный код',
+            'INVALID_CODE'
+        )
+
+    if not consumed:
+        logger.warning("Попытка использования просроченного кода для %s", phone_number)
+        CODE_VERIFICATIONS.labels('CODE_EXPIRED').inc()
+        return create_error_response(
+            status.HTTP_400_BAD_REQUEST,
+            'Код истек',
+            'CODE_EXPIRED'
+        )
+
+    logger.info("Код верификации успешно использован для %s", phone_number)
+
+    try:
+        user, created = await sync_to_async(User.get_or_create_by_phone)(phone_number)
+        if created:
+            logger.info("Создан новый пользователь: %s", phone_number)
+        else:
+            logger.info("Аутентификация существующего пользователя: %s", phone_number)
+    except (IntegrityError, CodeGenerationError) as e:
+        logger.error("Ошибка создания пользователя %s: %s", phone_number, e)
+        CODE_VERIFICATIONS.labels('USER_CREATION_ERROR').inc()
+        return create_error_response(
+            status.HTTP_500_INTERNAL_SERVER_ERROR,
+            'Ошибка создания пользователя',
+            'USER_CREATION_ERROR',
+            {'error_details': str(e)}
+        )
+
+    await request.session.aset('user_id', user.id)
+    CODE_VERIFICATIONS.labels('success').inc()
+    logger.debug("Пользователь %s аутентифицирован, ID сохранен в сессии", user.id)
+
+    response_data = user_auth_data(user)
+    response_data['is_new_user'] = created
+    return json_response(response_data)
+
+
+@require_GET
+async def profile(request):
+    """
+    Получение профиля пользователя
+    """
+    user_id = await request.session.aget('user_id')
+    if not user_id:
+        logger.warning("Попытка доступа к профилю неаутентифицированного пользователя")
+        return not_authenticated_response()
+
+    etag = data = None
+    if settings.PROFILE_CACHE_SETTINGS['enabled']:
+        version = await aprofile_version(user_id)
+        etag = profile_etag(user_id, version)
+        if etag_matches(request, etag):
+            logger.debug("Профиль пользователя %s не изменился", user_id)
+            return HttpResponseNotModified(headers=profile_cache_headers(etag))
+        data = await aget_profile(user_id, version)
+
+    if data is None:
+        try:
+            user = await User.objects.aget(id=user_id)
+        except User.DoesNotExist:
+            logger.error("Пользователь с ID %s не найден", user_id)
+            return create_error_response(
+                status.HTTP_404_NOT_FOUND,
+                'Пользователь не найден',
+                'USER_NOT_FOUND'
+            )
+        logger.debug("Получен профиль пользователя %s", user_id)
+        data = await profile_data(user)
+        if etag:
+            await aset_profile(user_id, version, data)
+
+    return json_response(data, headers=profile_cache_headers(etag))
+
+
+@csrf_exempt
+@require_POST
+async def activate_invite(request):
+    """
+    Активация инвайт-кода
+    """
+    user_id = await request.session.aget('user_id')
+    if not user_id:
+        logger.warning("Попытка активации инвайт-кода неаутентифицированным пользователем")
+        INVITE_ACTIVATIONS.labels('NOT_AUTHENTICATED').inc()
+        return not_authenticated_response()
+
+    idempotency = idempotency_key(request, 'activate_invite', user_id)
+    replay = await aclaim_response(idempotency)
+    if replay is not None:
+        logger.info("Повтор активации инвайт-кода пользователем %s по ключу идемпотентности", user_id)
+        return replay
+    return await arun_idempotent(idempotency, _activate_invite, request, user_id)
+
+
+async def _activate_invite(request, user_id):
+    """Активация инвайт-кода аутентифицированным пользователем"""
+    try:
+        user = await User.objects.aget(id=user_id)
+        logger.debug("Пользователь %s инициировал активацию инвайт-кода", user_id)
+    except User.DoesNotExist:
+        logger.error("Пользователь с ID %s не найден при активации инвайт-кода", user_id)
+        INVITE_ACTIVATIONS.labels('USER_NOT_FOUND').inc()
+        return create_error_response(
+            status.HTTP_404_NOT_FOUND,
+            'Пользователь не найден',
+            'USER_NOT_FOUND'
+        )
+
+    if user.activated_invite_code:
+        logger.warning("Пользователь %s пытается активировать второй инвайт-код", user_id)
+        INVITE_ACTIVATIONS.labels('INVITE_ALREADY_ACTIVATED').inc()
+        return create_error_response(
+            status.HTTP_400_BAD_REQUEST,
+            'Инвайт-код уже активирован',
+            'INVITE_ALREADY_ACTIVATED'
+        )
+
+    data = parse_json_body(request)
+    if data is None:
+        INVITE_ACTIVATIONS.labels('VALIDATION_ERROR').inc()
+        return validation_error_response({'non_field_errors': ['Ожидается JSON-объект']})
+
+    serializer = ActivateInviteSerializer(data=data)
+    if not serializer.is_valid():
+        logger.warning("Невалидные данные при активации инвайт-кода: %s", serializer.errors)
+        INVITE_ACTIVATIONS.labels('VALIDATION_ERROR').inc()
+        return validation_error_response(serializer.errors)
+
+    invite_code = serializer.validated_data['invite_code']
+
+    inviter_id = await User.ainviter_id_by_code(invite_code)
+    if inviter_id is None:
+        logger.warning("Попытка активации несуществующего инвайт-кода: %s", invite_code)
+        INVITE_ACTIVATIONS.labels('INVALID_INVITE_CODE').inc()
+        return create_error_response(
+            status.HTTP_400_BAD_REQUEST,
+            'Неверный инвайт-код',
+            'INVALID_INVITE_CODE'
+        )
+
+    if inviter_id == user.id:
+        logger.warning("Пользователь %s пытается использовать свой собственный инвайт-код", user_id)
+        INVITE_ACTIVATIONS.labels('SELF_INVITE_NOT_ALLOWED').inc()
+        return create_error_response(
+            status.HTTP_400_BAD_REQUEST,
+            'Нельзя использовать свой собственный инвайт-код',
+            'SELF_INVITE_NOT_ALLOWED'
+        )
+
+    # Пригласивший известен по id и коду, activate_invite сверяет код под блокировкой строки
+    invited_user = User(id=inviter_id, invite_code=invite_code)
+    # Условный UPDATE и счетчик реферера выполняются в одной транзакции,
+    # а транзакции в асинхронном контексте Django не поддерживаются
+    try:
+        activated = await sync_to_async(user.activate_invite)(invited_user)
+    except ReferralCycleError:
+        logger.warning("Пользователь %s пытается активировать код из своего дерева рефералов: %s", user_id, invite_code)
+        INVITE_ACTIVATIONS.labels('REFERRAL_CYCLE_NOT_ALLOWED').inc()
+        return create_error_response(
+            status.HTTP_400_BAD_REQUEST,
+            'Нельзя использовать инвайт-код своего реферала',
+            'REFERRAL_CYCLE_NOT_ALLOWED'
+        )
+    except User.DoesNotExist:
+        # Запись кеша устарела: код удален или сменился
+        invalidate_invite_codes([invite_code])
+        logger.warning("Инвайт-код %s больше не принадлежит пользователю %s", invite_code, inviter_id)
+        INVITE_ACTIVATIONS.labels('INVALID_INVITE_CODE').inc()
+        return create_error_response(
+            status.HTTP_400_BAD_REQUEST,
+            'Неверный инвайт-код',
+            'INVALID_INVITE_CODE'
+        )
+    if not activated:
+        logger.warning("Пользователь %s пытается активировать второй инвайт-код", user_id)
+        INVITE_ACTIVATIONS.labels('INVITE_ALREADY_ACTIVATED').inc()
+        return create_error_response(
+            status.HTTP_400_BAD_REQUEST,
+            'Инвайт-код уже активирован',
+            'INVITE_ALREADY_ACTIVATED'
+        )
+    logger.info("Пользователь %s успешно активировал инвайт-код %s", user_id, invite_code)
+    INVITE_ACTIVATIONS.labels('success').inc()
+
+    return json_response(await profile_data(user))
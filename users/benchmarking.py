@@ -0,0 +1,46 @@
+import time
+import math
+from concurrent.futures import ThreadPoolExecutor
+from django.db import connections
+
+
+def percentile(values, pct):
+    """Возвращает перцентиль pct (0-100) для списка значений"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, math.ceil(pct / 100 * len(ordered)) - 1)
+    return ordered[index]
+
+
+def summarize(latencies, elapsed):
+    """Сводная статистика по задержкам (в миллисекундах) и пропускной способности"""
+    count = len(latencies)
+    return {
+        'requests': count,
+        'elapsed_s': round(elapsed, 3),
+        'rps': round(count / elapsed, 2) if elapsed else 0.0,
+        'mean_ms': round(sum(latencies) / count * 1000, 3) if count else 0.0,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+    }
+
+
+def run_concurrently(func, count, concurrency):
+    """
+    Вызывает func(i) count раз в concurrency потоках.
+    Возвращает список длительностей вызовов и общее время.
+    """
+    def timed(i):
+        start = time.perf_counter()
+        try:
+            func(i)
+            return time.perf_counter() - start
+        finally:
+            connections.close_all()
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        latencies = list(executor.map(timed, range(count)))
+    return latencies, time.perf_counter() - started
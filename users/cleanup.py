@@ -0,0 +1,68 @@
+import time
+from dataclasses import dataclass
+from django.conf import settings
+from django.db import connection
+
+
+@dataclass
+class CleanupResult:
+    """Итог пакетного удаления"""
+    deleted: int = 0
+    batches: int = 0
+    elapsed: float = 0.0
+    complete: bool = True
+
+    @property
+    def rows_per_second(self):
+        return self.deleted / self.elapsed if self.elapsed else 0.0
+
+
+def delete_in_batches(model, where, params, order_by, batch_size=None, time_budget=None,
+                      max_batches_per_second=None):
+    """
+    Удаляет строки model, подходящие под условие where, пачками по batch_size
+    сырым DELETE по первичному ключу - без выборки строк в Python и сигналов ORM.
+    Каждая пачка выполняется отдельным коротким запросом, поэтому блокировки
+    не держатся долго. Удаление останавливается по исчерпании строк или
+    time_budget (секунды), частота пачек ограничивается max_batches_per_second.
+    """
+    cleanup_settings = settings.CLEANUP_SETTINGS
+    if batch_size is None:
+        batch_size = cleanup_settings['batch_size']
+    if time_budget is None:
+        time_budget = cleanup_settings['time_budget_seconds']
+    if max_batches_per_second is None:
+        max_batches_per_second = cleanup_settings['max_batches_per_second']
+
+    qn = connection.ops.quote_name
+    table = qn(model._meta.db_table)
+    pk = qn(model._meta.pk.column)
+    sql = (
+        f"DELETE FROM {table} WHERE {pk} IN ("
+        f"SELECT {pk} FROM {table} WHERE {where} ORDER BY {order_by} LIMIT %s)"
+    )
+
+    result = CleanupResult()
+    started = time.monotonic()
+    min_batch_interval = 1 / max_batches_per_second if max_batches_per_second else 0
+
+    while True:
+        batch_started = time.monotonic()
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [*params, batch_size])
+            deleted = cursor.rowcount
+        result.deleted += deleted
+        result.batches += 1
+
+        if deleted < batch_size:
+            break
+        if time_budget and time.monotonic() - started >= time_budget:
+            result.complete = False
+            break
+
+        pause = min_batch_interval - (time.monotonic() - batch_started)
+        if pause > 0:
+            time.sleep(pause)
+
+    result.elapsed = time.monotonic() - started
+    return result
@@ -0,0 +1,79 @@
+import os
+import time
+import logging
+from django.conf import settings
+from django.db import connections, DatabaseError
+
+logger = logging.getLogger(__name__)
+
+
+def get_pool(using='default'):
+    """Пул соединений psycopg 3 или None, если пул не настроен"""
+    connection = connections[using]
+    return getattr(connection, 'pool', None)
+
+
+def warm_up_connections(using='default'):
+    """
+    Открывает соединение с БД при старте воркера, чтобы первый запрос
+    не платил за TCP-соединение и аутентификацию. В режиме пула дожидается
+    открытия min_size соединений и возвращает соединение в пул.
+    """
+    if not settings.DATABASE_SETTINGS['warmup']:
+        return
+
+    connection = connections[using]
+    started = time.monotonic()
+    try:
+        connection.ensure_connection()
+        pool = get_pool(using)
+        if pool is not None:
+            pool.wait(timeout=settings.DATABASE_SETTINGS['pool_timeout'])
+    except Exception as e:
+        # Прогрев необязателен: при недоступной БД соединение откроется в первом запросе
+        logger.warning("Не удалось прогреть соединения с БД %s: %s", using, e)
+        return
+    finally:
+        # Соединение пула или непостоянное соединение не должно оставаться за потоком старта
+        if get_pool(using) is not None or not connection.settings_dict['CONN_MAX_AGE']:
+            connection.close()
+
+    logger.info(
+        "Соединения с БД %s прогреты за %.1f мс (процесс %s)",
+        using, (time.monotonic() - started) * 1000, os.getpid()
+    )
+
+
+def database_status(using='default'):
+    """Режим соединений, задержка SELECT 1 и статистика пула текущего процесса"""
+    connection = connections[using]
+    database_settings = settings.DATABASE_SETTINGS
+    pool = get_pool(using)
+
+    status = {
+        'pid': os.getpid(),
+        'vendor': connection.vendor,
+        'connection_mode': 'pool' if pool is not None else 'persistent',
+        'conn_max_age': connection.settings_dict['CONN_MAX_AGE'],
+        'health_checks': connection.settings_dict['CONN_HEALTH_CHECKS'],
+        'reused_connection': connection.connection is not None,
+    }
+
+    started = time.monotonic()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+            cursor.fetchone()
+        status['healthy'] = True
+    except DatabaseError as e:
+        status['healthy'] = False
+        status['error'] = str(e)
+    status['latency_ms'] = round((time.monotonic() - started) * 1000, 3)
+
+    if pool is not None:
+        status['pool'] = {
+            'min_size': database_settings['pool_min_size'],
+            'max_size': database_settings['pool_max_size'],
+            **pool.get_stats(),
+        }
+    return status
@@ -0,0 +1,255 @@
+import random
+import time
+import asyncio
+import logging
+from datetime import timedelta
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from .exceptions import CodeDeliveryError
+from .models import CodeDelivery
+
+logger = logging.getLogger(__name__)
+
+
+class BaseCodeSender:
+    """Базовый интерфейс провайдера доставки кодов верификации"""
+
+    def send(self, phone_number, message):
+        """Отправляет одно сообщение, при ошибке выбрасывает CodeDeliveryError"""
+        raise NotImplementedError
+
+    async def asend(self, phone_number, message):
+        """
+        Асинхронная отправка одного сообщения. По умолчанию выполняет send
+        в пуле потоков, провайдеры с асинхронным клиентом переопределяют ее.
+        """
+        await sync_to_async(self.send, thread_sensitive=False)(phone_number, message)
+
+    def send_batch(self, messages):
+        """
+        Отправляет пачку сообщений [(phone_number, message), ...].
+        Возвращает список ошибок той же длины (None - сообщение отправлено).
+        """
+        errors = []
+        for phone_number, message in messages:
+            try:
+                self.send(phone_number, message)
+                errors.append(None)
+            except CodeDeliveryError as e:
+                errors.append(str(e))
+        return errors
+
+
+class FakeCodeSender(BaseCodeSender):
+    """Локальный провайдер, имитирующий задержку SMS-шлюза"""
+
+    def __init__(self, min_latency=1.0, max_latency=2.0, failure_rate=0.0):
+        self.min_latency = min_latency
+        self.max_latency = max_latency
+        self.failure_rate = failure_rate
+
+    def _simulate_latency(self):
+        delay = random.uniform(self.min_latency, self.max_latency)
+        time.sleep(delay)
+        return delay
+
+    async def _asimulate_latency(self):
+        delay = random.uniform(self.min_latency, self.max_latency)
+        await asyncio.sleep(delay)
+        return delay
+
+    def _simulate_failure(self, phone_number):
+        if self.failure_rate and random.random() < self.failure_rate:
+            raise CodeDeliveryError(f"Шлюз отклонил сообщение для {phone_number}")
+
+    def send(self, phone_number, message):
+        delay = self._simulate_latency()
+        self._simulate_failure(phone_number)
+        logger.debug("Сообщение для %s отправлено за %.2f секунд", phone_number, delay)
+
+    async def asend(self, phone_number, message):
+        delay = await self._asimulate_latency()
+        self._simulate_failure(phone_number)
+        logger.debug("Сообщение для %s отправлено за %.2f секунд", phone_number, delay)
+
+    def send_batch(self, messages):
+        delay = self._simulate_latency()
+        errors = []
+        for phone_number, message in messages:
+            try:
+                self._simulate_failure(phone_number)
+                errors.append(None)
+            except CodeDeliveryError as e:
+                errors.append(str(e))
+        logger.debug("Пачка из %s сообщений отправлена за %.2f секунд", len(messages), delay)
+        return errors
+
+
+_sender = None
+
+
+def get_code_sender():
+    """Возвращает провайдера доставки, настроенного в CODE_DELIVERY_SETTINGS"""
+    global _sender
+    if _sender is None:
+        delivery_settings = settings.CODE_DELIVERY_SETTINGS
+        sender_class = import_string(delivery_settings['sender'])
+        _sender = sender_class(**delivery_settings.get('sender_options', {}))
+    return _sender
+
+
+def render_code_message(code):
+    """Формирует текст сообщения с кодом верификации"""
+    return f"Ваш код подтверждения: {code}"
+
+
+def deliver_code(phone_number, code, sender=None):
+    """
+    Доставляет код верификации. В режиме 'outbox' только ставит сообщение
+    в очередь, в режиме 'sync' отправляет его прямо в текущем запросе.
+    """
+    if settings.CODE_DELIVERY_SETTINGS['mode'] != 'sync':
+        return CodeDelivery.objects.create(phone_number=phone_number, code=code)
+
+    sender = sender or get_code_sender()
+    delivery = CodeDelivery(phone_number=phone_number, code=code, attempts=1)
+    try:
+        sender.send(phone_number, render_code_message(code))
+        _mark_sent(delivery)
+    except CodeDeliveryError as e:
+        _mark_failed(delivery, e)
+    delivery.save()
+    return delivery
+
+
+async def adeliver_code(phone_number, code, sender=None):
+    """
+    Асинхронный вариант deliver_code: в режиме 'sync' ожидание шлюза
+    не занимает ни поток, ни воркер.
+    """
+    if settings.CODE_DELIVERY_SETTINGS['mode'] != 'sync':
+        return await CodeDelivery.objects.acreate(phone_number=phone_number, code=code)
+
+    sender = sender or get_code_sender()
+    delivery = CodeDelivery(phone_number=phone_number, code=code, attempts=1)
+    try:
+        await sender.asend(phone_number, render_code_message(code))
+        _mark_sent(delivery)
+    except CodeDeliveryError as e:
+        _mark_failed(delivery, e)
+    await delivery.asave()
+    return delivery
+
+
+def _mark_sent(delivery):
+    delivery.status = CodeDelivery.STATUS_SENT
+    delivery.sent_at = timezone.now()
+
+
+def _mark_failed(delivery, error):
+    logger.error("Ошибка отправки кода на %s: %s", delivery.phone_number, error)
+    delivery.status = CodeDelivery.STATUS_FAILED
+    delivery.last_error = str(error)[:255]
+
+
+class CodeDispatcher:
+    """
+    Фоновый диспетчер, отправляющий сообщения из outbox пачками. Пачка
+    забирается короткой транзакцией (статус 'sending', попытка засчитана),
+    отправляется вне транзакции и без блокировок, а результат записывается
+    второй короткой транзакцией. Сообщения диспетчера, упавшего во время
+    отправки, забираются снова через claim_timeout_seconds.
+    """
+
+    def __init__(self, sender=None, batch_size=None, max_attempts=None, claim_timeout=None):
+        delivery_settings = settings.CODE_DELIVERY_SETTINGS
+        self.sender = sender or get_code_sender()
+        self.batch_size = batch_size or delivery_settings['batch_size']
+        self.max_attempts = max_attempts or delivery_settings['max_attempts']
+        self.claim_timeout = claim_timeout or delivery_settings['claim_timeout_seconds']
+
+    def claim_batch(self):
+        """Забирает на отправку пачку ожидающих и брошенных сообщений"""
+        now = timezone.now()
+        stale = Q(status=CodeDelivery.STATUS_SENDING, claimed_at__lt=now - timedelta(seconds=self.claim_timeout))
+        with transaction.atomic():
+            abandoned = CodeDelivery.objects.filter(stale, attempts__gte=self.max_attempts).update(
+                status=CodeDelivery.STATUS_FAILED,
+                last_error='Нет результата отправки',
+            )
+            if abandoned:
+                logger.warning("%s сообщений без результата отправки помечены как неотправленные", abandoned)
+
+            deliveries = list(
+                CodeDelivery.objects
+                .select_for_update(skip_locked=True)
+                .filter(Q(status=CodeDelivery.STATUS_PENDING) | stale)
+                .order_by('id')[:self.batch_size]
+            )
+            if deliveries:
+                CodeDelivery.objects.filter(id__in=[delivery.id for delivery in deliveries]).update(
+                    status=CodeDelivery.STATUS_SENDING,
+                    claimed_at=now,
+                    attempts=F('attempts') + 1,
+                )
+        for delivery in deliveries:
+            delivery.status = CodeDelivery.STATUS_SENDING
+            delivery.claimed_at = now
+            delivery.attempts += 1
+        return deliveries
+
+    def record_results(self, deliveries, errors):
+        """Записывает результат отправки пачки"""
+        sent_ids = [d.id for d, error in zip(deliveries, errors) if error is None]
+        failed = [(d, error) for d, error in zip(deliveries, errors) if error is not None]
+
+        for delivery, error in failed:
+            delivery.last_error = error[:255]
+            if delivery.attempts >= self.max_attempts:
+                delivery.status = CodeDelivery.STATUS_FAILED
+            else:
+                delivery.status = CodeDelivery.STATUS_PENDING
+
+        with transaction.atomic():
+            if sent_ids:
+                CodeDelivery.objects.filter(id__in=sent_ids).update(
+                    status=CodeDelivery.STATUS_SENT,
+                    sent_at=timezone.now(),
+                )
+            if failed:
+                CodeDelivery.objects.bulk_update(
+                    [delivery for delivery, _ in failed],
+                    ['last_error', 'status'],
+                )
+        if failed:
+            logger.warning("Не удалось отправить %s из %s сообщений", len(failed), len(deliveries))
+
+    def dispatch_batch(self):
+        """Отправляет одну пачку ожидающих сообщений, возвращает их количество"""
+        deliveries = self.claim_batch()
+        if not deliveries:
+            return 0
+
+        errors = self.sender.send_batch([
+            (delivery.phone_number, render_code_message(delivery.code))
+            for delivery in deliveries
+        ])
+        self.record_results(deliveries, errors)
+        return len(deliveries)
+
+    def run_pending(self, max_batches=None):
+        """Отправляет ожидающие сообщения, пока очередь не опустеет"""
+        if max_batches is None:
+            max_batches = settings.CODE_DELIVERY_SETTINGS['max_batches_per_run']
+
+        total = 0
+        for _ in range(max_batches):
+            processed = self.dispatch_batch()
+            total += processed
+            if processed < self.batch_size:
+                break
+        return total
@@ -1,14 +1,44 @@
 from rest_framework.views import exception_handler
 from rest_framework.response import Response
+from rest_framework.exceptions import Throttled
 from rest_framework import status
+from .utils import build_error_data
 
 class CodeGenerationError(Exception):
     """Custom exception for code generation errors"""
     pass
 
+class CodeDeliveryError(Exception):
+    """Custom exception for code delivery errors"""
+    pass
+
+class ReferralCycleError(Exception):
+    """Активация инвайт-кода замкнула бы цепочку рефералов в цикл"""
+    pass
+
+class RateLimitExceeded(Throttled):
+    """Превышен лимит частоты запросов (429, заголовок Retry-After выставляет DRF)"""
+    default_detail = 'Слишком много запросов, повторите позже'
+    default_code = 'RATE_LIMITED'
+
+    def __init__(self, scope, wait):
+        super().__init__(wait=wait, detail=self.default_detail)
+        self.scope = scope
+
+    def get_error_data(self):
+        return build_error_data(
+            self.default_detail,
+            self.default_code,
+            {'scope': self.scope, 'retry_after': self.wait}
+        )
+
 def custom_exception_handler(exc, context):
     response = exception_handler(exc, context)
 
+    if isinstance(exc, RateLimitExceeded):
+        response.data = exc.get_error_data()
+        return response
+
     if isinstance(exc, CodeGenerationError):
         return Response(
             {'error': str(exc)},
@@ -0,0 +1,263 @@
+import time
+import hashlib
+import threading
+from datetime import timedelta
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import IntegrityError, transaction
+from django.dispatch import receiver
+from django.http import HttpResponse
+from django.utils import timezone
+from rest_framework import status
+from .models import IdempotencyRecord
+from .renderers import dumps
+from .utils import create_error_response
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+# Статус записи, зарезервированной выполняющимся запросом
+PENDING = 0
+
+
+class MemoryIdempotencyStore:
+    """
+    Ответы в памяти процесса: без обращений к БД, но повтор, попавший
+    на другой воркер, выполняется заново
+    """
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._responses = {}
+        self._lock = threading.Lock()
+
+    def claim(self, key, ttl):
+        """
+        (статус, тело) действующей записи ключа или None, если ключа не было
+        и он зарезервирован за вызывающим (запись со статусом PENDING)
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._responses.get(key)
+            if entry is not None and entry[2] > now:
+                return entry[0], entry[1]
+            self._responses[key] = (PENDING, b'', now + ttl)
+            if len(self._responses) > self.max_keys:
+                self._prune(now)
+        return None
+
+    async def aclaim(self, key, ttl):
+        return self.claim(key, ttl)
+
+    def complete(self, key, status_code, content, ttl):
+        """Сохраняет ответ в зарезервированную запись"""
+        with self._lock:
+            self._responses[key] = (status_code, content, time.monotonic() + ttl)
+
+    async def acomplete(self, key, status_code, content, ttl):
+        self.complete(key, status_code, content, ttl)
+
+    def release(self, key):
+        """Снимает резервирование: повтор выполнится заново"""
+        with self._lock:
+            entry = self._responses.get(key)
+            if entry is not None and entry[0] == PENDING:
+                del self._responses[key]
+
+    async def arelease(self, key):
+        self.release(key)
+
+    def _prune(self, now):
+        # Просроченные ответы удаляются, только когда ключей стало больше max_keys
+        self._responses = {key: entry for key, entry in self._responses.items() if entry[2] > now}
+
+
+class DatabaseIdempotencyStore:
+    """
+    Ответы в таблице IdempotencyRecord, общие для всех воркеров: повтор
+    обходится одним SELECT по уникальному индексу. Ключ резервируется
+    вставкой строки со статусом PENDING, уникальный индекс пропускает
+    только один из параллельных запросов. Просроченные строки удаляет
+    задача планировщика.
+    """
+
+    @staticmethod
+    def _stored(key, now):
+        return (
+            IdempotencyRecord.objects
+            .filter(key=key, expires_at__gt=now)
+            .values_list('status', 'content')
+        )
+
+    def claim(self, key, ttl):
+        now = timezone.now()
+        stored = self._stored(key, now).first()
+        if stored is not None:
+            return stored[0], bytes(stored[1])
+        return self._reserve(key, now, ttl)
+
+    async def aclaim(self, key, ttl):
+        now = timezone.now()
+        stored = await self._stored(key, now).afirst()
+        if stored is not None:
+            return stored[0], bytes(stored[1])
+        # Вставка с перехватом IntegrityError требует транзакции, в асинхронном контексте ее нет
+        return await sync_to_async(self._reserve)(key, now, ttl)
+
+    def _reserve(self, key, now, ttl):
+        expires_at = now + timedelta(seconds=ttl)
+        try:
+            with transaction.atomic():
+                IdempotencyRecord.objects.create(key=key, status=PENDING, content=b'', expires_at=expires_at)
+            return None
+        except IntegrityError:
+            pass
+        # Ключ занят параллельным запросом или просроченной строкой, которую еще не удалил планировщик
+        if IdempotencyRecord.objects.filter(key=key, expires_at__lte=now).update(
+            status=PENDING, content=b'', expires_at=expires_at
+        ):
+            return None
+        stored = self._stored(key, now).first()
+        return (PENDING, b'') if stored is None else (stored[0], bytes(stored[1]))
+
+    def complete(self, key, status_code, content, ttl):
+        IdempotencyRecord.objects.filter(key=key).update(
+            status=status_code, content=content, expires_at=timezone.now() + timedelta(seconds=ttl)
+        )
+
+    async def acomplete(self, key, status_code, content, ttl):
+        await IdempotencyRecord.objects.filter(key=key).aupdate(
+            status=status_code, content=content, expires_at=timezone.now() + timedelta(seconds=ttl)
+        )
+
+    def release(self, key):
+        IdempotencyRecord.objects.filter(key=key, status=PENDING).delete()
+
+    async def arelease(self, key):
+        await IdempotencyRecord.objects.filter(key=key, status=PENDING).adelete()
+
+
+_store = None
+
+
+def get_idempotency_store():
+    """Хранилище ответов, настроенное в IDEMPOTENCY_SETTINGS"""
+    global _store
+    if _store is None:
+        idempotency_settings = settings.IDEMPOTENCY_SETTINGS
+        if idempotency_settings['backend'] == 'memory':
+            _store = MemoryIdempotencyStore(idempotency_settings['max_keys'])
+        else:
+            _store = DatabaseIdempotencyStore()
+    return _store
+
+
+@receiver(setting_changed)
+def reset_idempotency_store(setting, **kwargs):
+    global _store
+    if setting == 'IDEMPOTENCY_SETTINGS':
+        _store = None
+
+
+def idempotency_key(request, endpoint, scope):
+    """
+    Ключ хранилища для запроса с заголовком Idempotency-Key или None.
+    Ключ привязан к эндпоинту и номеру телефона или пользователю: чужой
+    или повторно использованный для другого номера заголовок не совпадет.
+    """
+    if not settings.IDEMPOTENCY_SETTINGS['enabled']:
+        return None
+    value = request.headers.get(IDEMPOTENCY_HEADER, '').strip()
+    if not value:
+        return None
+    return hashlib.sha256(f'{endpoint}:{scope}:{value}'.encode()).hexdigest()
+
+
+def response_ttl():
+    """
+    Срок хранения ответа: не дольше жизни кода верификации, иначе повтор
+    send-code вернул бы уже просроченный код
+    """
+    return min(
+        settings.IDEMPOTENCY_SETTINGS['ttl_seconds'],
+        settings.VERIFICATION_CODE_SETTINGS['expiration_minutes'] * 60,
+    )
+
+
+def _claimed(stored):
+    if stored is None:
+        return None
+    status_code, content = stored
+    if status_code == PENDING:
+        response = create_error_response(
+            status.HTTP_409_CONFLICT,
+            'Запрос с этим ключом идемпотентности еще выполняется',
+            'IDEMPOTENCY_KEY_IN_USE'
+        )
+        response['Retry-After'] = '1'
+        return response
+    return HttpResponse(
+        content, status=status_code, content_type='application/json', headers={REPLAYED_HEADER: 'true'}
+    )
+
+
+def claim_response(key):
+    """
+    Резервирует ключ за запросом до выполнения обработчика. Возвращает
+    сохраненный ответ (то же тело байт в байт), 409, если запрос с тем же
+    ключом еще выполняется, или None: ключ зарезервирован либо не передан.
+    Резервирование живет pending_ttl_seconds: ключ воркера, упавшего до
+    сохранения ответа, освобождается без ожидания срока хранения ответа.
+    """
+    if key is None:
+        return None
+    return _claimed(get_idempotency_store().claim(key, settings.IDEMPOTENCY_SETTINGS['pending_ttl_seconds']))
+
+
+async def aclaim_response(key):
+    if key is None:
+        return None
+    return _claimed(await get_idempotency_store().aclaim(key, settings.IDEMPOTENCY_SETTINGS['pending_ttl_seconds']))
+
+
+def _content(response):
+    # Response DRF еще не отрендерен: тело кодируется тем же dumps, что и у FastJSONRenderer
+    data = getattr(response, 'data', None)
+    return response.content if data is None else dumps(data)
+
+
+def run_idempotent(key, handler, *args):
+    """
+    Выполняет handler(*args) под ключом, зарезервированным claim_response.
+    Для повторов сохраняется только успешный ответ; после ошибки или
+    исключения резервирование снимается и повтор выполнится заново.
+    """
+    if key is None:
+        return handler(*args)
+    store = get_idempotency_store()
+    try:
+        response = handler(*args)
+    except BaseException:
+        store.release(key)
+        raise
+    if response.status_code == status.HTTP_200_OK:
+        store.complete(key, response.status_code, _content(response), response_ttl())
+    else:
+        store.release(key)
+    return response
+
+
+async def arun_idempotent(key, handler, *args):
+    if key is None:
+        return await handler(*args)
+    store = get_idempotency_store()
+    try:
+        response = await handler(*args)
+    except BaseException:
+        await store.arelease(key)
+        raise
+    if response.status_code == status.HTTP_200_OK:
+        await store.acomplete(key, response.status_code, _content(response), response_ttl())
+    else:
+        await store.arelease(key)
+    return response
@@ -0,0 +1,215 @@
+import io
+import csv
+import json
+from dataclasses import dataclass, field
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+from django.db.models import Count, Exists, F, OuterRef, Subquery
+from django.utils import timezone
+from .invite_codes import normalize_invite_code
+from .models import User
+from .phone import validate_phone_number, phone_number_key
+
+IMPORT_COLUMNS = ['phone_number', 'phone_key', 'invite_code', 'activated_invite_code']
+STAGING_TABLE = 'referral_users_import'
+
+
+@dataclass
+class ImportBatchResult:
+    """Итог загрузки одной пачки записей"""
+    inserted: int = 0
+    skipped: int = 0
+    errors: list = field(default_factory=list)
+
+
+def read_records(stream, file_format):
+    """Построчно читает записи CSV (с заголовком) или JSONL, не загружая файл целиком"""
+    if file_format == 'jsonl':
+        for line in stream:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                record = None
+            yield record if isinstance(record, dict) else {}
+    else:
+        yield from csv.DictReader(stream)
+
+
+def _clean_code(value):
+    value = normalize_invite_code(value or '')
+    if len(value) > User._meta.get_field('invite_code').max_length:
+        raise ValidationError(f"Инвайт-код {value} слишком длинный")
+    return value or None
+
+
+def prepare_users(records, first_number):
+    """
+    Проверяет пачку записей и строит несохраненных пользователей.
+    Возвращает пары (номер записи, пользователь) и ошибки вида
+    (номер записи, сообщение).
+    """
+    users = {}
+    errors = []
+    for number, record in enumerate(records, first_number):
+        try:
+            phone_number = validate_phone_number((record.get('phone_number') or '').strip())
+            user = User(
+                phone_number=phone_number,
+                phone_key=phone_number_key(phone_number),
+                invite_code=_clean_code(record.get('invite_code')),
+                activated_invite_code=_clean_code(record.get('activated_invite_code')),
+            )
+        except ValidationError as e:
+            errors.append((number, e.messages[0]))
+            continue
+        if phone_number in users:
+            errors.append((number, f"Номер {phone_number} повторяется в файле"))
+            continue
+        users[phone_number] = (number, user)
+    return list(users.values()), errors
+
+
+def _exclude_existing(users, result):
+    """Отбрасывает уже существующие номера и переданные инвайт-коды, занятые другими номерами"""
+    existing_keys = set(
+        User.objects.filter(phone_key__in=[user.phone_key for _, user in users])
+        .values_list('phone_key', flat=True)
+    )
+    taken_codes = set(
+        User.objects.filter(invite_code__in=[user.invite_code for _, user in users if user.invite_code])
+        .values_list('invite_code', flat=True)
+    )
+    fresh = []
+    for number, user in users:
+        if user.phone_key in existing_keys:
+            result.skipped += 1
+        elif user.invite_code in taken_codes:
+            result.errors.append((number, f"Инвайт-код {user.invite_code} уже занят другим номером"))
+        else:
+            fresh.append(user)
+    return fresh
+
+
+def _assign_invite_codes(users):
+    """Выдает коды одной пачкой, не повторяя коды, переданные в самом файле"""
+    provided = {user.invite_code for user in users if user.invite_code}
+    pending = [user for user in users if not user.invite_code]
+    while pending:
+        codes = User.generate_invite_codes(len(pending))
+        for user, code in zip(pending, codes):
+            if code not in provided:
+                user.invite_code = code
+                provided.add(code)
+        pending = [user for user in pending if not user.invite_code]
+
+
+def _copy_rows(cursor, sql, rows):
+    """COPY ... FROM STDIN для psycopg2 и psycopg 3"""
+    raw_cursor = cursor.cursor
+    if hasattr(raw_cursor, 'copy_expert'):
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        buffer.seek(0)
+        raw_cursor.copy_expert(f"{sql} WITH (FORMAT csv)", buffer)
+    else:
+        with raw_cursor.copy(sql) as copy:
+            for row in rows:
+                copy.write_row(row)
+
+
+def _insert_with_copy(users, created_at):
+    """
+    Загружает пачку через COPY во временную таблицу и переносит ее
+    одним INSERT ... SELECT ... ON CONFLICT DO NOTHING.
+    """
+    qn = connection.ops.quote_name
+    table = qn(User._meta.db_table)
+    staging = qn(STAGING_TABLE)
+    columns = ', '.join(qn(column) for column in IMPORT_COLUMNS)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"CREATE TEMPORARY TABLE IF NOT EXISTS {staging} ("
+            f"{qn('phone_number')} varchar(15), {qn('phone_key')} bigint, {qn('invite_code')} varchar(10), "
+            f"{qn('activated_invite_code')} varchar(10)) ON COMMIT DELETE ROWS"
+        )
+        _copy_rows(
+            cursor,
+            f"COPY {staging} ({columns}) FROM STDIN",
+            ([getattr(user, column) for column in IMPORT_COLUMNS] for user in users),
+        )
+        cursor.execute(
+            f"INSERT INTO {table} ({columns}, {qn('referral_count')}, {qn('created_at')}) "
+            f"SELECT {columns}, 0, %s FROM {staging} ON CONFLICT DO NOTHING",
+            [created_at]
+        )
+        return cursor.rowcount
+
+
+def _insert_with_bulk_create(users, batch_size):
+    """
+    Загружает пачку через bulk_create с пропуском конфликтов и возвращает
+    число записанных строк: bulk_create его не сообщает, поэтому строки
+    перечитываются по phone_key. Своей считается строка с выданным здесь
+    инвайт-кодом, номер, параллельно добавленный другим процессом, - нет.
+    """
+    User.objects.bulk_create(users, batch_size=batch_size, ignore_conflicts=True)
+    written = set(
+        User.objects.filter(phone_key__in=[user.phone_key for user in users])
+        .values_list('phone_key', 'invite_code')
+    )
+    return sum((user.phone_key, user.invite_code) in written for user in users)
+
+
+def import_batch(records, first_number, method='auto', bulk_batch_size=1000):
+    """
+    Проверяет и загружает пачку записей в одной транзакции.
+    method: 'copy' (только PostgreSQL), 'bulk' (bulk_create) или 'auto'.
+    """
+    if method == 'auto':
+        method = 'copy' if connection.vendor == 'postgresql' else 'bulk'
+
+    users, errors = prepare_users(records, first_number)
+    result = ImportBatchResult(errors=errors)
+    with transaction.atomic():
+        users = _exclude_existing(users, result)
+        if not users:
+            return result
+        _assign_invite_codes(users)
+        if method == 'copy':
+            inserted = _insert_with_copy(users, timezone.now())
+        else:
+            inserted = _insert_with_bulk_create(users, bulk_batch_size)
+    result.inserted = inserted
+    result.skipped += len(users) - inserted
+    return result
+
+
+def link_imported_referrals():
+    """
+    Связывает загруженных пользователей с пригласившими по activated_invite_code
+    и пересчитывает referral_count пригласивших. Возвращает число новых связей
+    и число пользователей, чей код не найден.
+    """
+    with transaction.atomic():
+        pending = User.objects.filter(
+            referred_by__isnull=True,
+            activated_invite_code__isnull=False,
+        ).exclude(invite_code=F('activated_invite_code'))
+        inviter = User.objects.filter(invite_code=OuterRef('activated_invite_code'))
+        linked = pending.filter(Exists(inviter)).update(
+            referred_by=Subquery(inviter.values('id')[:1])
+        )
+        if linked:
+            referrer_ids = User.objects.filter(referred_by__isnull=False).values('referred_by')
+            User.objects.filter(id__in=referrer_ids).update(
+                referral_count=Subquery(
+                    User.objects.filter(referred_by=OuterRef('pk'))
+                    .values('referred_by')
+                    .annotate(total=Count('id'))
+                    .values('total')
+                )
+            )
+    return linked, pending.count()
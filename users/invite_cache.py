@@ -0,0 +1,106 @@
+import time
+import threading
+from collections import OrderedDict
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from .metrics import INVITE_CODE_CACHE
+
+MISSING = object()
+
+
+class InviteCodeCache:
+    """
+    LRU с TTL в памяти процесса: инвайт-код -> id пользователя или None,
+    если кода нет. Несуществующие коды хранятся меньше (negative_ttl):
+    код, выданный другим воркером, станет виден не позже чем через negative_ttl.
+    """
+
+    def __init__(self, max_size, ttl, negative_ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, code):
+        """id пользователя, None для несуществующего кода или MISSING, если кода нет в кеше"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(code)
+            if entry is None:
+                return MISSING
+            user_id, expires = entry
+            if expires <= now:
+                del self._entries[code]
+                return MISSING
+            self._entries.move_to_end(code)
+            return user_id
+
+    def set(self, code, user_id):
+        ttl = self.ttl if user_id is not None else self.negative_ttl
+        with self._lock:
+            self._entries[code] = (user_id, time.monotonic() + ttl)
+            self._entries.move_to_end(code)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                INVITE_CODE_CACHE.labels('eviction').inc()
+
+    def invalidate(self, codes):
+        with self._lock:
+            for code in codes:
+                self._entries.pop(code, None)
+
+
+_cache = None
+
+
+def get_invite_code_cache():
+    """Кеш инвайт-кодов процесса, настроенный в INVITE_CODE_CACHE_SETTINGS, или None, если он выключен"""
+    global _cache
+    cache_settings = settings.INVITE_CODE_CACHE_SETTINGS
+    if not cache_settings['enabled']:
+        return None
+    if _cache is None:
+        _cache = InviteCodeCache(
+            cache_settings['max_size'],
+            cache_settings['ttl_seconds'],
+            cache_settings['negative_ttl_seconds'],
+        )
+    return _cache
+
+
+@receiver(setting_changed)
+def reset_invite_code_cache(setting, **kwargs):
+    global _cache
+    if setting == 'INVITE_CODE_CACHE_SETTINGS':
+        _cache = None
+
+
+def cached_user_id(code):
+    """Результат из кеша (id или None) или MISSING; учитывает попадания и промахи"""
+    cache = get_invite_code_cache()
+    if cache is None:
+        return MISSING
+    user_id = cache.get(code)
+    if user_id is MISSING:
+        INVITE_CODE_CACHE.labels('miss').inc()
+    else:
+        INVITE_CODE_CACHE.labels('hit' if user_id is not None else 'negative_hit').inc()
+    return user_id
+
+
+def remember_user_id(code, user_id):
+    cache = get_invite_code_cache()
+    if cache is not None:
+        cache.set(code, user_id)
+
+
+def invalidate_invite_codes(codes):
+    """
+    Удаляет коды из кеша текущего процесса. Другие воркеры увидят новый
+    код не позже negative_ttl, а смену кода проверяет User.activate_invite.
+    """
+    cache = get_invite_code_cache()
+    if cache is not None:
+        cache.invalidate([code for code in codes if code])
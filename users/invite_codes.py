@@ -0,0 +1,173 @@
+import os
+import hashlib
+import threading
+from collections import deque
+from django.conf import settings
+from django.db import connections
+from .exceptions import CodeGenerationError
+
+INVITE_CODE_SEQUENCE = 'referral_invite_code_seq'
+FEISTEL_ROUNDS = 4
+
+
+def normalize_invite_code(value):
+    """
+    Каноническая форма инвайт-кода: без пробелов по краям и в верхнем регистре.
+    Коды хранятся только в этой форме, поэтому поиск без учета регистра
+    обслуживается обычным уникальным индексом.
+    """
+    return value.strip().upper()
+
+
+class InviteCodeEncoder:
+    """
+    Обратимое кодирование чисел в инвайт-коды.
+    Число переставляется ключевой сетью Фейстеля внутри пространства
+    len(charset) ** length и записывается в системе счисления charset,
+    поэтому разные числа всегда дают разные коды, а коды выглядят случайными.
+    """
+
+    def __init__(self, secret, charset, length, rounds=FEISTEL_ROUNDS):
+        self.key = hashlib.sha256(secret.encode() if isinstance(secret, str) else secret).digest()
+        self.charset = charset
+        self.length = length
+        self.rounds = rounds
+        self.base = len(charset)
+        self.left_modulus = self.base ** (length // 2)
+        self.right_modulus = self.base ** (length - length // 2)
+        self.domain = self.left_modulus * self.right_modulus
+        self._index = {char: i for i, char in enumerate(charset)}
+
+    def _round_function(self, round_index, value):
+        digest = hashlib.blake2b(
+            f'{round_index}:{value}'.encode(),
+            key=self.key,
+            digest_size=8,
+        ).digest()
+        return int.from_bytes(digest, 'big')
+
+    def permute(self, value):
+        """Прямая перестановка числа внутри пространства кодов"""
+        if not 0 <= value < self.domain:
+            raise CodeGenerationError(
+                f"Значение {value} вне пространства инвайт-кодов (0..{self.domain - 1})"
+            )
+        a, b = self.left_modulus, self.right_modulus
+        for round_index in range(self.rounds):
+            left, right = divmod(value, b)
+            left = (left + self._round_function(round_index, right)) % a
+            value = right * a + left
+            a, b = b, a
+        return value
+
+    def unpermute(self, value):
+        """Обратная перестановка"""
+        a, b = self.left_modulus, self.right_modulus
+        if self.rounds % 2:
+            a, b = b, a
+        for round_index in reversed(range(self.rounds)):
+            right, left = divmod(value, b)
+            a, b = b, a
+            left = (left - self._round_function(round_index, right)) % a
+            value = left * b + right
+        return value
+
+    def to_code(self, value):
+        """Записывает число в системе счисления charset фиксированной длины"""
+        chars = []
+        for _ in range(self.length):
+            value, digit = divmod(value, self.base)
+            chars.append(self.charset[digit])
+        return ''.join(reversed(chars))
+
+    def from_code(self, code):
+        """Переводит код обратно в число"""
+        if len(code) != self.length:
+            raise ValueError(f"Длина инвайт-кода должна быть {self.length}")
+        value = 0
+        for char in code:
+            if char not in self._index:
+                raise ValueError(f"Недопустимый символ инвайт-кода: {char}")
+            value = value * self.base + self._index[char]
+        return value
+
+    def encode(self, value):
+        """Инвайт-код для значения последовательности"""
+        return self.to_code(self.permute(value))
+
+    def decode(self, code):
+        """Значение последовательности для инвайт-кода"""
+        return self.unpermute(self.from_code(code))
+
+
+class InviteCodeSequence:
+    """
+    Выделяет значения последовательности PostgreSQL блоками, чтобы регистрация
+    пользователя в среднем не требовала ни одного дополнительного запроса.
+    """
+
+    def __init__(self, name=INVITE_CODE_SEQUENCE, block_size=100, using='default'):
+        self.name = name
+        self.block_size = block_size
+        self.using = using
+        self._values = deque()
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+
+    def reserve(self, count):
+        """Резервирует count значений последовательности одним запросом"""
+        connection = connections[self.using]
+        if connection.vendor != 'postgresql':
+            raise CodeGenerationError("Генерация инвайт-кодов из последовательности требует PostgreSQL")
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT nextval(%s) FROM generate_series(1, %s)",
+                [self.name, count],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    def next_value(self):
+        """Следующее значение из локального блока процесса"""
+        with self._lock:
+            if self._pid != os.getpid():
+                self._values.clear()
+                self._pid = os.getpid()
+            if not self._values:
+                self._values.extend(self.reserve(self.block_size))
+            return self._values.popleft()
+
+
+_encoder = None
+_sequence = None
+
+
+def get_encoder():
+    """Кодировщик, настроенный по INVITE_CODE_SETTINGS"""
+    global _encoder
+    if _encoder is None:
+        code_settings = settings.INVITE_CODE_SETTINGS
+        _encoder = InviteCodeEncoder(
+            code_settings['secret'],
+            code_settings['charset'],
+            code_settings['length'],
+        )
+    return _encoder
+
+
+def get_sequence():
+    """Последовательность значений для инвайт-кодов текущего процесса"""
+    global _sequence
+    if _sequence is None:
+        _sequence = InviteCodeSequence(block_size=settings.INVITE_CODE_SETTINGS['sequence_block_size'])
+    return _sequence
+
+
+def next_sequence_code():
+    """Инвайт-код для очередного значения последовательности"""
+    return get_encoder().encode(get_sequence().next_value())
+
+
+def reserve_sequence_codes(count):
+    """Инвайт-коды для count новых значений последовательности"""
+    encoder = get_encoder()
+    return [encoder.encode(value) for value in get_sequence().reserve(count)]
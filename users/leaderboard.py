@@ -0,0 +1,87 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Count
+from .models import User
+
+LEADERBOARD_CACHE_KEY = 'leaderboard:snapshot'
+
+
+def mask_phone_number(phone_number):
+    """
+    +79991234567 -> +7***67: рейтинг публичный и без аутентификации, поэтому
+    видны только первая цифра кода страны и две последние цифры номера,
+    а длина номера не раскрывается
+    """
+    return f'{phone_number[:2]}***{phone_number[-2:]}'
+
+
+def build_snapshot(limit):
+    """
+    Топ limit пользователей и распределение счетчиков: [(referral_count, число
+    пользователей), ...] по убыванию. Оба запроса читают частичный индекс
+    referral_users_leaderboard, а распределение позволяет вычислить место
+    любого пользователя без COUNT по таблице.
+    """
+    ranked = User.objects.filter(referral_count__gt=0)
+    top = list(
+        ranked.order_by('-referral_count', 'id')
+        .values_list('id', 'phone_number', 'referral_count')[:limit]
+    )
+    histogram = list(
+        ranked.order_by('-referral_count')
+        .values('referral_count')
+        .annotate(users=Count('id'))
+        .values_list('referral_count', 'users')
+    )
+    return {'top': top, 'histogram': histogram}
+
+
+def get_snapshot():
+    """Снимок рейтинга из кеша с коротким TTL (LEADERBOARD_SETTINGS)"""
+    leaderboard_settings = settings.LEADERBOARD_SETTINGS
+    cache = caches[leaderboard_settings['cache_alias']]
+    snapshot = cache.get(LEADERBOARD_CACHE_KEY)
+    if snapshot is None:
+        snapshot = build_snapshot(leaderboard_settings['max_limit'])
+        cache.set(LEADERBOARD_CACHE_KEY, snapshot, leaderboard_settings['cache_ttl_seconds'])
+    return snapshot
+
+
+def rank_for(referral_count, histogram):
+    """
+    Место пользователя с данным числом рефералов: 1 + число пользователей
+    с большим счетчиком (одинаковые счетчики делят место). Без рефералов - None.
+    """
+    if not referral_count:
+        return None
+    ahead = 0
+    for count, users in histogram:
+        if count <= referral_count:
+            break
+        ahead += users
+    return ahead + 1
+
+
+def leaderboard_data(limit, user=None):
+    """Данные эндпоинта /api/leaderboard/: топ limit и место пользователя user"""
+    snapshot = get_snapshot()
+    top = []
+    rank = 0
+    previous_count = None
+    for position, (user_id, phone_number, referral_count) in enumerate(snapshot['top'][:limit], 1):
+        if referral_count != previous_count:
+            rank, previous_count = position, referral_count
+        top.append({
+            'rank': rank,
+            'phone_number': mask_phone_number(phone_number),
+            'referral_count': referral_count,
+            'is_me': user is not None and user_id == user.id,
+        })
+
+    me = None
+    if user is not None:
+        me = {
+            'rank': rank_for(user.referral_count, snapshot['histogram']),
+            'referral_count': user.referral_count,
+        }
+    return {'top': top, 'me': me}
@@ -0,0 +1,133 @@
+import os
+import json
+import queue
+import atexit
+import logging
+import threading
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler, WatchedFileHandler
+
+VERBOSE_FORMAT = '{levelname} {asctime} {module} {process:d} {thread:d} {message}'
+# Атрибуты самой записи: все остальные переданы через extra и выводятся полями JSON
+RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'taskName'}
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись журнала - один JSON-объект в строке"""
+
+    def format(self, record):
+        data = {
+            'timestamp': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'module': record.module,
+            'process': record.process,
+            'thread': record.thread,
+        }
+        for key, value in record.__dict__.items():
+            if key not in RECORD_ATTRIBUTES and key not in data:
+                data[key] = value
+        if record.exc_info:
+            data['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+def build_formatter(log_format):
+    """Форматтер для 'json' или 'text' (формат verbose из LOGGING)"""
+    if log_format == 'json':
+        return JsonFormatter()
+    return logging.Formatter(VERBOSE_FORMAT, style='{')
+
+
+def build_file_handler(filename, max_bytes, backup_count, log_format='text'):
+    """
+    Файловый обработчик: {pid} в имени файла заменяется id процесса.
+    RotatingFileHandler ротирует файл по размеру и не согласует ротацию
+    с другими процессами, поэтому подходит только для файла одного процесса.
+    При max_bytes=0 файл ротируется снаружи (logrotate), и WatchedFileHandler
+    переоткрывает его после переименования.
+    """
+    filename = filename.format(pid=os.getpid())
+    # Файл открывается при первой записи, а не при настройке логирования
+    if max_bytes:
+        handler = RotatingFileHandler(
+            filename, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8', delay=True
+        )
+    else:
+        handler = WatchedFileHandler(filename, encoding='utf-8', delay=True)
+    handler.setFormatter(build_formatter(log_format))
+    return handler
+
+
+def build_console_handler(log_format='text'):
+    handler = logging.StreamHandler()
+    handler.setFormatter(build_formatter(log_format))
+    return handler
+
+
+class BackgroundQueueHandler(QueueHandler):
+    """
+    Обработчик, который только кладет запись в очередь, а запись в файл
+    и консоль выполняет фоновый QueueListener процесса. Поток запроса не ждет
+    диска и блокировок обработчиков. Слушатель запускается при первой записи
+    в каждом процессе, поэтому переживает fork воркеров gunicorn. При
+    переполнении очереди записи отбрасываются и учитываются в dropped.
+    """
+
+    def __init__(self, filename=None, max_bytes=10 * 1024 * 1024, backup_count=5,
+                 log_format='text', console=True, queue_size=10000):
+        super().__init__(queue.Queue(queue_size))
+        self.filename = filename
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.log_format = log_format
+        self.console = console
+        self.queue_size = queue_size
+        self.dropped = 0
+        self._listener = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def _build_targets(self):
+        targets = []
+        if self.filename:
+            targets.append(build_file_handler(self.filename, self.max_bytes, self.backup_count, self.log_format))
+        if self.console:
+            targets.append(build_console_handler(self.log_format))
+        return targets
+
+    def _ensure_listener(self):
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            if self._pid is not None:
+                # Процесс-потомок: поток слушателя родителя не унаследован,
+                # а очередь могла остаться заблокированной в момент fork
+                self.queue = queue.Queue(self.queue_size)
+            self._listener = QueueListener(self.queue, *self._build_targets(), respect_handler_level=True)
+            self._listener.start()
+            self._pid = os.getpid()
+            atexit.register(self.stop)
+
+    def enqueue(self, record):
+        self._ensure_listener()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def stop(self):
+        """Дописывает оставшиеся в очереди записи и останавливает слушателя"""
+        if self._listener is not None and self._pid == os.getpid():
+            self._listener.stop()
+            for handler in self._listener.handlers:
+                handler.close()
+            self._listener = None
+            self._pid = None
+
+    def close(self):
+        self.stop()
+        super().close()
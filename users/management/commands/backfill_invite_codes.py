@@ -0,0 +1,68 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Case, When, Value, Q
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = 'Assign invite codes to existing users in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='Reissue codes for all users (for example after switching INVITE_CODE_MODE to sequence), '
+                 'activated invite codes of referrals are remapped to the new codes',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=5000,
+            help='Users per batch (default: 5000)',
+        )
+
+    def handle(self, *args, **options):
+        reissue = options['all']
+        batch_size = options['batch_size']
+
+        queryset = User.objects.only('id', 'invite_code').order_by('id')
+        if not reissue:
+            queryset = queryset.filter(Q(invite_code__isnull=True) | Q(invite_code=''))
+
+        last_id = 0
+        processed = 0
+        started = time.monotonic()
+
+        while True:
+            users = list(queryset.filter(id__gt=last_id)[:batch_size])
+            if not users:
+                break
+            last_id = users[-1].id
+
+            with transaction.atomic():
+                old_codes = {user.id: user.invite_code for user in users}
+                if reissue:
+                    for user in users:
+                        user.invite_code = None
+                User.assign_invite_codes(users)
+                User.objects.bulk_update(users, ['invite_code'])
+
+                remap = {
+                    old_codes[user.id]: user.invite_code
+                    for user in users if old_codes[user.id]
+                }
+                if remap:
+                    User.objects.filter(activated_invite_code__in=remap.keys()).update(
+                        activated_invite_code=Case(
+                            *[When(activated_invite_code=old, then=Value(new)) for old, new in remap.items()]
+                        )
+                    )
+
+            processed += len(users)
+            elapsed = time.monotonic() - started
+            self.stdout.write(
+                f'Обработано {processed} пользователей ({processed / elapsed:.0f} в секунду)'
+            )
+
+        self.stdout.write(self.style.SUCCESS(f'Инвайт-коды выданы {processed} пользователям'))
@@ -0,0 +1,29 @@
+import time
+from django.core.management.base import BaseCommand
+from users.models import ReferralClosure
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the referral closure table from referred_by links'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--max-depth',
+            type=int,
+            default=None,
+            help='Stop after this many tree levels (default: REFERRAL_SETTINGS max_tree_depth)',
+        )
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        levels, truncated = ReferralClosure.rebuild(max_depth=options['max_depth'])
+        rows = ReferralClosure.objects.count()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Замыкание дерева рефералов перестроено за {time.monotonic() - started:.2f} с: '
+            f'уровней {levels}, строк {rows}'
+        ))
+        if truncated:
+            self.stdout.write(self.style.WARNING(
+                f'Перестройка остановлена на глубине {levels}: проверьте данные на слишком длинные цепочки'
+            ))
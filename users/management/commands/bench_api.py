@@ -0,0 +1,285 @@
+import json
+import time
+import random
+import platform
+import subprocess
+import threading
+from collections import defaultdict
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.db.models import Q
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from users.benchmarking import summarize
+from users.cleanup import delete_in_batches
+from users.importing import import_batch, link_imported_referrals
+from users.models import User, ReferralClosure, VerificationCode, CodeDelivery
+
+SEED_PHONE_PREFIX = '+7005'
+FLOW_PHONE_PREFIX = '+7006'
+SEED_CODE_PREFIX = 'B'
+# Пути заданы явно: имя 'profile' занято также страницей профиля
+ENDPOINTS = {
+    'send-code': '/api/auth/send-code/',
+    'verify-code': '/api/auth/verify-code/',
+    'profile': '/api/profile/',
+    'activate-invite': '/api/profile/activate-invite/',
+}
+BASE36 = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+
+
+def seed_invite_code(index):
+    """Инвайт-код синтетического пользователя: 'B' и номер в base36 (6 символов, как в API)"""
+    chars = []
+    for _ in range(5):
+        index, digit = divmod(index, 36)
+        chars.append(BASE36[digit])
+    return SEED_CODE_PREFIX + ''.join(reversed(chars))
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            capture_output=True, text=True, check=True, cwd=settings.BASE_DIR,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        'Seed synthetic users with a referral graph and drive send-code -> verify-code -> profile -> '
+        'activate-invite through the real URL routes with concurrent virtual users'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--users',
+            type=int,
+            default=10000,
+            help='Synthetic users to seed (default: 10000)',
+        )
+        parser.add_argument(
+            '--referral-ratio',
+            type=float,
+            default=0.7,
+            help='Share of seeded users who activated an earlier user\'s invite code (default: 0.7)',
+        )
+        parser.add_argument(
+            '--flows',
+            type=int,
+            default=200,
+            help='Full send-code -> activate-invite flows to run (default: 200)',
+        )
+        parser.add_argument(
+            '--vus',
+            type=int,
+            default=8,
+            help='Concurrent virtual users (default: 8)',
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=42,
+            help='Random seed for the graph and the flows (default: 42)',
+        )
+        parser.add_argument(
+            '--keep',
+            action='store_true',
+            help='Keep seeded and created users after the run',
+        )
+        parser.add_argument(
+            '--output',
+            default=None,
+            help='Write JSON results to this file',
+        )
+        parser.add_argument(
+            '--compare',
+            default=None,
+            help='JSON results of a previous run to print the difference against',
+        )
+        parser.add_argument(
+            '--json',
+            action='store_true',
+            help='Print results as JSON',
+        )
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options['compare']:
+            try:
+                with open(options['compare'], encoding='utf-8') as f:
+                    baseline = json.load(f)
+            except (OSError, ValueError) as e:
+                raise CommandError(f"Не удалось прочитать {options['compare']}: {e}")
+
+        self.cleanup()
+        started = time.monotonic()
+        self.seed(options['users'], options['referral_ratio'], options['seed'])
+        seed_elapsed = time.monotonic() - started
+        self.stdout.write(f"Создано {options['users']} пользователей за {seed_elapsed:.1f} с")
+
+        try:
+            endpoints, elapsed, errors = self.run_flows(options)
+        finally:
+            if not options['keep']:
+                self.cleanup()
+
+        results = {
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'vendor': connection.vendor,
+            'server_mode': settings.SERVER_MODE,
+            'users': options['users'],
+            'referral_ratio': options['referral_ratio'],
+            'flows': options['flows'],
+            'vus': options['vus'],
+            'seed': options['seed'],
+            'seed_elapsed_s': round(seed_elapsed, 3),
+            'elapsed_s': round(elapsed, 3),
+            'flows_per_second': round(options['flows'] / elapsed, 2) if elapsed else 0.0,
+            'errors': errors,
+            'endpoints': endpoints,
+        }
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump(results, f, indent=2)
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        self.print_results(results, baseline)
+
+    def seed(self, count, referral_ratio, seed):
+        """
+        Загружает синтетических пользователей через импорт: каждый следующий
+        пользователь с вероятностью referral_ratio приглашен одним из предыдущих,
+        поэтому граф - лес без циклов с цепочками разной глубины.
+        """
+        rng = random.Random(seed)
+        batch_size = 10000
+        for start in range(0, count, batch_size):
+            records = []
+            for i in range(start, min(start + batch_size, count)):
+                inviter = rng.randrange(i) if i and rng.random() < referral_ratio else None
+                records.append({
+                    'phone_number': f'{SEED_PHONE_PREFIX}{i:07d}',
+                    'invite_code': seed_invite_code(i),
+                    'activated_invite_code': seed_invite_code(inviter) if inviter is not None else '',
+                })
+            import_batch(records, start + 1)
+        link_imported_referrals()
+        ReferralClosure.rebuild()
+
+    def run_flows(self, options):
+        """Прогоняет сценарии в --vus потоках, замеряя задержку и число запросов к БД"""
+        rng = random.Random(options['seed'])
+        invite_codes = [seed_invite_code(rng.randrange(options['users'])) for _ in range(options['flows'])]
+        samples = defaultdict(list)
+        queries = defaultdict(int)
+        errors = defaultdict(int)
+        lock = threading.Lock()
+        next_flow = iter(range(options['flows']))
+
+        def call(client, name, method, data=None):
+            db = connections['default']
+            with CaptureQueriesContext(db) as captured:
+                started = time.perf_counter()
+                if method == 'get':
+                    response = client.get(ENDPOINTS[name])
+                else:
+                    response = client.post(ENDPOINTS[name], data, content_type='application/json')
+                duration = time.perf_counter() - started
+            with lock:
+                samples[name].append(duration)
+                queries[name] += len(captured)
+                if response.status_code != 200:
+                    errors[name] += 1
+            return response
+
+        def virtual_user():
+            try:
+                while True:
+                    with lock:
+                        flow = next(next_flow, None)
+                    if flow is None:
+                        return
+                    client = Client()
+                    phone_number = f'{FLOW_PHONE_PREFIX}{flow:07d}'
+                    response = call(client, 'send-code', 'post', {'phone_number': phone_number})
+                    code = response.json().get('code')
+                    call(client, 'verify-code', 'post', {'phone_number': phone_number, 'code': code})
+                    call(client, 'profile', 'get')
+                    call(client, 'activate-invite', 'post', {'invite_code': invite_codes[flow]})
+            finally:
+                connections.close_all()
+
+        with override_settings(
+            ALLOWED_HOSTS=['testserver'],
+            RATE_LIMIT_SETTINGS={**settings.RATE_LIMIT_SETTINGS, 'enabled': False},
+        ):
+            started = time.perf_counter()
+            threads = [threading.Thread(target=virtual_user) for _ in range(options['vus'])]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - started
+
+        endpoints = {}
+        for name in ENDPOINTS:
+            stats = summarize(samples[name], elapsed)
+            stats['queries_per_request'] = round(queries[name] / len(samples[name]), 2) if samples[name] else 0.0
+            stats['errors'] = errors[name]
+            endpoints[name] = stats
+        return endpoints, elapsed, sum(errors.values())
+
+    def cleanup(self):
+        """Удаляет синтетических пользователей, их строки замыкания, коды и доставки"""
+        qn = connection.ops.quote_name
+        users = qn(User._meta.db_table)
+        bench_users = (
+            f"SELECT {qn('id')} FROM {users} "
+            f"WHERE {qn('phone_number')} LIKE %s OR {qn('phone_number')} LIKE %s"
+        )
+        prefixes = [f'{SEED_PHONE_PREFIX}%', f'{FLOW_PHONE_PREFIX}%']
+        batch_options = {'time_budget': 0, 'max_batches_per_second': 0}
+        delete_in_batches(
+            ReferralClosure,
+            f"{qn('ancestor_id')} IN ({bench_users}) OR {qn('descendant_id')} IN ({bench_users})",
+            prefixes * 2,
+            order_by=qn('id'),
+            **batch_options
+        )
+        # Пачки удаляются в отдельных транзакциях, поэтому ссылки referred_by
+        # между удаляемыми строками снимаются заранее
+        User.objects.filter(
+            Q(phone_number__startswith=SEED_PHONE_PREFIX) | Q(phone_number__startswith=FLOW_PHONE_PREFIX),
+            referred_by__isnull=False,
+        ).update(referred_by=None)
+        delete_in_batches(User, f"{qn('id')} IN ({bench_users})", prefixes, order_by=qn('id'), **batch_options)
+        for model in (VerificationCode, CodeDelivery):
+            model.objects.filter(phone_number__startswith=FLOW_PHONE_PREFIX).delete()
+
+    def print_results(self, results, baseline):
+        self.stdout.write(
+            f"{results['flows']} сценариев, {results['vus']} виртуальных пользователей, "
+            f"{results['flows_per_second']:.2f} сценариев/с, ошибок: {results['errors']} "
+            f"({results['vendor']}, {results['server_mode']})"
+        )
+        for name, stats in results['endpoints'].items():
+            line = (
+                f"{name:>15}: {stats['rps']:8.2f} req/s, p50 {stats['p50_ms']:.2f} ms, "
+                f"p95 {stats['p95_ms']:.2f} ms, p99 {stats['p99_ms']:.2f} ms, "
+                f"запросов к БД: {stats['queries_per_request']:.2f}"
+            )
+            previous = (baseline or {}).get('endpoints', {}).get(name)
+            if previous and previous['p50_ms']:
+                change = (stats['p50_ms'] - previous['p50_ms']) / previous['p50_ms'] * 100
+                line += (
+                    f" | p50 {change:+.1f}% к {baseline.get('revision') or 'базе'}, "
+                    f"запросов к БД {stats['queries_per_request'] - previous['queries_per_request']:+.2f}"
+                )
+            self.stdout.write(line)
@@ -0,0 +1,116 @@
+import json
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from users.benchmarking import percentile
+from users.exceptions import CodeGenerationError
+from users.models import VerificationCode
+
+BENCH_PHONE_PREFIX = '+7001'
+
+
+class Command(BaseCommand):
+    help = 'Benchmark verification code allocation latency at different keyspace fill levels'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--fill',
+            type=int,
+            nargs='+',
+            default=[10, 50, 90],
+            help='Keyspace fill levels in percent (default: 10 50 90)',
+        )
+        parser.add_argument(
+            '--samples',
+            type=int,
+            default=500,
+            help='Codes to issue per fill level (default: 500)',
+        )
+        parser.add_argument(
+            '--legacy',
+            action='store_true',
+            help='Also measure the previous probe-and-retry allocation for comparison',
+        )
+        parser.add_argument(
+            '--json',
+            action='store_true',
+            help='Print results as JSON',
+        )
+
+    def handle(self, *args, **options):
+        code_settings = settings.VERIFICATION_CODE_SETTINGS
+        keyspace = len(code_settings['charset']) ** code_settings['length']
+
+        strategies = {'upsert': VerificationCode.create_code}
+        if options['legacy']:
+            strategies['legacy'] = self.legacy_create_code
+
+        results = []
+        for fill in options['fill']:
+            for name, strategy in strategies.items():
+                stats = self.measure(strategy, keyspace * fill // 100, options['samples'])
+                results.append({'strategy': name, 'fill_percent': fill, **stats})
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+
+        for row in results:
+            self.stdout.write(
+                f"{row['strategy']:>6} {row['fill_percent']:>3}%: "
+                f"p50 {row['p50_ms']:.3f} ms, p99 {row['p99_ms']:.3f} ms, "
+                f"{row['queries_per_code']:.2f} queries/code, {row['failures']} failures"
+            )
+
+    def measure(self, strategy, occupied, samples):
+        """Заполняет таблицу occupied кодами и выдает samples новых кодов"""
+        latencies = []
+        failures = 0
+        with transaction.atomic():
+            expires_at = timezone.now() + timedelta(minutes=5)
+            VerificationCode.objects.bulk_create(
+                VerificationCode(
+                    phone_number=f'{BENCH_PHONE_PREFIX}{i:07d}',
+                    code=f'{i:04d}'[-4:],
+                    expires_at=expires_at,
+                )
+                for i in range(occupied)
+            )
+
+            with CaptureQueriesContext(connection) as queries:
+                for i in range(samples):
+                    phone_number = f'{BENCH_PHONE_PREFIX}{occupied + i:07d}'
+                    start = time.perf_counter()
+                    try:
+                        strategy(phone_number)
+                    except CodeGenerationError:
+                        failures += 1
+                    latencies.append(time.perf_counter() - start)
+
+            transaction.set_rollback(True)
+
+        return {
+            'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+            'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+            'queries_per_code': len(queries) / samples,
+            'failures': failures,
+        }
+
+    @staticmethod
+    def legacy_create_code(phone_number):
+        """Прежний алгоритм: подбор глобально уникального кода с проверкой exists()"""
+        VerificationCode.objects.filter(phone_number=phone_number).delete()
+        expires_at = timezone.now() + timedelta(minutes=5)
+        for _ in range(10):
+            candidate = VerificationCode.generate_verification_code()
+            if not VerificationCode.objects.filter(code=candidate).exists():
+                return VerificationCode.objects.create(
+                    phone_number=phone_number,
+                    code=candidate,
+                    expires_at=expires_at,
+                )
+        raise CodeGenerationError('Не удалось сгенерировать уникальный verification код')
@@ -0,0 +1,153 @@
+import json
+import time
+import random
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+from users.benchmarking import percentile, run_concurrently, summarize
+from users.cleanup import delete_in_batches
+from users.leaderboard import LEADERBOARD_CACHE_KEY, build_snapshot
+from users.models import User
+
+BENCH_PHONE_PREFIX = '+7004'
+
+
+class Command(BaseCommand):
+    help = 'Benchmark /api/leaderboard/ on a table seeded with synthetic users (for example --users 10000000)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--users',
+            type=int,
+            default=100000,
+            help='Synthetic users to seed (default: 100000)',
+        )
+        parser.add_argument(
+            '--requests',
+            type=int,
+            default=1000,
+            help='Leaderboard requests per scenario (default: 1000)',
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=4,
+            help='Concurrent clients (default: 4)',
+        )
+        parser.add_argument(
+            '--rebuilds',
+            type=int,
+            default=5,
+            help='Cold snapshot rebuilds to time (default: 5)',
+        )
+        parser.add_argument(
+            '--keep',
+            action='store_true',
+            help='Keep seeded users after the run',
+        )
+        parser.add_argument(
+            '--json',
+            action='store_true',
+            help='Print results as JSON',
+        )
+
+    def handle(self, *args, **options):
+        first_id = (User.objects.order_by('-id').values_list('id', flat=True).first() or 0) + 1
+        started = time.monotonic()
+        self.seed(options['users'])
+        self.stdout.write(f"Создано {options['users']} пользователей за {time.monotonic() - started:.1f} с")
+
+        try:
+            results = {
+                'snapshot_rebuild': self.measure_rebuild(options['rebuilds']),
+                'anonymous': self.measure_requests(options, authenticated=False),
+                'authenticated': self.measure_requests(options, authenticated=True, first_id=first_id),
+            }
+        finally:
+            if not options['keep']:
+                qn = connection.ops.quote_name
+                delete_in_batches(
+                    User,
+                    f"{qn('id')} >= %s AND {qn('phone_number')} LIKE %s",
+                    [first_id, f'{BENCH_PHONE_PREFIX}%'],
+                    order_by=qn('id'),
+                    time_budget=0,
+                    max_batches_per_second=0,
+                )
+            caches[settings.LEADERBOARD_SETTINGS['cache_alias']].delete(LEADERBOARD_CACHE_KEY)
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+
+        rebuild = results['snapshot_rebuild']
+        self.stdout.write(
+            f"снимок рейтинга без кеша: p50 {rebuild['p50_ms']:.1f} ms, max {rebuild['max_ms']:.1f} ms"
+        )
+        for name in ('anonymous', 'authenticated'):
+            stats = results[name]
+            self.stdout.write(
+                f"{name:>13}: {stats['rps']:8.2f} req/s, p50 {stats['p50_ms']:.2f} ms, p99 {stats['p99_ms']:.2f} ms"
+            )
+
+    def seed(self, count):
+        """Пользователи с убывающим по степенному закону числом рефералов"""
+        if connection.vendor == 'postgresql':
+            table = connection.ops.quote_name(User._meta.db_table)
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"INSERT INTO {table} (phone_number, referral_count, created_at) "
+                    "SELECT %s || lpad(g::text, 8, '0'), floor(power(random(), 12) * 1000)::int, now() "
+                    "FROM generate_series(1, %s) g",
+                    [BENCH_PHONE_PREFIX, count]
+                )
+                cursor.execute(f"ANALYZE {table}")
+            return
+
+        batch_size = 10000
+        for start in range(0, count, batch_size):
+            User.objects.bulk_create([
+                User(
+                    phone_number=f'{BENCH_PHONE_PREFIX}{i:08d}',
+                    referral_count=int(random.random() ** 12 * 1000),
+                )
+                for i in range(start, min(start + batch_size, count))
+            ])
+
+    def measure_rebuild(self, rebuilds):
+        limit = settings.LEADERBOARD_SETTINGS['max_limit']
+        durations = []
+        for _ in range(rebuilds):
+            started = time.perf_counter()
+            build_snapshot(limit)
+            durations.append(time.perf_counter() - started)
+        return {
+            'p50_ms': round(percentile(durations, 50) * 1000, 3),
+            'max_ms': round(max(durations) * 1000, 3),
+        }
+
+    def measure_requests(self, options, authenticated, first_id=None):
+        url = reverse('leaderboard')
+        session_keys = []
+        if authenticated:
+            # Сессии создаются заранее, чтобы в замер попал только запрос рейтинга
+            for user_id in random.sample(range(first_id, first_id + options['users']), min(options['users'], 100)):
+                session = Client().session
+                session['user_id'] = user_id
+                session.save()
+                session_keys.append(session.session_key)
+
+        def request(i):
+            client = Client()
+            if session_keys:
+                client.cookies[settings.SESSION_COOKIE_NAME] = session_keys[i % len(session_keys)]
+            response = client.get(url)
+            assert response.status_code == 200, response.content
+
+        with override_settings(ALLOWED_HOSTS=['testserver']):
+            latencies, elapsed = run_concurrently(request, options['requests'], options['concurrency'])
+        return summarize(latencies, elapsed)
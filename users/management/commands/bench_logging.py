@@ -0,0 +1,130 @@
+import json
+import logging
+import tempfile
+from pathlib import Path
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+from users.benchmarking import run_concurrently, summarize
+from users.log_handlers import BackgroundQueueHandler, build_file_handler
+from users.models import VerificationCode, CodeDelivery
+
+BENCH_PHONE_PREFIX = '+7002'
+MODES = ['off', 'sync', 'queue']
+
+
+class Command(BaseCommand):
+    help = 'Benchmark /api/auth/send-code/ latency with file logging off, synchronous and queued'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--requests',
+            type=int,
+            default=500,
+            help='Number of send-code requests per mode (default: 500)',
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=4,
+            help='Concurrent clients (default: 4)',
+        )
+        parser.add_argument(
+            '--modes',
+            nargs='+',
+            default=MODES,
+            choices=MODES,
+            help='Logging modes to compare (default: off sync queue)',
+        )
+        parser.add_argument(
+            '--level',
+            default='INFO',
+            choices=['DEBUG', 'INFO', 'WARNING'],
+            help='Level of the users logger during the run (default: INFO)',
+        )
+        parser.add_argument(
+            '--format',
+            default='text',
+            choices=['text', 'json'],
+            help='Log record format (default: text)',
+        )
+        parser.add_argument(
+            '--json',
+            action='store_true',
+            help='Print results as JSON',
+        )
+
+    def handle(self, *args, **options):
+        results = {}
+        with tempfile.TemporaryDirectory() as log_dir:
+            for mode in options['modes']:
+                log_file = str(Path(log_dir) / f'{mode}.log')
+                results[mode] = self.run_mode(mode, log_file, options)
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+
+        for mode, stats in results.items():
+            self.stdout.write(
+                f"{mode:>5}: {stats['rps']:8.2f} req/s, mean {stats['mean_ms']:.2f} ms, "
+                f"p50 {stats['p50_ms']:.2f} ms, p99 {stats['p99_ms']:.2f} ms, "
+                f"записей в журнале: {stats['log_lines']}, отброшено: {stats['dropped']}"
+            )
+
+    def build_handler(self, mode, log_file, log_format):
+        if mode == 'off':
+            return logging.NullHandler()
+        log_settings = settings.LOG_SETTINGS
+        if mode == 'sync':
+            return build_file_handler(log_file, log_settings['max_bytes'], log_settings['backup_count'], log_format)
+        return BackgroundQueueHandler(
+            filename=log_file,
+            max_bytes=log_settings['max_bytes'],
+            backup_count=log_settings['backup_count'],
+            log_format=log_format,
+            console=False,
+            queue_size=log_settings['queue_size'],
+        )
+
+    def run_mode(self, mode, log_file, options):
+        """Прогоняет запросы, подменив обработчики логгера users на обработчик режима"""
+        url = reverse('send-code')
+        delivery_settings = {**settings.CODE_DELIVERY_SETTINGS, 'mode': 'outbox'}
+
+        def send(i):
+            client = Client()
+            response = client.post(
+                url,
+                {'phone_number': f'{BENCH_PHONE_PREFIX}{i:07d}'},
+                content_type='application/json',
+            )
+            assert response.status_code == 200, response.content
+
+        users_logger = logging.getLogger('users')
+        saved_handlers, saved_level = users_logger.handlers[:], users_logger.level
+        handler = self.build_handler(mode, log_file, options['format'])
+        users_logger.handlers = [handler]
+        users_logger.setLevel(options['level'])
+        try:
+            with override_settings(
+                ALLOWED_HOSTS=['testserver'],
+                CODE_DELIVERY_SETTINGS=delivery_settings,
+                RATE_LIMIT_SETTINGS={**settings.RATE_LIMIT_SETTINGS, 'enabled': False},
+            ):
+                latencies, elapsed = run_concurrently(send, options['requests'], options['concurrency'])
+        finally:
+            users_logger.handlers = saved_handlers
+            users_logger.setLevel(saved_level)
+            handler.close()
+            VerificationCode.objects.filter(phone_number__startswith=BENCH_PHONE_PREFIX).delete()
+            CodeDelivery.objects.filter(phone_number__startswith=BENCH_PHONE_PREFIX).delete()
+
+        log_path = Path(log_file)
+        return {
+            **summarize(latencies, elapsed),
+            'log_lines': sum(1 for _ in log_path.open(encoding='utf-8')) if log_path.exists() else 0,
+            'dropped': getattr(handler, 'dropped', 0),
+        }
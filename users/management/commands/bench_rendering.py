@@ -0,0 +1,118 @@
+import json
+import time
+from unittest import mock
+from django.http import HttpResponse
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from users import renderers
+from users.models import User
+from users.serializers import (
+    ErrorSerializer, UserAuthSerializer, UserProfileSerializer, user_auth_data, user_profile_data
+)
+from users.utils import build_error_data, create_error_response
+
+ENCODERS = ['orjson', 'stdlib']
+
+
+class Command(BaseCommand):
+    help = (
+        'Microbenchmark per-response CPU of DRF serializers with JSONRenderer against '
+        'plain dicts with the fast renderer and pre-encoded error bodies'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--iterations',
+            type=int,
+            default=20000,
+            help='Responses built per case and repeat (default: 20000)',
+        )
+        parser.add_argument(
+            '--repeats',
+            type=int,
+            default=5,
+            help='Repeats per case, the best one is reported (default: 5)',
+        )
+        parser.add_argument(
+            '--json',
+            action='store_true',
+            help='Print results as JSON',
+        )
+
+    def handle(self, *args, **options):
+        encoders = ENCODERS if renderers.orjson is not None else ['stdlib']
+        results = {}
+        for name, (drf, fast) in self.cases().items():
+            drf_us = self.measure(drf, options)
+            results[name] = {'drf_us': drf_us}
+            for encoder in encoders:
+                with mock.patch.object(renderers, 'orjson', renderers.orjson if encoder == 'orjson' else None):
+                    fast_us = self.measure(fast, options)
+                results[name][f'{encoder}_us'] = fast_us
+                results[name][f'{encoder}_speedup'] = round(drf_us / fast_us, 2) if fast_us else 0.0
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+
+        if renderers.orjson is None:
+            self.stdout.write('orjson не установлен (uv sync --extra json), замер только для stdlib')
+        for name, stats in results.items():
+            line = f"{name:>8}: DRF {stats['drf_us']:.2f} мкс"
+            for encoder in encoders:
+                line += f", {encoder} {stats[f'{encoder}_us']:.2f} мкс (x{stats[f'{encoder}_speedup']:.2f})"
+            self.stdout.write(line)
+
+    def cases(self):
+        """
+        Пары (прежний путь, новый путь) для каждого вида ответа. Пользователь
+        не сохраняется и превью рефералов передается готовым: замеряется
+        только сборка и кодирование тела, без запросов к БД.
+        """
+        user = User(
+            id=123456,
+            phone_number='+79991234567',
+            invite_code='A1B2C3',
+            activated_invite_code='Z9Y8X7',
+            referral_count=10,
+            created_at=timezone.now(),
+        )
+        referrals = [f'+7999000{i:04d}' for i in range(10)]
+        renderer = JSONRenderer()
+
+        def drf_error():
+            data = ErrorSerializer(build_error_data('Неверный код верификации', 'INVALID_CODE')).data
+            return HttpResponse(renderer.render(data), status=400, content_type='application/json')
+
+        def fast_error():
+            return create_error_response(400, 'Неверный код верификации', 'INVALID_CODE')
+
+        def drf_auth():
+            return renderer.render(UserAuthSerializer(user).data)
+
+        def fast_auth():
+            return renderers.dumps(user_auth_data(user))
+
+        def drf_profile():
+            return renderer.render(UserProfileSerializer(user, context={'referrals': referrals}).data)
+
+        def fast_profile():
+            return renderers.dumps(user_profile_data(user, referrals))
+
+        return {
+            'error': (drf_error, fast_error),
+            'auth': (drf_auth, fast_auth),
+            'profile': (drf_profile, fast_profile),
+        }
+
+    def measure(self, build, options):
+        """Лучшее из --repeats время на один ответ в микросекундах"""
+        best = None
+        for _ in range(options['repeats']):
+            started = time.perf_counter()
+            for _ in range(options['iterations']):
+                build()
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        return round(best / options['iterations'] * 1e6, 2)
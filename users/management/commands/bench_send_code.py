@@ -0,0 +1,84 @@
+import json
+from django.core.management.base import BaseCommand
+from django.conf import settings
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+from users.benchmarking import run_concurrently, summarize
+from users.models import VerificationCode, CodeDelivery
+
+BENCH_PHONE_PREFIX = '+7000'
+
+
+class Command(BaseCommand):
+    help = 'Benchmark /api/auth/send-code/ throughput with sync and outbox code delivery'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--requests',
+            type=int,
+            default=40,
+            help='Number of send-code requests per mode (default: 40)',
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=4,
+            help='Concurrent clients, same as gunicorn sync workers (default: 4)',
+        )
+        parser.add_argument(
+            '--modes',
+            nargs='+',
+            default=['sync', 'outbox'],
+            choices=['sync', 'outbox'],
+            help='Delivery modes to compare (default: sync outbox)',
+        )
+        parser.add_argument(
+            '--json',
+            action='store_true',
+            help='Print results as JSON',
+        )
+
+    def handle(self, *args, **options):
+        results = {}
+        for mode in options['modes']:
+            results[mode] = self.run_mode(mode, options['requests'], options['concurrency'])
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+
+        for mode, stats in results.items():
+            self.stdout.write(
+                f"{mode:>7}: {stats['rps']:8.2f} req/s, "
+                f"p50 {stats['p50_ms']:.1f} ms, p99 {stats['p99_ms']:.1f} ms"
+            )
+        if 'sync' in results and 'outbox' in results and results['sync']['rps']:
+            gain = results['outbox']['rps'] / results['sync']['rps']
+            self.stdout.write(self.style.SUCCESS(f'Прирост пропускной способности: x{gain:.1f}'))
+
+    def run_mode(self, mode, count, concurrency):
+        url = reverse('send-code')
+        delivery_settings = {**settings.CODE_DELIVERY_SETTINGS, 'mode': mode}
+
+        def send(i):
+            client = Client()
+            response = client.post(
+                url,
+                {'phone_number': f'{BENCH_PHONE_PREFIX}{i:07d}'},
+                content_type='application/json',
+            )
+            assert response.status_code == 200, response.content
+
+        try:
+            with override_settings(
+                ALLOWED_HOSTS=['testserver'],
+                CODE_DELIVERY_SETTINGS=delivery_settings,
+                RATE_LIMIT_SETTINGS={**settings.RATE_LIMIT_SETTINGS, 'enabled': False},
+            ):
+                latencies, elapsed = run_concurrently(send, count, concurrency)
+        finally:
+            VerificationCode.objects.filter(phone_number__startswith=BENCH_PHONE_PREFIX).delete()
+            CodeDelivery.objects.filter(phone_number__startswith=BENCH_PHONE_PREFIX).delete()
+
+        return summarize(latencies, elapsed)
@@ -0,0 +1,22 @@
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from users.openapi import write_schema
+
+
+class Command(BaseCommand):
+    help = 'Write the OpenAPI schema to STATIC_ROOT/openapi/ under a content-hashed name (run after collectstatic)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--static-root',
+            default=None,
+            help='Output root (default: STATIC_ROOT)',
+        )
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        path = write_schema(options['static_root'] or settings.STATIC_ROOT)
+        self.stdout.write(self.style.SUCCESS(
+            f'Схема OpenAPI записана в {path} за {time.monotonic() - started:.2f} с'
+        ))
@@ -1,6 +1,7 @@
 import time
 import logging
 from django.core.management.base import BaseCommand
+from users.models import VerificationCode
 from users.scheduler import start_scheduler
 
 logger = logging.getLogger(__name__)
@@ -15,15 +16,55 @@ class Command(BaseCommand):
             default=600,
             help='Interval in seconds between manual cleanup runs (default: 600)',
         )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=None,
+            help='Rows deleted per batch (default: CLEANUP_SETTINGS batch_size)',
+        )
+        parser.add_argument(
+            '--time-budget',
+            type=int,
+            default=None,
+            help='Maximum seconds per cleanup run (default: CLEANUP_SETTINGS time_budget_seconds)',
+        )
+        parser.add_argument(
+            '--max-rate',
+            type=float,
+            default=None,
+            help='Maximum batches per second (default: CLEANUP_SETTINGS max_batches_per_second)',
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Run a single cleanup pass and exit instead of starting the scheduler',
+        )
 
     def handle(self, *args, **options):
         interval = options['interval']
+        cleanup_options = {
+            'batch_size': options['batch_size'],
+            'time_budget': options['time_budget'],
+            'max_batches_per_second': options['max_rate'],
+        }
+        
+        if options['once']:
+            result = VerificationCode.cleanup_expired_codes(**cleanup_options)
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f'Удалено {result.deleted} кодов за {result.elapsed:.2f} с '
+                    f'({result.rows_per_second:.0f} строк/с, пачек: {result.batches})'
+                )
+            )
+            if not result.complete:
+                self.stdout.write(self.style.WARNING('Очистка остановлена по бюджету времени'))
+            return
         
         self.stdout.write(
             self.style.SUCCESS(f'Запуск APScheduler с интервалом {interval} секунд')
         )
         
-        scheduler = start_scheduler()
+        scheduler = start_scheduler(cleanup_options)
         
         if scheduler:
             self.stdout.write(
@@ -0,0 +1,132 @@
+import os
+import sys
+import json
+import time
+from itertools import islice
+from django.core.management.base import BaseCommand, CommandError
+from users.importing import read_records, import_batch, link_imported_referrals
+from users.models import ReferralClosure
+
+
+class Command(BaseCommand):
+    help = (
+        'Import users from a CSV file with a header row or from JSONL. Columns: phone_number '
+        '(required), invite_code and activated_invite_code (optional)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path',
+            help="Input file, '-' reads standard input",
+        )
+        parser.add_argument(
+            '--format',
+            choices=['csv', 'jsonl'],
+            default=None,
+            help='Input format (default: by file extension, csv otherwise)',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=10000,
+            help='Records per transaction (default: 10000)',
+        )
+        parser.add_argument(
+            '--method',
+            choices=['auto', 'copy', 'bulk'],
+            default='auto',
+            help='Load through PostgreSQL COPY or bulk_create (default: COPY on PostgreSQL)',
+        )
+        parser.add_argument(
+            '--checkpoint',
+            default=None,
+            help='Checkpoint file updated after every batch (default: <path>.checkpoint)',
+        )
+        parser.add_argument(
+            '--resume',
+            action='store_true',
+            help='Skip records already imported according to the checkpoint file',
+        )
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or ('jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv')
+        checkpoint_path = options['checkpoint'] or (None if path == '-' else f'{path}.checkpoint')
+        if options['resume'] and not checkpoint_path:
+            raise CommandError('Для --resume при чтении из stdin укажите --checkpoint')
+
+        state = {'processed': 0, 'inserted': 0, 'skipped': 0, 'invalid': 0}
+        if options['resume'] and os.path.exists(checkpoint_path):
+            with open(checkpoint_path, encoding='utf-8') as f:
+                state.update(json.load(f))
+            self.stdout.write(f"Продолжение импорта с записи {state['processed'] + 1}")
+
+        stream = sys.stdin if path == '-' else open(path, encoding='utf-8', newline='')
+        try:
+            self.import_stream(stream, file_format, state, checkpoint_path, options)
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+        linked, unresolved = link_imported_referrals()
+        self.stdout.write(f'Связано с пригласившими: {linked}')
+        truncated = False
+        if linked:
+            levels, truncated = ReferralClosure.rebuild()
+            self.stdout.write(f'Замыкание дерева рефералов перестроено, уровней: {levels}')
+        if unresolved:
+            self.stdout.write(self.style.WARNING(f'Пользователей с ненайденным activated_invite_code: {unresolved}'))
+
+        summary = (
+            f"добавлено {state['inserted']}, уже существовали {state['skipped']}, "
+            f"отклонено {state['invalid']}"
+        )
+        if truncated:
+            # Пользователи загружены, но замыкание неполное: скрипт развертывания должен это увидеть
+            raise CommandError(
+                f'Импорт завершен ({summary}), но перестройка замыкания остановлена на глубине {levels}: '
+                f'проверьте данные на циклы и слишком длинные цепочки и запустите backfill_referral_closure '
+                f'с большим --max-depth'
+            )
+        self.stdout.write(self.style.SUCCESS(f'Импорт завершен: {summary}'))
+
+    def import_stream(self, stream, file_format, state, checkpoint_path, options):
+        batch_size = options['batch_size']
+        records = read_records(stream, file_format)
+        # Уже загруженные записи пропускаются без проверки и обращений к БД
+        for _ in islice(records, state['processed']):
+            pass
+
+        started = time.monotonic()
+        imported_now = 0
+        while True:
+            batch = list(islice(records, batch_size))
+            if not batch:
+                break
+
+            result = import_batch(batch, state['processed'] + 1, method=options['method'])
+            for number, message in result.errors:
+                if options['verbosity'] > 1:
+                    self.stderr.write(f'Запись {number}: {message}')
+
+            state['processed'] += len(batch)
+            state['inserted'] += result.inserted
+            state['skipped'] += result.skipped
+            state['invalid'] += len(result.errors)
+            if checkpoint_path:
+                self.save_checkpoint(checkpoint_path, state)
+
+            imported_now += len(batch)
+            elapsed = time.monotonic() - started
+            self.stdout.write(
+                f"Обработано {state['processed']} записей ({imported_now / elapsed:.0f} в секунду), "
+                f"добавлено {state['inserted']}, отклонено {state['invalid']}"
+            )
+
+    @staticmethod
+    def save_checkpoint(checkpoint_path, state):
+        """Записывает состояние атомарно: прерванная запись не портит контрольную точку"""
+        tmp_path = f'{checkpoint_path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, checkpoint_path)
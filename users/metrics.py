@@ -0,0 +1,81 @@
+import os
+import glob
+from django.conf import settings
+from prometheus_client import CollectorRegistry, Counter, Histogram, REGISTRY, generate_latest
+from prometheus_client.multiprocess import MultiProcessCollector
+
+# При заданном PROMETHEUS_MULTIPROC_DIR значения пишутся в mmap-файлы процесса
+# (без блокировок между воркерами), а /metrics суммирует файлы всех процессов
+
+CODES_SENT = Counter(
+    'referral_codes_sent_total',
+    'Выданные коды верификации: новые (created) и повторно отправленные (reused)',
+    ['result'],
+)
+CODE_VERIFICATIONS = Counter(
+    'referral_code_verifications_total',
+    'Проверки кодов: success или код ошибки ответа (INVALID_CODE, CODE_EXPIRED, ...)',
+    ['result'],
+)
+INVITE_ACTIVATIONS = Counter(
+    'referral_invite_activations_total',
+    'Активации инвайт-кодов: success или код ошибки ответа',
+    ['result'],
+)
+CODE_GENERATION_RETRIES = Counter(
+    'referral_code_generation_retries_total',
+    'Повторные попытки генерации из-за занятого инвайт-кода',
+    ['operation'],
+)
+CLEANUP_DELETED_ROWS = Counter(
+    'referral_cleanup_deleted_rows_total',
+    'Строки, удаленные задачами очистки планировщика',
+    ['job'],
+)
+INVITE_CODE_CACHE = Counter(
+    'referral_invite_code_cache_total',
+    'Кеш инвайт-кодов воркера: hit, negative_hit (код не найден), miss и eviction (вытеснение по размеру)',
+    ['result'],
+)
+REQUEST_DURATION = Histogram(
+    'referral_request_duration_seconds',
+    'Время обработки запроса по маршруту',
+    ['view', 'method', 'status'],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+REQUEST_DB_QUERIES = Histogram(
+    'referral_request_db_queries',
+    'Число запросов к БД на запрос (только запросы из выборки PERFORMANCE_SETTINGS)',
+    ['view'],
+    buckets=(1, 2, 3, 5, 8, 13, 21, 34),
+)
+REQUEST_DB_DURATION = Histogram(
+    'referral_request_db_seconds',
+    'Время запросов к БД на запрос (только запросы из выборки PERFORMANCE_SETTINGS)',
+    ['view'],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+)
+
+
+class MultiDirectoryCollector:
+    """
+    MultiProcessCollector по нескольким каталогам: воркеры веб-сервера
+    и планировщик пишут файлы в свои каталоги, а выдаются общие суммы.
+    """
+
+    def __init__(self, paths):
+        self.paths = paths
+
+    def collect(self):
+        files = [path for directory in self.paths for path in glob.glob(os.path.join(directory, '*.db'))]
+        return MultiProcessCollector.merge(files, accumulate=True)
+
+
+def render_metrics():
+    """Текстовый формат Prometheus: суммы по всем процессам или реестр текущего процесса"""
+    directories = settings.METRICS_SETTINGS['multiprocess_dirs']
+    if not directories:
+        return generate_latest(REGISTRY)
+    registry = CollectorRegistry()
+    registry.register(MultiDirectoryCollector(directories))
+    return generate_latest(registry)
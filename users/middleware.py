@@ -0,0 +1,231 @@
+import time
+import random
+import logging
+from contextvars import ContextVar
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from .metrics import REQUEST_DURATION, REQUEST_DB_QUERIES, REQUEST_DB_DURATION
+
+logger = logging.getLogger(__name__)
+
+SESSION_REFRESHED_AT_KEY = '_refreshed_at'
+UNMATCHED_ROUTE = 'unmatched'
+# Замеры текущего запроса: контекст копируется и в потоки sync_to_async
+_request_timings = ContextVar('request_timings', default=None)
+
+
+class SessionRefreshMiddleware:
+    """
+    Скользящее продление сессии аутентифицированного пользователя не чаще
+    одного раза за SESSION_SETTINGS['refresh_interval_seconds'] вместо
+    сохранения сессии на каждый запрос (SESSION_SAVE_EVERY_REQUEST).
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.refresh_interval = settings.SESSION_SETTINGS['refresh_interval_seconds']
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        response = self.get_response(request)
+        self.refresh(request)
+        return response
+
+    async def __acall__(self, request):
+        response = await self.get_response(request)
+        self.refresh(request)
+        return response
+
+    def refresh(self, request):
+        # К этому моменту представление уже загрузило сессию, поэтому
+        # чтение ключей не обращается к хранилищу и безопасно под ASGI
+        session = getattr(request, 'session', None)
+        if session is None or not session.accessed or not session.get('user_id'):
+            return
+
+        now = int(time.time())
+        refreshed_at = session.get(SESSION_REFRESHED_AT_KEY, 0)
+        if session.modified or now - refreshed_at >= self.refresh_interval:
+            session[SESSION_REFRESHED_AT_KEY] = now
+
+
+def count_query(execute, sql, params, many, context):
+    """Обертка execute: учитывает запрос к БД в замерах текущего запроса, если он в выборке"""
+    timings = _request_timings.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.db += time.perf_counter() - started
+        timings.queries += 1
+
+
+def install_query_counter(sender, connection, **kwargs):
+    """
+    Обработчик connection_created (подключается в UsersConfig.ready): соединения
+    живут в своем потоке, поэтому обертка ставится на каждое из них, а не
+    на время запроса.
+    """
+    if count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, count_query)
+
+
+class RequestTimings:
+    """Замеры одного запроса: общее время, БД и рендеринг ответа DRF"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db = 0.0
+        self.render_started = None
+        self.render = 0.0
+
+    def start_render(self, response):
+        self.render_started = time.perf_counter()
+        response.add_post_render_callback(self.finish_render)
+
+    def finish_render(self, response):
+        self.render = time.perf_counter() - self.render_started
+
+
+def route_label(request):
+    """Шаблон маршрута для меток метрик: ограниченное число значений, в отличие от пути"""
+    match = getattr(request, 'resolver_match', None)
+    return match.route if match else UNMATCHED_ROUTE
+
+
+class MetricsMiddleware:
+    """Время обработки каждого запроса в гистограмме REQUEST_DURATION по маршруту, методу и статусу"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        started = time.perf_counter()
+        response = self.get_response(request)
+        self.observe(request, response, started)
+        return response
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        response = await self.get_response(request)
+        self.observe(request, response, started)
+        return response
+
+    @staticmethod
+    def observe(request, response, started):
+        if not settings.METRICS_SETTINGS['enabled']:
+            return
+        REQUEST_DURATION.labels(route_label(request), request.method, response.status_code).observe(
+            time.perf_counter() - started
+        )
+
+
+class PerformanceMiddleware:
+    """
+    Для доли запросов PERFORMANCE_SETTINGS['sample_rate'] замеряет общее время,
+    число запросов к БД и время в них (обертка count_query соединений) и время
+    рендеринга ответа. Замеры отдаются в заголовке Server-Timing и пишутся
+    в журнал отдельными полями, превышение бюджета запросов - предупреждением.
+    Запросы вне выборки проходят без оберток.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    @staticmethod
+    def sampled():
+        perf_settings = settings.PERFORMANCE_SETTINGS
+        return perf_settings['enabled'] and random.random() < perf_settings['sample_rate']
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not self.sampled():
+            return self.get_response(request)
+        timings = request._performance = RequestTimings()
+        token = _request_timings.set(timings)
+        try:
+            response = self.get_response(request)
+        finally:
+            _request_timings.reset(token)
+        self.report(request, response, timings)
+        return response
+
+    async def __acall__(self, request):
+        if not self.sampled():
+            return await self.get_response(request)
+        timings = request._performance = RequestTimings()
+        token = _request_timings.set(timings)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _request_timings.reset(token)
+        self.report(request, response, timings)
+        return response
+
+    def process_template_response(self, request, response):
+        timings = getattr(request, '_performance', None)
+        if timings is not None:
+            timings.start_render(response)
+        return response
+
+    def report(self, request, response, timings):
+        perf_settings = settings.PERFORMANCE_SETTINGS
+        match = getattr(request, 'resolver_match', None)
+        view = match.url_name if match else None
+        budget = perf_settings['query_budgets'].get(view, perf_settings['query_budget'])
+
+        fields = {
+            'http_method': request.method,
+            'path': request.path,
+            'view': view,
+            'status': response.status_code,
+            'duration_ms': round((time.perf_counter() - timings.started) * 1000, 3),
+            'db_queries': timings.queries,
+            'db_ms': round(timings.db * 1000, 3),
+            'render_ms': round(timings.render * 1000, 3),
+            'query_budget': budget,
+        }
+        if perf_settings['server_timing']:
+            response['Server-Timing'] = (
+                f"total;dur={fields['duration_ms']}, "
+                f"db;dur={fields['db_ms']};desc=\"{fields['db_queries']} queries\", "
+                f"render;dur={fields['render_ms']}"
+            )
+
+        if settings.METRICS_SETTINGS['enabled']:
+            route = route_label(request)
+            REQUEST_DB_QUERIES.labels(route).observe(timings.queries)
+            REQUEST_DB_DURATION.labels(route).observe(timings.db)
+
+        if budget is not None and fields['db_queries'] > budget:
+            logger.warning(
+                "Превышен бюджет запросов к БД: %s %s (%s) - %s запросов при бюджете %s",
+                request.method, request.path, view, fields['db_queries'], budget,
+                extra=fields
+            )
+        else:
+            logger.info(
+                "%s %s: %.1f мс, запросов к БД %s (%.1f мс), рендеринг %.1f мс",
+                request.method, request.path, fields['duration_ms'],
+                fields['db_queries'], fields['db_ms'], fields['render_ms'],
+                extra=fields
+            )
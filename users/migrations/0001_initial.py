@@ -0,0 +1,41 @@
+# Generated by Django 5.2.4 on 2026-10-18 06:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='User',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('phone_number', models.CharField(max_length=15, unique=True)),
+                ('invite_code', models.CharField(blank=True, max_length=10, null=True, unique=True)),
+                ('activated_invite_code', models.CharField(blank=True, max_length=10, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'db_table': 'referral_users',
+            },
+        ),
+        migrations.CreateModel(
+            name='VerificationCode',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('phone_number', models.CharField(max_length=15)),
+                ('code', models.CharField(max_length=4, unique=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('expires_at', models.DateTimeField()),
+            ],
+            options={
+                'db_table': 'referral_verification_codes',
+                'indexes': [models.Index(fields=['phone_number', 'created_at'], name='referral_ve_phone_n_a14b4d_idx'), models.Index(fields=['expires_at'], name='referral_ve_expires_d0c99d_idx'), models.Index(fields=['code'], name='referral_ve_code_1e134a_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.4 on 2026-10-18 06:45
+
+from django.db import migrations, models
+from django.db.models import Max
+
+
+def delete_duplicate_codes(apps, schema_editor):
+    """Оставляет для каждого номера только последний выданный код"""
+    VerificationCode = apps.get_model('users', 'VerificationCode')
+    latest_ids = (
+        VerificationCode.objects
+        .values('phone_number')
+        .annotate(latest_id=Max('id'))
+        .values('latest_id')
+    )
+    VerificationCode.objects.exclude(id__in=latest_ids).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_code_delivery'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='verificationcode',
+            name='referral_ve_phone_n_a14b4d_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='verificationcode',
+            name='referral_ve_code_1e134a_idx',
+        ),
+        migrations.AlterField(
+            model_name='verificationcode',
+            name='code',
+            field=models.CharField(max_length=4),
+        ),
+        migrations.RunPython(delete_duplicate_codes, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='verificationcode',
+            name='phone_number',
+            field=models.CharField(max_length=15, unique=True),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.2.4 on 2026-10-18 06:47
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+
+
+def populate_referrals(apps, schema_editor):
+    """Заполняет referred_by и referral_count по activated_invite_code"""
+    User = apps.get_model('users', 'User')
+    User.objects.filter(activated_invite_code__isnull=False).update(
+        referred_by=Subquery(
+            User.objects.filter(invite_code=OuterRef('activated_invite_code')).values('id')[:1]
+        )
+    )
+    referrer_ids = User.objects.filter(referred_by__isnull=False).values('referred_by')
+    User.objects.filter(id__in=referrer_ids).update(
+        referral_count=Subquery(
+            User.objects.filter(referred_by=OuterRef('pk'))
+            .values('referred_by')
+            .annotate(total=Count('id'))
+            .values('total')
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0004_invite_code_sequence'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='referral_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='referred_by',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='referrals', to='users.user'),
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['referred_by', 'id'], name='referral_us_referre_c1f498_idx'),
+        ),
+        migrations.RunPython(populate_referrals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,72 @@
+# Generated by Django 5.2.4 on 2026-10-18 06:49
+
+import random
+import string
+import django.db.models.functions.text
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Upper
+
+CANONICAL_CHARSET = string.ascii_uppercase + string.digits
+
+
+def canonicalize_invite_codes(apps, schema_editor):
+    """
+    Переводит инвайт-коды в верхний регистр. Если коды разных пользователей
+    совпадают без учета регистра, код сохраняет самый ранний пользователь,
+    остальные получают новые коды. Активированные коды пересчитываются
+    по referred_by, чтобы ссылаться на канонические коды пригласивших.
+    """
+    User = apps.get_model('users', 'User')
+
+    duplicates = (
+        User.objects.filter(invite_code__isnull=False)
+        .annotate(canonical=Upper('invite_code'))
+        .values('canonical')
+        .annotate(total=Count('id'))
+        .filter(total__gt=1)
+        .values_list('canonical', flat=True)
+    )
+    taken = None
+    for canonical in list(duplicates):
+        if taken is None:
+            taken = {code.upper() for code in User.objects.values_list('invite_code', flat=True) if code}
+        users = list(
+            User.objects.annotate(canonical=Upper('invite_code'))
+            .filter(canonical=canonical)
+            .order_by('id')
+        )
+        for user in users[1:]:
+            code = canonical
+            while code in taken:
+                code = ''.join(random.choices(CANONICAL_CHARSET, k=6))
+            taken.add(code)
+            user.invite_code = code
+            user.save(update_fields=['invite_code'])
+
+    User.objects.filter(invite_code__isnull=False).update(invite_code=Upper('invite_code'))
+    User.objects.filter(referred_by__isnull=False).update(
+        activated_invite_code=Subquery(
+            User.objects.filter(id=OuterRef('referred_by')).values('invite_code')[:1]
+        )
+    )
+    User.objects.filter(
+        referred_by__isnull=True,
+        activated_invite_code__isnull=False
+    ).update(activated_invite_code=Upper('activated_invite_code'))
+
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0005_referral_relation'),
+    ]
+
+    operations = [
+        migrations.RunPython(canonicalize_invite_codes, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='user',
+            constraint=models.CheckConstraint(condition=models.Q(('invite_code', django.db.models.functions.text.Upper('invite_code'))), name='referral_users_invite_code_canonical'),
+        ),
+    ]
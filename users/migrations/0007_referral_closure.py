@@ -0,0 +1,56 @@
+# Generated by Django 5.2.4 on 2026-10-18 07:06
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+MAX_DEPTH = 1000
+
+
+def populate_closure(apps, schema_editor):
+    """Строит замыкание по referred_by: один INSERT ... SELECT на уровень дерева"""
+    User = apps.get_model('users', 'User')
+    ReferralClosure = apps.get_model('users', 'ReferralClosure')
+    qn = schema_editor.connection.ops.quote_name
+    table = qn(ReferralClosure._meta.db_table)
+    users = qn(User._meta.db_table)
+
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {table} (ancestor_id, descendant_id, depth) "
+            f"SELECT referred_by_id, id, 1 FROM {users} WHERE referred_by_id IS NOT NULL"
+        )
+        level = 1
+        while cursor.rowcount and level < MAX_DEPTH:
+            cursor.execute(
+                f"INSERT INTO {table} (ancestor_id, descendant_id, depth) "
+                f"SELECT c.ancestor_id, u.id, c.depth + 1 FROM {table} c "
+                f"JOIN {users} u ON u.referred_by_id = c.descendant_id "
+                f"WHERE c.depth = %s AND u.id <> c.ancestor_id",
+                [level]
+            )
+            level += 1
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0006_canonical_invite_codes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReferralClosure',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('depth', models.PositiveIntegerField()),
+                ('ancestor', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='users.user')),
+                ('descendant', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='users.user')),
+            ],
+            options={
+                'db_table': 'referral_closure',
+                'indexes': [models.Index(fields=['ancestor', 'depth'], name='referral_cl_ancesto_f64101_idx')],
+                'constraints': [models.UniqueConstraint(fields=('descendant', 'ancestor'), name='referral_closure_unique_pair')],
+            },
+        ),
+        migrations.RunPython(populate_closure, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.4 on 2026-10-18 07:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0007_referral_closure'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(condition=models.Q(('referral_count__gt', 0)), fields=['-referral_count', 'id'], name='referral_users_leaderboard'),
+        ),
+    ]
@@ -0,0 +1,181 @@
+# Generated by Django 5.2.4 on 2026-10-18 07:26
+
+from collections import defaultdict
+from django.core.exceptions import ValidationError
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Q, Subquery
+from django.db.models.functions import Cast, Coalesce, Substr
+from users.phone import normalize_phone_number
+
+MAX_DEPTH = 1000
+BATCH_SIZE = 1000
+# '+' и цифры: такой номер уже в канонической форме или не нормализуется вовсе
+CANONICAL_PATTERN = r'^\+[0-9]+$'
+# Номера, для которых phone_number_key возвращает число
+PHONE_KEY_PATTERN = r'^\+[1-9][0-9]*$'
+
+
+def noncanonical_batches(model):
+    """
+    Пачки [(id, номер в канонической форме), ...] записей, где номер хранится
+    не в канонической форме. Записи вида '+' и цифры уже каноничны (или не
+    нормализуются вовсе) и отсекаются в запросе; остальные читаются по id
+    пачками. Номера, которые не удается нормализовать, остаются как есть.
+    """
+    rows = model.objects.exclude(phone_number__regex=CANONICAL_PATTERN).order_by('id')
+    last_id = 0
+    while True:
+        batch = list(rows.filter(id__gt=last_id).values_list('id', 'phone_number')[:BATCH_SIZE])
+        if not batch:
+            return
+        last_id = batch[-1][0]
+        converted = []
+        for row_id, phone_number in batch:
+            try:
+                converted.append((row_id, normalize_phone_number(phone_number)))
+            except ValidationError:
+                continue
+        yield converted
+
+
+def group_by_canonical(model):
+    """Номер в канонической форме -> id записей, где он хранится в другом виде"""
+    groups = defaultdict(list)
+    for batch in noncanonical_batches(model):
+        for row_id, canonical in batch:
+            groups[canonical].append(row_id)
+    return groups
+
+
+def is_descendant(User, user_id, ancestor_id):
+    """Пользователь user_id находится в дереве рефералов ancestor_id"""
+    for _ in range(MAX_DEPTH):
+        if user_id is None:
+            return False
+        if user_id == ancestor_id:
+            return True
+        user_id = User.objects.filter(id=user_id).values_list('referred_by_id', flat=True).first()
+    return True
+
+
+def merge_users(User, keeper, duplicates):
+    """
+    Переносит на keeper рефералов дубликатов и, если keeper никем не приглашен,
+    приглашение первого дубликата, не создающее цикла
+    """
+    duplicate_ids = [user.id for user in duplicates]
+    User.objects.filter(referred_by_id__in=duplicate_ids).exclude(id=keeper.id).update(
+        referred_by_id=keeper.id,
+        activated_invite_code=keeper.invite_code,
+    )
+    if keeper.referred_by_id in duplicate_ids:
+        keeper.referred_by_id = None
+        keeper.activated_invite_code = None
+    if keeper.referred_by_id is None:
+        for user in duplicates:
+            inviter_id = user.referred_by_id
+            if inviter_id is None or inviter_id in duplicate_ids or is_descendant(User, inviter_id, keeper.id):
+                continue
+            keeper.referred_by_id = inviter_id
+            keeper.activated_invite_code = user.activated_invite_code
+            break
+    User.objects.filter(id=keeper.id).update(
+        referred_by_id=keeper.referred_by_id,
+        activated_invite_code=keeper.activated_invite_code,
+    )
+    User.objects.filter(id__in=duplicate_ids).delete()
+
+
+def rebuild_referrals(apps, schema_editor):
+    """Пересчитывает referral_count и замыкание дерева после слияния пользователей"""
+    User = apps.get_model('users', 'User')
+    ReferralClosure = apps.get_model('users', 'ReferralClosure')
+    User.objects.update(
+        referral_count=Coalesce(
+            Subquery(
+                User.objects.filter(referred_by=OuterRef('pk'))
+                .values('referred_by')
+                .annotate(total=Count('id'))
+                .values('total')
+            ),
+            0,
+        )
+    )
+    qn = schema_editor.connection.ops.quote_name
+    table = qn(ReferralClosure._meta.db_table)
+    users = qn(User._meta.db_table)
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {table}")
+        cursor.execute(
+            f"INSERT INTO {table} (ancestor_id, descendant_id, depth) "
+            f"SELECT referred_by_id, id, 1 FROM {users} WHERE referred_by_id IS NOT NULL"
+        )
+        level = 1
+        while cursor.rowcount and level < MAX_DEPTH:
+            cursor.execute(
+                f"INSERT INTO {table} (ancestor_id, descendant_id, depth) "
+                f"SELECT c.ancestor_id, u.id, c.depth + 1 FROM {table} c "
+                f"JOIN {users} u ON u.referred_by_id = c.descendant_id "
+                f"WHERE c.depth = %s AND u.id <> c.ancestor_id",
+                [level]
+            )
+            level += 1
+
+
+def canonicalize_phone_numbers(apps, schema_editor):
+    """
+    Переводит номера в E.164 и заполняет phone_key. Пользователи, чьи номера
+    совпали после нормализации, сливаются в самого раннего: ему переходят
+    рефералы дубликатов. Из кодов верификации остается последний выданный,
+    записи доставки только переписываются. Читаются только записи с номером
+    не в канонической форме, phone_key заполняется в БД.
+    """
+    User = apps.get_model('users', 'User')
+    VerificationCode = apps.get_model('users', 'VerificationCode')
+    CodeDelivery = apps.get_model('users', 'CodeDelivery')
+
+    # Записи с той же канонической формой: переписанные номера и уже канонический
+    merged = False
+    for canonical, row_ids in group_by_canonical(User).items():
+        users = list(User.objects.filter(Q(id__in=row_ids) | Q(phone_number=canonical)).order_by('id'))
+        if len(users) > 1:
+            merge_users(User, users[0], users[1:])
+            merged = True
+        User.objects.filter(id=users[0].id).update(phone_number=canonical)
+    if merged:
+        rebuild_referrals(apps, schema_editor)
+
+    # Одним UPDATE: phone_key - цифры канонического номера (см. phone_number_key)
+    User.objects.filter(phone_number__regex=PHONE_KEY_PATTERN).update(
+        phone_key=Cast(Substr('phone_number', 2), models.BigIntegerField())
+    )
+
+    for canonical, row_ids in group_by_canonical(VerificationCode).items():
+        code_ids = list(
+            VerificationCode.objects.filter(Q(id__in=row_ids) | Q(phone_number=canonical))
+            .order_by('id').values_list('id', flat=True)
+        )
+        VerificationCode.objects.filter(id__in=code_ids[:-1]).delete()
+        VerificationCode.objects.filter(id=code_ids[-1]).update(phone_number=canonical)
+
+    for batch in noncanonical_batches(CodeDelivery):
+        CodeDelivery.objects.bulk_update(
+            [CodeDelivery(id=row_id, phone_number=canonical) for row_id, canonical in batch],
+            ['phone_number'],
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0008_leaderboard_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='phone_key',
+            field=models.BigIntegerField(blank=True, editable=False, null=True, unique=True),
+        ),
+        migrations.RunPython(canonicalize_phone_numbers, migrations.RunPython.noop),
+    ]
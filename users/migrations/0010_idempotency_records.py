@@ -0,0 +1,27 @@
+# Generated by Django 5.2.4 on 2026-10-18 07:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0009_canonical_phone_numbers'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IdempotencyRecord',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64, unique=True)),
+                ('status', models.PositiveSmallIntegerField()),
+                ('content', models.BinaryField()),
+                ('expires_at', models.DateTimeField()),
+            ],
+            options={
+                'db_table': 'referral_idempotency_records',
+                'indexes': [models.Index(fields=['expires_at'], name='referral_id_expires_c35b24_idx')],
+            },
+        ),
+    ]
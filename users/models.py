@@ -1,21 +1,96 @@
 import random
 import string
-from django.db import models
+from asgiref.sync import sync_to_async
+from django.db import models, transaction, connection, IntegrityError
+from django.db.models import Count, F, Max, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce, Upper
 from django.utils import timezone
 from django.conf import settings
 from datetime import timedelta
-from .exceptions import CodeGenerationError
+from .exceptions import CodeGenerationError, ReferralCycleError
+from .metrics import CODE_GENERATION_RETRIES
+from .profile_cache import invalidate_profiles
+from .invite_cache import MISSING, cached_user_id, invalidate_invite_codes, remember_user_id
+from .invite_codes import next_sequence_code, reserve_sequence_codes, normalize_invite_code
+from .phone import phone_number_key
+from .cleanup import delete_in_batches
 
 class User(models.Model):
     phone_number = models.CharField(max_length=15, unique=True)
+    # Номер в E.164 целым числом: индекс по bigint компактнее индекса по строке
+    phone_key = models.BigIntegerField(unique=True, blank=True, null=True, editable=False)
     invite_code = models.CharField(max_length=10, unique=True, blank=True, null=True)
     activated_invite_code = models.CharField(max_length=10, blank=True, null=True)
+    referred_by = models.ForeignKey(
+        'self',
+        on_delete=models.SET_NULL,
+        blank=True,
+        null=True,
+        related_name='referrals',
+        db_index=False
+    )
+    referral_count = models.PositiveIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
 
     def save(self, *args, **kwargs):
+        self.phone_key = phone_number_key(self.phone_number)
         if not self.invite_code:
+            self._save_with_new_invite_code(*args, **kwargs)
+        else:
+            self.invite_code = normalize_invite_code(self.invite_code)
+            super().save(*args, **kwargs)
+        invalidate_profiles([self.pk])
+        invalidate_invite_codes([self.invite_code])
+
+    def _save_with_new_invite_code(self, *args, **kwargs):
+        """
+        Сохраняет пользователя с новым invite кодом. Код из последовательности
+        может совпасть со случайным кодом, выданным до перехода в режим 'sequence':
+        тогда сохранение повторяется со следующим кодом в точке сохранения.
+        """
+        max_attempts = settings.INVITE_CODE_SETTINGS['max_attempts']
+
+        for attempt in range(max_attempts):
             self.invite_code = self.generate_unique_invite_code()
-        super().save(*args, **kwargs)
+            try:
+                with transaction.atomic():
+                    super().save(*args, **kwargs)
+                return
+            except IntegrityError:
+                if not User.objects.filter(invite_code=self.invite_code).exists():
+                    raise
+                CODE_GENERATION_RETRIES.labels('invite_code').inc()
+
+        raise CodeGenerationError(
+            f"Не удалось сгенерировать уникальный invite код за {max_attempts} попыток"
+        )
+
+    @classmethod
+    def by_invite_code(cls, invite_code):
+        """Пользователи с данным инвайт-кодом (поиск без учета регистра по уникальному индексу)"""
+        return cls.objects.filter(invite_code=normalize_invite_code(invite_code))
+
+    @classmethod
+    def inviter_id_by_code(cls, invite_code):
+        """
+        id пользователя с данным инвайт-кодом или None. Повторные попытки
+        с тем же кодом, в том числе несуществующим, обслуживает кеш воркера.
+        """
+        code = normalize_invite_code(invite_code)
+        user_id = cached_user_id(code)
+        if user_id is MISSING:
+            user_id = cls.by_invite_code(code).values_list('id', flat=True).first()
+            remember_user_id(code, user_id)
+        return user_id
+
+    @classmethod
+    async def ainviter_id_by_code(cls, invite_code):
+        code = normalize_invite_code(invite_code)
+        user_id = cached_user_id(code)
+        if user_id is MISSING:
+            user_id = await cls.by_invite_code(code).values_list('id', flat=True).afirst()
+            remember_user_id(code, user_id)
+        return user_id
 
     @classmethod
     def generate_invite_code(cls, length=None, charset=None):
@@ -28,28 +103,359 @@ class User(models.Model):
         return ''.join(random.choices(charset, k=length))
 
     def generate_unique_invite_code(self):
-        """Генерирует уникальный invite код с ограничением попыток"""
+        """
+        Генерирует уникальный invite код с ограничением попыток.
+        В режиме 'sequence' код выводится из значения последовательности
+        без проверочных запросов: совпадение со старым случайным кодом
+        обрабатывает повтор сохранения в save().
+        """
+        if settings.INVITE_CODE_SETTINGS['mode'] == 'sequence':
+            return next_sequence_code()
+        
         max_attempts = settings.INVITE_CODE_SETTINGS['max_attempts']
         
         for attempt in range(max_attempts):
             code = self.generate_invite_code()
             if not User.objects.filter(invite_code=code).exists():
                 return code
+            CODE_GENERATION_RETRIES.labels('invite_code').inc()
+        
+        raise CodeGenerationError(
+            f"Не удалось сгенерировать уникальный invite код за {max_attempts} попыток"
+        )
+    
+    @classmethod
+    def get_or_create_by_phone(cls, phone_number):
+        """
+        Находит или создает пользователя одним запросом
+        INSERT ... ON CONFLICT (phone_number) DO UPDATE ... RETURNING.
+        Новый пользователь определяется по совпадению created_at со значением,
+        переданным при вставке. При совпадении invite кода вставка повторяется
+        с новым кодом (вне транзакции), без предварительных проверок exists().
+        """
+        max_attempts = settings.INVITE_CODE_SETTINGS['max_attempts']
+        sequence_mode = settings.INVITE_CODE_SETTINGS['mode'] == 'sequence'
+        
+        for attempt in range(max_attempts):
+            candidate = cls(
+                phone_number=phone_number,
+                phone_key=phone_number_key(phone_number),
+                invite_code=next_sequence_code() if sequence_mode else cls.generate_invite_code()
+            )
+            try:
+                user = cls._upsert_by_phone(candidate)
+            except IntegrityError:
+                if connection.in_atomic_block:
+                    raise
+                CODE_GENERATION_RETRIES.labels('user_upsert').inc()
+                continue
+            created = user.created_at == candidate.created_at
+            if created:
+                invalidate_invite_codes([user.invite_code])
+            return user, created
         
         raise CodeGenerationError(
             f"Не удалось сгенерировать уникальный invite код за {max_attempts} попыток"
         )
     
+    @classmethod
+    def _upsert_by_phone(cls, user):
+        """Вставляет пользователя или возвращает существующего с тем же номером"""
+        qn = connection.ops.quote_name
+        fields = [field for field in cls._meta.concrete_fields if not field.primary_key]
+        columns = ', '.join(qn(field.column) for field in fields)
+        placeholders = ', '.join(['%s'] * len(fields))
+        returning = ', '.join(qn(field.column) for field in cls._meta.concrete_fields)
+        phone_column = qn(cls._meta.get_field('phone_number').column)
+        params = [
+            field.get_db_prep_save(field.pre_save(user, True), connection)
+            for field in fields
+        ]
+        sql = (
+            f"INSERT INTO {qn(cls._meta.db_table)} ({columns}) VALUES ({placeholders}) "
+            f"ON CONFLICT ({phone_column}) DO UPDATE SET {phone_column} = EXCLUDED.{phone_column} "
+            f"RETURNING {returning}"
+        )
+        return list(cls.objects.raw(sql, params))[0]
+    
+    @classmethod
+    def generate_invite_codes(cls, count):
+        """
+        Генерирует count уникальных invite кодов для массовой вставки.
+        Коды, уже занятые в базе (например, случайные коды, выданные до
+        перехода в режим 'sequence'), отбрасываются одним запросом на пачку.
+        """
+        sequence_mode = settings.INVITE_CODE_SETTINGS['mode'] == 'sequence'
+        max_attempts = settings.INVITE_CODE_SETTINGS['max_attempts']
+        codes = set()
+        
+        for attempt in range(max_attempts):
+            missing = count - len(codes)
+            if missing == 0:
+                break
+            if attempt:
+                CODE_GENERATION_RETRIES.labels('invite_code_batch').inc()
+            if sequence_mode:
+                candidates = set(reserve_sequence_codes(missing))
+            else:
+                candidates = {cls.generate_invite_code() for _ in range(missing)} - codes
+            candidates = list(candidates)
+            for start in range(0, len(candidates), 5000):
+                chunk = candidates[start:start + 5000]
+                taken = set(
+                    cls.objects.filter(invite_code__in=chunk).values_list('invite_code', flat=True)
+                )
+                codes.update(code for code in chunk if code not in taken)
+        
+        if len(codes) < count:
+            raise CodeGenerationError(
+                f"Не удалось сгенерировать {count} уникальных invite кодов за {max_attempts} попыток"
+            )
+        return list(codes)
+    
+    @classmethod
+    def assign_invite_codes(cls, users):
+        """Проставляет invite коды пользователям без кода (без сохранения)"""
+        users = [user for user in users if not user.invite_code]
+        for user, code in zip(users, cls.generate_invite_codes(len(users))):
+            user.invite_code = code
+        return users
+    
+    def referral_preview(self):
+        """Номера последних рефералов для профиля (полный список - в /api/profile/referrals/)"""
+        return self.referrals.order_by('-id').values_list('phone_number', flat=True)[
+            :settings.REFERRAL_SETTINGS['profile_preview_size']
+        ]
+    
+    def activate_invite(self, inviter):
+        """
+        Привязывает пользователя к пригласившему, атомарно увеличивает
+        счетчик рефералов пригласившего и дополняет замыкание дерева рефералов.
+        Возвращает False, если инвайт-код уже был активирован, выбрасывает
+        ReferralCycleError, если пригласивший находится в поддереве пользователя,
+        и User.DoesNotExist, если у пригласившего больше нет кода inviter.invite_code.
+        """
+        with transaction.atomic():
+            locked_codes = self._lock_activation_rows(inviter)
+            # Пригласивший мог быть найден по устаревшей записи кеша инвайт-кодов
+            if locked_codes.get(inviter.id) != inviter.invite_code:
+                raise User.DoesNotExist(
+                    f"У пользователя {inviter.id} нет инвайт-кода {inviter.invite_code}"
+                )
+            if ReferralClosure.objects.filter(ancestor_id=self.id, descendant_id=inviter.id).exists():
+                raise ReferralCycleError(
+                    f"Пользователь {inviter.id} входит в дерево рефералов пользователя {self.id}"
+                )
+            updated = User.objects.filter(
+                id=self.id,
+                activated_invite_code__isnull=True
+            ).update(
+                activated_invite_code=inviter.invite_code,
+                referred_by=inviter
+            )
+            if not updated:
+                return False
+            User.objects.filter(id=inviter.id).update(referral_count=F('referral_count') + 1)
+            ReferralClosure.link(inviter.id, self.id)
+            # Меняются профиль пользователя и счетчик и превью рефералов пригласившего
+            invalidate_profiles([self.id, inviter.id])
+        
+        self.activated_invite_code = inviter.invite_code
+        self.referred_by = inviter
+        return True
+
+    def _lock_activation_rows(self, inviter):
+        """
+        Блокирует в порядке id строки пользователя, пригласившего и корня дерева
+        пригласившего; возвращает {id: invite_code} заблокированных строк.
+        Пользователь без активированного кода сам корень своего дерева, а цикл
+        возникает, только если две активации встречно соединяют два дерева
+        (корень X в дерево Z и корень Z в дерево X). Обе такие активации
+        блокируют корни X и Z, поэтому выполняются по очереди, и вторая видит
+        замыкание, дополненное первой.
+        """
+        root = ReferralClosure.objects.filter(descendant_id=inviter.id).order_by('-depth').values('ancestor_id')[:1]
+        lock = Q(id__in=[self.id, inviter.id]) | Q(id=Subquery(root))
+        locked_codes = {}
+        while True:
+            locked_codes.update(
+                User.objects.select_for_update()
+                .filter(lock)
+                .order_by('id')
+                .values_list('id', 'invite_code')
+            )
+            # Пока ожидалась блокировка, дерево пригласившего могло быть
+            # подвешено к другому: тогда блокируется и новый корень. Такая
+            # блокировка берется не по порядку id, и редкую взаимную
+            # блокировку PostgreSQL разрешает, отменяя одну из транзакций
+            root_id = ReferralClosure.root_of(inviter.id)
+            if root_id in locked_codes or inviter.id not in locked_codes:
+                return locked_codes
+            lock = Q(id=root_id)
+
+    @classmethod
+    def reconcile_referral_counts(cls, batch_size=None):
+        """
+        Исправляет расхождения referral_count с фактическим числом рефералов
+        (например, после ручных правок referred_by). Пользователи обходятся
+        диапазонами id по batch_size, каждый диапазон - один UPDATE только
+        для строк с расхождением. Возвращает число исправленных счетчиков.
+        """
+        if batch_size is None:
+            batch_size = settings.LEADERBOARD_SETTINGS['reconcile_batch_size']
+        actual = Coalesce(
+            Subquery(
+                cls.objects.filter(referred_by=OuterRef('pk'))
+                .order_by()
+                .values('referred_by')
+                .annotate(total=Count('id'))
+                .values('total')
+            ),
+            0
+        )
+        max_id = cls.objects.aggregate(max_id=Max('id'))['max_id'] or 0
+        fixed = 0
+        for start in range(0, max_id, batch_size):
+            fixed += (
+                cls.objects.filter(id__gt=start, id__lte=start + batch_size)
+                .annotate(actual=actual)
+                .exclude(referral_count=F('actual'))
+                .update(referral_count=actual)
+            )
+        return fixed
+
     def __str__(self):
         return f"{self.phone_number} ({self.invite_code})"
 
     class Meta:
         db_table = 'referral_users'
+        indexes = [
+            models.Index(fields=['referred_by', 'id']),
+            # Рейтинг пригласивших: только пользователи с рефералами
+            models.Index(
+                fields=['-referral_count', 'id'],
+                condition=Q(referral_count__gt=0),
+                name='referral_users_leaderboard',
+            ),
+        ]
+        constraints = [
+            models.CheckConstraint(
+                condition=Q(invite_code=Upper('invite_code')),
+                name='referral_users_invite_code_canonical'
+            ),
+        ]
+
+
+class ReferralClosure(models.Model):
+    """
+    Замыкание дерева рефералов: строка на каждую пару (предок, потомок)
+    с расстоянием между ними. Размер поддерева и число рефералов по уровням
+    читаются одним запросом независимо от глубины дерева.
+    """
+    ancestor = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+', db_index=False)
+    descendant = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+', db_index=False)
+    depth = models.PositiveIntegerField()
+
+    @classmethod
+    def link(cls, ancestor_id, descendant_id):
+        """
+        Подвешивает поддерево descendant_id под ancestor_id одним INSERT ... SELECT:
+        каждый предок ancestor_id (и он сам) соединяется с каждым потомком
+        descendant_id (и с ним самим).
+        """
+        qn = connection.ops.quote_name
+        table = qn(cls._meta.db_table)
+        ancestor, descendant, depth = qn('ancestor_id'), qn('descendant_id'), qn('depth')
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {table} ({ancestor}, {descendant}, {depth}) "
+                f"SELECT up.{ancestor}, down.{descendant}, up.{depth} + down.{depth} + 1 FROM "
+                f"(SELECT {ancestor}, {depth} FROM {table} WHERE {descendant} = %s "
+                f"UNION ALL SELECT %s, 0) up CROSS JOIN "
+                f"(SELECT {descendant}, {depth} FROM {table} WHERE {ancestor} = %s "
+                f"UNION ALL SELECT %s, 0) down",
+                [ancestor_id, ancestor_id, descendant_id, descendant_id]
+            )
+
+    @classmethod
+    def root_of(cls, user_id):
+        """id корня дерева рефералов, в которое входит пользователь (самого пользователя, если его никто не пригласил)"""
+        root_id = (
+            cls.objects.filter(descendant_id=user_id)
+            .order_by('-depth')
+            .values_list('ancestor_id', flat=True)
+            .first()
+        )
+        return user_id if root_id is None else root_id
+
+    @classmethod
+    def rebuild(cls, max_depth=None):
+        """
+        Пересобирает замыкание по referred_by: один INSERT ... SELECT на уровень
+        дерева. Возвращает число уровней и признак того, что перестройка
+        остановлена на max_depth (в данных есть цикл или слишком глубокая цепочка).
+        """
+        if max_depth is None:
+            max_depth = settings.REFERRAL_SETTINGS['max_tree_depth']
+        qn = connection.ops.quote_name
+        table = qn(cls._meta.db_table)
+        users = qn(User._meta.db_table)
+        ancestor, descendant, depth = qn('ancestor_id'), qn('descendant_id'), qn('depth')
+        referred_by = qn('referred_by_id')
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {table}")
+            cursor.execute(
+                f"INSERT INTO {table} ({ancestor}, {descendant}, {depth}) "
+                f"SELECT {referred_by}, {qn('id')}, 1 FROM {users} WHERE {referred_by} IS NOT NULL"
+            )
+            level = 1 if cursor.rowcount else 0
+            while level and level < max_depth:
+                cursor.execute(
+                    f"INSERT INTO {table} ({ancestor}, {descendant}, {depth}) "
+                    f"SELECT c.{ancestor}, u.{qn('id')}, c.{depth} + 1 FROM {table} c "
+                    f"JOIN {users} u ON u.{referred_by} = c.{descendant} "
+                    # Цикл в загруженных данных обрывается, не порождая пару (A, A)
+                    f"WHERE c.{depth} = %s AND u.{qn('id')} <> c.{ancestor}",
+                    [level]
+                )
+                if not cursor.rowcount:
+                    return level, False
+                level += 1
+        return level, bool(level)
+
+    @classmethod
+    def downline_levels(cls, user_id):
+        """Число рефералов пользователя на каждом уровне дерева: [(глубина, число), ...]"""
+        return list(
+            cls.objects.filter(ancestor_id=user_id)
+            .values('depth')
+            .annotate(count=Count('id'))
+            .order_by('depth')
+            .values_list('depth', 'count')
+        )
+
+    class Meta:
+        db_table = 'referral_closure'
+        indexes = [
+            models.Index(fields=['ancestor', 'depth']),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['descendant', 'ancestor'], name='referral_closure_unique_pair'),
+        ]
+
+
+# Новый код номера заменяет предыдущий одним INSERT ... ON CONFLICT
+CODE_UPSERT_OPTIONS = {
+    'update_conflicts': True,
+    'unique_fields': ['phone_number'],
+    'update_fields': ['code', 'created_at', 'expires_at'],
+}
 
 
 class VerificationCode(models.Model):
-    phone_number = models.CharField(max_length=15)
-    code = models.CharField(max_length=4, unique=True)  
+    phone_number = models.CharField(max_length=15, unique=True)
+    code = models.CharField(max_length=4)
     created_at = models.DateTimeField(auto_now_add=True)
     expires_at = models.DateTimeField()
     
@@ -67,34 +473,108 @@ class VerificationCode(models.Model):
 
     @classmethod
     def create_code(cls, phone_number, length=None, charset=None, expiration_minutes=None):
-        """Создает код верификации с настройками из settings"""
-        cls.objects.filter(phone_number=phone_number).delete()
-        
+        """
+        Создает код верификации с настройками из settings.
+        Коды уникальны в пределах номера телефона, поэтому код выдается одним
+        запросом INSERT ... ON CONFLICT, заменяющим предыдущий код номера.
+        В режиме resend_mode='reuse' действующий код, выданный не раньше
+        reuse_threshold_seconds назад, сохраняется (см. _upsert_reusing).
+        """
+        verification_code = cls._new_code(phone_number, length, charset, expiration_minutes)
+        if settings.VERIFICATION_CODE_SETTINGS['resend_mode'] == 'reuse':
+            return cls._upsert_reusing(verification_code)
+        cls.objects.bulk_create([verification_code], **CODE_UPSERT_OPTIONS)
+        verification_code.reused = False
+        return verification_code
+
+    @classmethod
+    async def acreate_code(cls, phone_number, length=None, charset=None, expiration_minutes=None):
+        """Асинхронный вариант create_code для ASGI-представлений"""
+        if settings.VERIFICATION_CODE_SETTINGS['resend_mode'] == 'reuse':
+            # Сырой upsert с RETURNING не имеет асинхронного API ORM
+            return await sync_to_async(cls.create_code)(phone_number, length, charset, expiration_minutes)
+        verification_code = cls._new_code(phone_number, length, charset, expiration_minutes)
+        await cls.objects.abulk_create([verification_code], **CODE_UPSERT_OPTIONS)
+        verification_code.reused = False
+        return verification_code
+
+    @classmethod
+    def _upsert_reusing(cls, verification_code):
+        """
+        Вставляет код или при конфликте по номеру одним запросом решает,
+        сохранить ли существующий код: он сохраняется, если еще действителен
+        и выдан позже порога повторного использования, иначе заменяется новым.
+        При extend_on_reuse срок сохраненного кода продлевается.
+        Возвращает строку после вставки с признаком reused.
+        """
+        code_settings = settings.VERIFICATION_CODE_SETTINGS
+        qn = connection.ops.quote_name
+        table = qn(cls._meta.db_table)
+        fields = [field for field in cls._meta.concrete_fields if not field.primary_key]
+        columns = ', '.join(qn(field.column) for field in fields)
+        placeholders = ', '.join(['%s'] * len(fields))
+        returning = ', '.join(qn(field.column) for field in cls._meta.concrete_fields)
+        params = [
+            field.get_db_prep_save(field.pre_save(verification_code, True), connection)
+            for field in fields
+        ]
+        reuse_after = verification_code.created_at - timedelta(seconds=code_settings['reuse_threshold_seconds'])
+        reuse_after = connection.ops.adapt_datetimefield_value(reuse_after)
+
+        reuse = (
+            f"{table}.{qn('expires_at')} > EXCLUDED.{qn('created_at')} "
+            f"AND {table}.{qn('created_at')} > %s"
+        )
+        kept_expiry = 'EXCLUDED' if code_settings['extend_on_reuse'] else table
+        kept = {'code': table, 'created_at': table, 'expires_at': kept_expiry}
+        # Все CASE видят старую строку, поэтому условие одинаково для трех колонок
+        assignments = ', '.join(
+            f"{qn(column)} = CASE WHEN {reuse} THEN {source}.{qn(column)} "
+            f"ELSE EXCLUDED.{qn(column)} END"
+            for column, source in kept.items()
+        )
+        sql = (
+            f"INSERT INTO {table} ({columns}) VALUES ({placeholders}) "
+            f"ON CONFLICT ({qn('phone_number')}) DO UPDATE SET {assignments} "
+            f"RETURNING {returning}"
+        )
+        code = list(cls.objects.raw(sql, params + [reuse_after] * len(kept)))[0]
+        code.reused = code.created_at != verification_code.created_at
+        return code
+
+    @classmethod
+    def _new_code(cls, phone_number, length=None, charset=None, expiration_minutes=None):
         if expiration_minutes is None:
             expiration_minutes = settings.VERIFICATION_CODE_SETTINGS['expiration_minutes']
         
-        expires_at = timezone.now() + timedelta(minutes=expiration_minutes)
-        
-        max_attempts = settings.VERIFICATION_CODE_SETTINGS['max_attempts']
-        code = None
-        
-        for attempt in range(max_attempts):
-            candidate_code = cls.generate_verification_code(length, charset)
-            if not cls.objects.filter(code=candidate_code).exists():
-                code = candidate_code
-                break
-        
-        if code is None:
-            raise CodeGenerationError(
-                f"Не удалось сгенерировать уникальный verification код за {max_attempts} попыток"
-            )
-        
-        verification_code = cls.objects.create(
+        return cls(
             phone_number=phone_number,
-            code=code,
-            expires_at=expires_at
+            code=cls.generate_verification_code(length, charset),
+            expires_at=timezone.now() + timedelta(minutes=expiration_minutes)
         )
-        return verification_code
+    
+    @classmethod
+    def consume(cls, phone_number, code):
+        """
+        Атомарно забирает код одним запросом DELETE ... RETURNING.
+        Возвращает True для действительного кода, False для просроченного
+        (он тоже удаляется) и None, если такого кода нет. Из параллельных
+        запросов с одним кодом успешным может быть только один.
+        """
+        qn = connection.ops.quote_name
+        now = connection.ops.adapt_datetimefield_value(timezone.now())
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"DELETE FROM {qn(cls._meta.db_table)} "
+                f"WHERE {qn('phone_number')} = %s AND {qn('code')} = %s "
+                f"RETURNING {qn('expires_at')} > %s",
+                [phone_number, code, now]
+            )
+            row = cursor.fetchone()
+        
+        if row is None:
+            return None
+        return bool(row[0])
     
     def is_valid(self):
         """Проверяет, действителен ли код"""
@@ -108,12 +588,18 @@ class VerificationCode(models.Model):
         return False
     
     @classmethod
-    def cleanup_expired_codes(cls):
-        """Удаляет все просроченные коды"""
-        expired_codes = cls.objects.filter(expires_at__lt=timezone.now())
-        count = expired_codes.count()
-        expired_codes.delete()
-        return count
+    def cleanup_expired_codes(cls, batch_size=None, time_budget=None, max_batches_per_second=None):
+        """Удаляет просроченные коды пачками, возвращает CleanupResult"""
+        qn = connection.ops.quote_name
+        return delete_in_batches(
+            cls,
+            f"{qn('expires_at')} < %s",
+            [connection.ops.adapt_datetimefield_value(timezone.now())],
+            order_by=qn('expires_at'),
+            batch_size=batch_size,
+            time_budget=time_budget,
+            max_batches_per_second=max_batches_per_second
+        )
 
     def __str__(self):
         return f"{self.phone_number}: {self.code}"
@@ -121,7 +607,92 @@ class VerificationCode(models.Model):
     class Meta:
         db_table = 'referral_verification_codes'
         indexes = [
+            models.Index(fields=['expires_at']),
+        ]
+
+
+class CodeDelivery(models.Model):
+    """Исходящее сообщение с кодом верификации (outbox для фоновой отправки)"""
+    STATUS_PENDING = 'pending'
+    STATUS_SENDING = 'sending'
+    STATUS_SENT = 'sent'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Ожидает отправки'),
+        (STATUS_SENDING, 'Отправляется'),
+        (STATUS_SENT, 'Отправлено'),
+        (STATUS_FAILED, 'Ошибка отправки'),
+    ]
+
+    phone_number = models.CharField(max_length=15)
+    code = models.CharField(max_length=4)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.CharField(max_length=255, blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Время, когда диспетчер забрал сообщение на отправку (статус 'sending')
+    claimed_at = models.DateTimeField(blank=True, null=True)
+    sent_at = models.DateTimeField(blank=True, null=True)
+
+    @classmethod
+    def latest_for_phone(cls, phone_number):
+        """Возвращает последнюю доставку для номера телефона"""
+        return cls.objects.filter(phone_number=phone_number).order_by('-id').first()
+
+    @classmethod
+    def cleanup_old_deliveries(cls, retention_hours=None):
+        """Удаляет завершенные доставки старше срока хранения"""
+        if retention_hours is None:
+            retention_hours = settings.CODE_DELIVERY_SETTINGS['retention_hours']
+
+        threshold = timezone.now() - timedelta(hours=retention_hours)
+        qn = connection.ops.quote_name
+        return delete_in_batches(
+            cls,
+            f"{qn('created_at')} < %s AND {qn('status')} IN (%s, %s)",
+            [connection.ops.adapt_datetimefield_value(threshold), cls.STATUS_SENT, cls.STATUS_FAILED],
+            order_by=qn('id')
+        ).deleted
+
+    def __str__(self):
+        return f"{self.phone_number}: {self.status}"
+
+    class Meta:
+        db_table = 'referral_code_deliveries'
+        indexes = [
+            models.Index(fields=['status', 'id']),
             models.Index(fields=['phone_number', 'created_at']),
+        ]
+
+
+class IdempotencyRecord(models.Model):
+    """Сохраненный ответ на запрос с заголовком Idempotency-Key"""
+    # sha256 от эндпоинта, номера или пользователя и значения заголовка
+    key = models.CharField(max_length=64, unique=True)
+    # 0 - ключ зарезервирован, запрос еще выполняется
+    status = models.PositiveSmallIntegerField()
+    content = models.BinaryField()
+    expires_at = models.DateTimeField()
+
+    @classmethod
+    def cleanup_expired(cls, batch_size=None, time_budget=None, max_batches_per_second=None):
+        """Удаляет просроченные ответы пачками, возвращает CleanupResult"""
+        qn = connection.ops.quote_name
+        return delete_in_batches(
+            cls,
+            f"{qn('expires_at')} < %s",
+            [connection.ops.adapt_datetimefield_value(timezone.now())],
+            order_by=qn('expires_at'),
+            batch_size=batch_size,
+            time_budget=time_budget,
+            max_batches_per_second=max_batches_per_second
+        )
+
+    def __str__(self):
+        return f"{self.key}: {self.status}"
+
+    class Meta:
+        db_table = 'referral_idempotency_records'
+        indexes = [
             models.Index(fields=['expires_at']),
-            models.Index(fields=['code']),
-        ]
\ No newline at end of file
+        ]
@@ -0,0 +1,83 @@
+import os
+import json
+import hashlib
+from django.conf import settings
+from django.templatetags.static import static
+from django.urls import include, path
+from drf_yasg import openapi
+from drf_yasg.codecs import OpenAPICodecJson
+from drf_yasg.generators import OpenAPISchemaGenerator
+
+API_INFO = openapi.Info(
+    title="Referral System API",
+    default_version='v1',
+    description="API for referral system with phone authentication",
+)
+SCHEMA_DIR = 'openapi'
+SCHEMA_MANIFEST = os.path.join(SCHEMA_DIR, 'manifest.json')
+
+_schema = None
+_schema_json = None
+_schema_path = None
+
+
+def get_schema():
+    """
+    Схема OpenAPI, построенная один раз на процесс. Строится без запроса:
+    схема публичная и не зависит от пользователя, а хост Swagger UI берет
+    из адреса страницы. Маршруты берутся из синхронных DRF-представлений,
+    поэтому схема одна и та же при SERVER_MODE=wsgi и asgi.
+    """
+    global _schema
+    if _schema is None:
+        # Ленивый импорт: urls импортирует views, а views - этот модуль
+        from .urls import schema_urlpatterns
+        patterns = [path('api/', include(schema_urlpatterns))]
+        _schema = OpenAPISchemaGenerator(API_INFO, patterns=patterns).get_schema(request=None, public=True)
+    return _schema
+
+
+def get_schema_json():
+    """Схема в JSON (байты), закодированная один раз на процесс"""
+    global _schema_json
+    if _schema_json is None:
+        _schema_json = OpenAPICodecJson(validators=[]).encode(get_schema())
+    return _schema_json
+
+
+class CachedSchemaGenerator(OpenAPISchemaGenerator):
+    """Генератор для get_schema_view: отдает схему процесса вместо разбора представлений на каждый запрос"""
+
+    def get_schema(self, request=None, public=False):
+        return get_schema()
+
+
+def write_schema(static_root):
+    """
+    Записывает схему в static_root/openapi/openapi.<хеш>.json и манифест
+    с путем к ней. Имя меняется вместе с содержимым, поэтому файл можно
+    кешировать без срока. Возвращает путь относительно static_root.
+    """
+    content = get_schema_json()
+    path = os.path.join(SCHEMA_DIR, f'openapi.{hashlib.sha256(content).hexdigest()[:12]}.json')
+    os.makedirs(os.path.join(static_root, SCHEMA_DIR), exist_ok=True)
+    with open(os.path.join(static_root, path), 'wb') as f:
+        f.write(content)
+    manifest_path = os.path.join(static_root, SCHEMA_MANIFEST)
+    with open(f'{manifest_path}.tmp', 'w', encoding='utf-8') as f:
+        json.dump({'schema': path}, f)
+    os.replace(f'{manifest_path}.tmp', manifest_path)
+    return path
+
+
+def get_schema_static_url():
+    """URL файла схемы, собранного командой build_openapi_schema, или None, если его нет"""
+    global _schema_path
+    if _schema_path is None:
+        try:
+            with open(os.path.join(settings.STATIC_ROOT, SCHEMA_MANIFEST), encoding='utf-8') as f:
+                _schema_path = json.load(f)['schema']
+        except (OSError, ValueError, KeyError):
+            # Без файла схема отдается из памяти процесса, повторно манифест не читается
+            _schema_path = ''
+    return static(_schema_path) if _schema_path else None
@@ -0,0 +1,10 @@
+from django.conf import settings
+from rest_framework.pagination import CursorPagination
+
+
+class ReferralCursorPagination(CursorPagination):
+    """Курсорная пагинация рефералов: от новых к старым"""
+    ordering = '-id'
+    page_size = settings.REFERRAL_SETTINGS['page_size']
+    page_size_query_param = 'page_size'
+    max_page_size = settings.REFERRAL_SETTINGS['max_page_size']
@@ -0,0 +1,111 @@
+from django.core.exceptions import ValidationError
+
+PHONE_NUMBER_MAX_LENGTH = 15
+# Длина ввода до нормализации: номер с пробелами, дефисами и скобками
+PHONE_NUMBER_INPUT_MAX_LENGTH = 32
+# Цифр в номере вместе с кодом страны: '+' и до 14 цифр помещаются в столбец
+PHONE_NUMBER_MIN_DIGITS = 9
+PHONE_NUMBER_MAX_DIGITS = PHONE_NUMBER_MAX_LENGTH - 1
+
+# Коды стран, выделенные ITU-T E.164. Набор кодов беспрефиксный: ни один код
+# не является началом другого, поэтому код номера определяется однозначно
+COUNTRY_CODES = frozenset(
+    '1 7 20 27 30 31 32 33 34 36 39 40 41 43 44 45 46 47 48 49 51 52 53 54 55 56 57 58 '
+    '60 61 62 63 64 65 66 81 82 84 86 90 91 92 93 94 95 98 '
+    '211 212 213 216 218 290 291 297 298 299 380 381 382 383 385 386 387 389 420 421 423 '
+    '670 800 808 850 852 853 855 856 870 878 880 881 882 883 886 888 979 '
+    '992 993 994 995 996 998'.split()
+    + [str(code) for code in (
+        *range(220, 259), *range(260, 270), *range(350, 360), *range(370, 379),
+        *range(500, 510), *range(590, 600), *range(672, 684), *range(685, 693),
+        *range(960, 969), *range(970, 978),
+    )]
+)
+
+# Точная длина национального номера там, где она фиксирована (NANP и страны СНГ);
+# для остальных кодов проверяется только общая длина номера
+NATIONAL_NUMBER_LENGTHS = {
+    '1': 10,
+    '7': 10,
+    '373': 8,
+    '374': 8,
+    '375': 9,
+    '380': 9,
+    '992': 9,
+    '993': 8,
+    '994': 9,
+    '995': 9,
+    '996': 9,
+    '998': 9,
+}
+
+
+def _build_prefix_table():
+    """Код страны -> (минимум, максимум) цифр национального номера"""
+    table = {}
+    for code in COUNTRY_CODES:
+        length = NATIONAL_NUMBER_LENGTHS.get(code)
+        if length is None:
+            table[code] = (max(PHONE_NUMBER_MIN_DIGITS - len(code), 1), PHONE_NUMBER_MAX_DIGITS - len(code))
+        else:
+            table[code] = (length, length)
+    return table
+
+
+_PREFIXES = _build_prefix_table()
+_SEPARATORS = str.maketrans('', '', ' \t-().')
+_DIGITS = frozenset('0123456789')
+
+
+def normalize_phone_number(value):
+    """
+    Каноническая форма номера в E.164: '+' и цифры без разделителей.
+    '+7 (999) 123-45-67' и '+79991234567' дают один номер, поэтому
+    уникальный индекс и поиск кода работают по одной строке. Проверка
+    идет без запросов к БД; возвращает номер или выбрасывает ValidationError.
+    """
+    value = value.strip()
+    if len(value) > PHONE_NUMBER_INPUT_MAX_LENGTH:
+        raise ValidationError("Номер телефона слишком длинный")
+    if not value.startswith('+'):
+        raise ValidationError("Номер телефона должен начинаться с '+'")
+    digits = value[1:].translate(_SEPARATORS)
+    if not _DIGITS.issuperset(digits):
+        raise ValidationError("Номер телефона может содержать только цифры, пробелы, дефисы и скобки")
+    if len(digits) < PHONE_NUMBER_MIN_DIGITS:
+        raise ValidationError("Номер телефона слишком короткий")
+    if len(digits) > PHONE_NUMBER_MAX_DIGITS:
+        raise ValidationError("Номер телефона слишком длинный")
+
+    for size in (1, 2, 3):
+        lengths = _PREFIXES.get(digits[:size])
+        if lengths is not None:
+            break
+    else:
+        raise ValidationError("Неизвестный код страны")
+    national = len(digits) - size
+    if national < lengths[0]:
+        raise ValidationError("Номер телефона слишком короткий")
+    if national > lengths[1]:
+        raise ValidationError("Номер телефона слишком длинный")
+    return '+' + digits
+
+
+def phone_number_key(phone_number):
+    """
+    Номер в E.164 как целое число для столбца phone_key: коды стран не
+    начинаются с нуля, поэтому разные номера дают разные числа. Для номеров
+    не в канонической форме (старые записи) возвращает None.
+    """
+    digits = phone_number[1:]
+    if not phone_number.startswith('+') or not digits or not _DIGITS.issuperset(digits) or digits[0] == '0':
+        return None
+    return int(digits)
+
+
+def validate_phone_number(value):
+    """
+    Правила проверки номера телефона, общие для API и импорта пользователей.
+    Возвращает номер в канонической форме или выбрасывает ValidationError.
+    """
+    return normalize_phone_number(value)
@@ -0,0 +1,83 @@
+import uuid
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils.http import parse_etags, quote_etag
+
+PROFILE_VERSION_KEY = 'profile:version:{}'
+PROFILE_DATA_KEY = 'profile:data:{}:{}'
+
+
+def _cache():
+    return caches[settings.PROFILE_CACHE_SETTINGS['cache_alias']]
+
+
+def _new_version():
+    return uuid.uuid4().hex[:16]
+
+
+def profile_version(user_id):
+    """
+    Версия профиля пользователя: меняется при каждом сбросе. Данные профиля
+    хранятся под ключом с версией, поэтому сброс - удаление одного ключа версии.
+    """
+    return _cache().get_or_set(
+        PROFILE_VERSION_KEY.format(user_id),
+        _new_version,
+        settings.PROFILE_CACHE_SETTINGS['version_ttl_seconds'],
+    )
+
+
+async def aprofile_version(user_id):
+    return await _cache().aget_or_set(
+        PROFILE_VERSION_KEY.format(user_id),
+        _new_version,
+        settings.PROFILE_CACHE_SETTINGS['version_ttl_seconds'],
+    )
+
+
+def profile_etag(user_id, version):
+    return quote_etag(f'{user_id}-{version}')
+
+
+def profile_cache_headers(etag):
+    """ETag и Cache-Control: браузер хранит профиль, но перепроверяет его при каждом запросе"""
+    if not etag:
+        return None
+    return {'ETag': etag, 'Cache-Control': 'private, no-cache'}
+
+
+def etag_matches(request, etag):
+    """If-None-Match содержит текущий ETag профиля (или '*')"""
+    header = request.headers.get('If-None-Match')
+    if not header:
+        return False
+    etags = parse_etags(header)
+    return '*' in etags or etag in etags
+
+
+def get_profile(user_id, version):
+    return _cache().get(PROFILE_DATA_KEY.format(user_id, version))
+
+
+async def aget_profile(user_id, version):
+    return await _cache().aget(PROFILE_DATA_KEY.format(user_id, version))
+
+
+def set_profile(user_id, version, data):
+    _cache().set(PROFILE_DATA_KEY.format(user_id, version), dict(data), settings.PROFILE_CACHE_SETTINGS['ttl_seconds'])
+
+
+async def aset_profile(user_id, version, data):
+    await _cache().aset(PROFILE_DATA_KEY.format(user_id, version), dict(data), settings.PROFILE_CACHE_SETTINGS['ttl_seconds'])
+
+
+def invalidate_profiles(user_ids):
+    """
+    Сбрасывает версии профилей после фиксации транзакции: иначе параллельный
+    запрос успел бы закешировать данные до изменения под новой версией.
+    """
+    if not settings.PROFILE_CACHE_SETTINGS['enabled']:
+        return
+    keys = [PROFILE_VERSION_KEY.format(user_id) for user_id in user_ids]
+    transaction.on_commit(lambda: _cache().delete_many(keys))
@@ -0,0 +1,232 @@
+import math
+import time
+import threading
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from rest_framework.throttling import BaseThrottle
+from .exceptions import RateLimitExceeded
+
+PERIODS = {'s': 1, 'm': 60, 'h': 60 * 60, 'd': 24 * 60 * 60}
+
+
+def parse_rate(rate):
+    """'5/m' -> (5, 60): число запросов и период в секундах (формат DRF)"""
+    num, period = rate.split('/')
+    return int(num), PERIODS[period[0]]
+
+
+class TokenBucketRateLimiter:
+    """
+    Token bucket в памяти процесса: без обращений к сети и БД, но лимит
+    действует на каждый воркер отдельно. Ведро наполняется на rate токенов
+    за период, запрос забирает один токен.
+    """
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def hit(self, key, rate):
+        """Учитывает запрос, возвращает None или сколько секунд ждать следующего"""
+        capacity, period = parse_rate(rate)
+        refill_rate = capacity / period
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated, _ = self._buckets.get(key, (capacity, now, period))
+            tokens = min(capacity, tokens + (now - updated) * refill_rate)
+            if tokens >= 1:
+                tokens -= 1
+                wait = None
+            else:
+                wait = (1 - tokens) / refill_rate
+            self._buckets[key] = (tokens, now, period)
+            if len(self._buckets) > self.max_keys:
+                self._prune(now)
+        return wait
+
+    async def ahit(self, key, rate):
+        return self.hit(key, rate)
+
+    def refund(self, key, rate):
+        """Возвращает токен, забранный hit, если запрос отклонен по другому лимиту"""
+        capacity, _ = parse_rate(rate)
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is not None:
+                self._buckets[key] = (min(capacity, bucket[0] + 1), bucket[1], bucket[2])
+
+    async def arefund(self, key, rate):
+        self.refund(key, rate)
+
+    def _prune(self, now):
+        # Ведро, которое успело наполниться, ничем не отличается от отсутствующего
+        self._buckets = {
+            key: bucket
+            for key, bucket in self._buckets.items()
+            if now - bucket[1] < bucket[2]
+        }
+
+
+class CacheSlidingWindowRateLimiter:
+    """
+    Скользящее окно поверх кеша Django (CACHES), общее для всех воркеров
+    при Redis или Memcached. Число запросов за окно оценивается по счетчикам
+    текущего и предыдущего фиксированных окон, по два ключа на клиента.
+    """
+
+    def __init__(self, cache_alias='default', key_prefix='ratelimit'):
+        self.cache_alias = cache_alias
+        self.key_prefix = key_prefix
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    def _window(self, key, rate):
+        limit, period = parse_rate(rate)
+        now = time.time()
+        window = int(now // period)
+        elapsed = (now % period) / period
+        current_key = f'{self.key_prefix}:{key}:{period}:{window}'
+        previous_key = f'{self.key_prefix}:{key}:{period}:{window - 1}'
+        return limit, period, elapsed, current_key, previous_key
+
+    @staticmethod
+    def _wait(limit, period, elapsed, count, previous):
+        """Через сколько секунд в окне освободится место еще для одного запроса"""
+        if previous and count < limit:
+            # previous * (1 - t) + count + 1 <= limit
+            needed = 1 - (limit - count - 1) / previous
+            return max(needed - elapsed, 0) * period
+        return (1 - elapsed) * period
+
+    def hit(self, key, rate):
+        limit, period, elapsed, current_key, previous_key = self._window(key, rate)
+        cache = self.cache
+        cache.add(current_key, 0, timeout=2 * period)
+        count = cache.incr(current_key)
+        previous = cache.get(previous_key, 0)
+        if previous * (1 - elapsed) + count <= limit:
+            return None
+        # Отклоненный запрос не расходует лимит
+        cache.decr(current_key)
+        return self._wait(limit, period, elapsed, count - 1, previous)
+
+    async def ahit(self, key, rate):
+        limit, period, elapsed, current_key, previous_key = self._window(key, rate)
+        cache = self.cache
+        await cache.aadd(current_key, 0, timeout=2 * period)
+        count = await cache.aincr(current_key)
+        previous = await cache.aget(previous_key, 0)
+        if previous * (1 - elapsed) + count <= limit:
+            return None
+        await cache.adecr(current_key)
+        return self._wait(limit, period, elapsed, count - 1, previous)
+
+    def refund(self, key, rate):
+        """Снимает запрос, учтенный hit, если он отклонен по другому лимиту"""
+        current_key = self._window(key, rate)[3]
+        try:
+            self.cache.decr(current_key)
+        except ValueError:
+            # Окно сменилось, а счетчик прошлого уже не влияет на текущее окно
+            pass
+
+    async def arefund(self, key, rate):
+        current_key = self._window(key, rate)[3]
+        try:
+            await self.cache.adecr(current_key)
+        except ValueError:
+            pass
+
+
+_limiter = None
+
+
+def get_rate_limiter():
+    """Ограничитель частоты запросов, настроенный в RATE_LIMIT_SETTINGS"""
+    global _limiter
+    if _limiter is None:
+        rate_settings = settings.RATE_LIMIT_SETTINGS
+        if rate_settings['backend'] == 'cache':
+            _limiter = CacheSlidingWindowRateLimiter(rate_settings['cache_alias'])
+        else:
+            _limiter = TokenBucketRateLimiter(rate_settings['max_keys'])
+    return _limiter
+
+
+@receiver(setting_changed)
+def reset_rate_limiter(setting, **kwargs):
+    global _limiter
+    if setting == 'RATE_LIMIT_SETTINGS':
+        _limiter = None
+
+
+def get_client_ip(request):
+    """IP клиента с учетом REST_FRAMEWORK['NUM_PROXIES'] (X-Forwarded-For от nginx)"""
+    return BaseThrottle().get_ident(request)
+
+
+def _send_code_limits(request, phone_number):
+    rates = settings.RATE_LIMIT_SETTINGS['rates']
+    limits = [('ip', f'send_code:ip:{get_client_ip(request)}', rates['send_code_ip'])]
+    if phone_number:
+        limits.append(('phone', f'send_code:phone:{phone_number}', rates['send_code_phone']))
+    return limits
+
+
+def _charge(limits):
+    """
+    Учитывает запрос во всех лимитах по очереди. При превышении возвращает
+    уже учтенные лимиты и выбрасывает RateLimitExceeded.
+    """
+    limiter = get_rate_limiter()
+    charged = []
+    for scope, key, rate in limits:
+        wait = limiter.hit(key, rate)
+        if wait is not None:
+            for charged_key, charged_rate in charged:
+                limiter.refund(charged_key, charged_rate)
+            raise RateLimitExceeded(scope, math.ceil(wait))
+        charged.append((key, rate))
+
+
+async def _acharge(limits):
+    limiter = get_rate_limiter()
+    charged = []
+    for scope, key, rate in limits:
+        wait = await limiter.ahit(key, rate)
+        if wait is not None:
+            for charged_key, charged_rate in charged:
+                await limiter.arefund(charged_key, charged_rate)
+            raise RateLimitExceeded(scope, math.ceil(wait))
+        charged.append((key, rate))
+
+
+def check_send_code_rate(request, phone_number=None):
+    """
+    Учитывает запрос на отправку кода в лимитах по IP и по номеру телефона.
+    При превышении выбрасывает RateLimitExceeded; отказы по номеру не
+    расходуют лимит IP.
+    """
+    if settings.RATE_LIMIT_SETTINGS['enabled']:
+        _charge(_send_code_limits(request, phone_number))
+
+
+async def acheck_send_code_rate(request, phone_number=None):
+    """Асинхронный вариант check_send_code_rate"""
+    if settings.RATE_LIMIT_SETTINGS['enabled']:
+        await _acharge(_send_code_limits(request, phone_number))
+
+
+def check_delivery_status_rate(request):
+    """
+    Учитывает запрос статуса доставки в лимите по IP: статус показывает,
+    запрашивался ли код для номера, поэтому перебор номеров ограничен.
+    """
+    if settings.RATE_LIMIT_SETTINGS['enabled']:
+        rate = settings.RATE_LIMIT_SETTINGS['rates']['delivery_status_ip']
+        _charge([('ip', f'delivery_status:ip:{get_client_ip(request)}', rate)])
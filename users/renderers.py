@@ -0,0 +1,33 @@
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    # Необязательная зависимость: uv sync --extra json
+    import orjson
+except ImportError:
+    orjson = None
+
+_encoder = JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+
+
+def dumps(data):
+    """
+    JSON в байтах в компактном виде DRF. С orjson кодирование в несколько раз
+    быстрее; типы, которых orjson не знает (Decimal, ленивые строки), кодирует
+    JSONEncoder DRF.
+    """
+    if orjson is not None:
+        # Даты тоже кодирует JSONEncoder DRF: формат не зависит от наличия orjson
+        return orjson.dumps(data, default=_encoder.default, option=orjson.OPT_PASSTHROUGH_DATETIME)
+    return _encoder.encode(data).encode()
+
+
+class FastJSONRenderer(JSONRenderer):
+    """JSONRenderer на dumps; с отступами (Browsable API, ?indent=) - стандартный рендерер DRF"""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+        return dumps(data)
@@ -1,26 +1,86 @@
 import logging
+from importlib import import_module
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.executors.pool import ThreadPoolExecutor
 from django_apscheduler.jobstores import DjangoJobStore
 from django_apscheduler import util
 from django.conf import settings
-from .models import VerificationCode
+from .models import User, VerificationCode, CodeDelivery, IdempotencyRecord
+from .delivery import CodeDispatcher
+from .metrics import CLEANUP_DELETED_ROWS
 
 logger = logging.getLogger(__name__)
 
 
-def cleanup_expired_codes():
+def cleanup_expired_codes(**cleanup_options):
     """Задача для очистки просроченных кодов верификации"""
     try:
-        count = VerificationCode.cleanup_expired_codes()
-        if count > 0:
-            logger.info(f"Очищено {count} просроченных кодов верификации")
+        result = VerificationCode.cleanup_expired_codes(**cleanup_options)
+        CLEANUP_DELETED_ROWS.labels('verification_codes').inc(result.deleted)
+        if result.deleted > 0:
+            logger.info(
+                "Очищено %s просроченных кодов верификации за %.2f с (%.0f строк/с, пачек: %s)",
+                result.deleted, result.elapsed, result.rows_per_second, result.batches
+            )
         else:
             logger.debug("Нет просроченных кодов для очистки")
+        if not result.complete:
+            logger.warning("Очистка кодов остановлена по бюджету времени, остаток будет удален при следующем запуске")
+    except Exception as e:
+        logger.error("Ошибка при очистке просроченных кодов: %s", e)
+
+def dispatch_code_deliveries():
+    """Задача для отправки кодов верификации из очереди"""
+    try:
+        count = CodeDispatcher().run_pending()
+        if count > 0:
+            logger.info("Обработано %s сообщений с кодами верификации", count)
+    except Exception as e:
+        logger.error("Ошибка при отправке кодов верификации: %s", e)
+
+def cleanup_code_deliveries():
+    """Задача для очистки завершенных доставок кодов"""
+    try:
+        count = CodeDelivery.cleanup_old_deliveries()
+        CLEANUP_DELETED_ROWS.labels('code_deliveries').inc(count)
+        if count > 0:
+            logger.info("Очищено %s завершенных доставок кодов", count)
     except Exception as e:
-        logger.error(f"Ошибка при очистке просроченных кодов: {e}")
+        logger.error("Ошибка при очистке доставок кодов: %s", e)
 
-def start_scheduler():
+def cleanup_idempotency_records(**cleanup_options):
+    """Задача для очистки просроченных ответов по ключам идемпотентности"""
+    try:
+        result = IdempotencyRecord.cleanup_expired(**cleanup_options)
+        CLEANUP_DELETED_ROWS.labels('idempotency_records').inc(result.deleted)
+        if result.deleted > 0:
+            logger.info("Очищено %s просроченных ответов по ключам идемпотентности", result.deleted)
+        if not result.complete:
+            logger.warning("Очистка ответов по ключам идемпотентности остановлена по бюджету времени")
+    except Exception as e:
+        logger.error("Ошибка при очистке ответов по ключам идемпотентности: %s", e)
+
+def reconcile_referral_counts():
+    """Задача для исправления расхождений счетчиков рефералов, используемых в рейтинге"""
+    try:
+        fixed = User.reconcile_referral_counts()
+        if fixed > 0:
+            logger.warning("Исправлено %s счетчиков рефералов, расходившихся с referred_by", fixed)
+        else:
+            logger.debug("Счетчики рефералов совпадают с referred_by")
+    except Exception as e:
+        logger.error("Ошибка при сверке счетчиков рефералов: %s", e)
+
+def clear_expired_sessions():
+    """Задача для очистки просроченных сессий, хранящихся в БД"""
+    try:
+        engine = import_module(settings.SESSION_ENGINE)
+        engine.SessionStore.clear_expired()
+        logger.info("Просроченные сессии очищены")
+    except Exception as e:
+        logger.error("Ошибка при очистке просроченных сессий: %s", e)
+
+def start_scheduler(cleanup_options=None):
     """Запуск APScheduler"""
     try:
         executors = {
@@ -44,19 +104,72 @@ def start_scheduler():
         scheduler.add_job(
             cleanup_expired_codes,
             'interval',
+            kwargs=cleanup_options or {},
             minutes=settings.SCHEDULER_SETTINGS['cleanup_interval_minutes'],
             id='cleanup_expired_verification_codes',
             replace_existing=True,
             coalesce=True,
         )
         
+        if settings.CODE_DELIVERY_SETTINGS['mode'] == 'outbox':
+            scheduler.add_job(
+                dispatch_code_deliveries,
+                'interval',
+                seconds=settings.CODE_DELIVERY_SETTINGS['dispatch_interval_seconds'],
+                id='dispatch_code_deliveries',
+                replace_existing=True,
+                coalesce=True,
+            )
+        
+        scheduler.add_job(
+            cleanup_code_deliveries,
+            'interval',
+            minutes=settings.SCHEDULER_SETTINGS['cleanup_interval_minutes'],
+            id='cleanup_code_deliveries',
+            replace_existing=True,
+            coalesce=True,
+        )
+        
+        if settings.IDEMPOTENCY_SETTINGS['backend'] == 'db':
+            scheduler.add_job(
+                cleanup_idempotency_records,
+                'interval',
+                kwargs=cleanup_options or {},
+                minutes=settings.SCHEDULER_SETTINGS['cleanup_interval_minutes'],
+                id='cleanup_idempotency_records',
+                replace_existing=True,
+                coalesce=True,
+            )
+        
+        scheduler.add_job(
+            reconcile_referral_counts,
+            'interval',
+            minutes=settings.LEADERBOARD_SETTINGS['reconcile_interval_minutes'],
+            id='reconcile_referral_counts',
+            replace_existing=True,
+            coalesce=True,
+        )
+        
+        if settings.SESSION_ENGINE in (
+            settings.SESSION_BACKENDS['db'],
+            settings.SESSION_BACKENDS['cached_db'],
+        ):
+            scheduler.add_job(
+                clear_expired_sessions,
+                'interval',
+                minutes=settings.SCHEDULER_SETTINGS['session_cleanup_interval_minutes'],
+                id='clear_expired_sessions',
+                replace_existing=True,
+                coalesce=True,
+            )
+        
         scheduler.start()
         logger.info("APScheduler успешно запущен")
         
         return scheduler
         
     except Exception as e:
-        logger.error(f"Ошибка при запуске APScheduler: {e}")
+        logger.error("Ошибка при запуске APScheduler: %s", e)
         return None
 
 def shutdown_scheduler(scheduler):
@@ -1,24 +1,22 @@
 from rest_framework import serializers
 from typing_extensions import Self
-from .models import User, VerificationCode
+from .models import User, CodeDelivery
+from .invite_codes import normalize_invite_code
+from .phone import PHONE_NUMBER_INPUT_MAX_LENGTH, validate_phone_number
 
 class BasePhoneValidatorMixin:
     """Миксин для валидации номера телефона"""
     
     def validate_phone_number(self: Self, value: str):
-        if not value.startswith('+'):
-            raise serializers.ValidationError("Номер телефона должен начинаться с '+'")
-        if len(value) < 10:
-            raise serializers.ValidationError("Номер телефона слишком короткий")
-        return value
+        return validate_phone_number(value)
 
 class PhoneSerializer(BasePhoneValidatorMixin, serializers.Serializer):
     """Сериализатор для отправки номера телефона"""
-    phone_number = serializers.CharField(max_length=15)
+    phone_number = serializers.CharField(max_length=PHONE_NUMBER_INPUT_MAX_LENGTH)
 
 class CodeSerializer(BasePhoneValidatorMixin, serializers.Serializer):
     """Сериализатор для верификации кода"""
-    phone_number = serializers.CharField(max_length=15)
+    phone_number = serializers.CharField(max_length=PHONE_NUMBER_INPUT_MAX_LENGTH)
     code = serializers.CharField(max_length=4)
     
     def validate_code(self: Self, value: str):
@@ -38,6 +36,7 @@ class UserProfileSerializer(serializers.ModelSerializer):
             'invite_code', 
             'activated_invite_code', 
             'referrals', 
+            'referral_count', 
             'created_at'
         ]
         read_only_fields = [
@@ -45,13 +44,53 @@ class UserProfileSerializer(serializers.ModelSerializer):
             'invite_code', 
             'activated_invite_code', 
             'referrals', 
+            'referral_count', 
             'created_at'
         ]
     
     def get_referrals(self: Self, obj: User):
-        """Получает список рефералов пользователя"""
-        referrals = User.objects.filter(activated_invite_code=obj.invite_code)
-        return [user.phone_number for user in referrals]
+        """Получает последних рефералов пользователя (полный список - в /api/profile/referrals/)"""
+        if 'referrals' in self.context:
+            return self.context['referrals']
+        if not obj.referral_count:
+            return []
+        return list(obj.referral_preview())
+
+# Горячие эндпоинты собирают ответ словарями того же формата, что у сериализаторов
+# (они остаются описанием схемы для Swagger), без обхода полей DRF на каждый запрос
+_datetime_field = serializers.DateTimeField()
+
+def user_auth_data(user: User):
+    """Данные UserAuthSerializer"""
+    return {
+        'id': user.id,
+        'phone_number': user.phone_number,
+        'invite_code': user.invite_code,
+        'activated_invite_code': user.activated_invite_code,
+        'created_at': _datetime_field.to_representation(user.created_at),
+    }
+
+def user_profile_data(user: User, referrals: list):
+    """Данные UserProfileSerializer с уже прочитанным превью рефералов"""
+    return {
+        'id': user.id,
+        'phone_number': user.phone_number,
+        'invite_code': user.invite_code,
+        'activated_invite_code': user.activated_invite_code,
+        'referrals': referrals,
+        'referral_count': user.referral_count,
+        'created_at': _datetime_field.to_representation(user.created_at),
+    }
+
+class ReferralSerializer(serializers.ModelSerializer):
+    """Сериализатор для элемента списка рефералов"""
+    
+    class Meta:
+        model = User
+        fields = [
+            'phone_number', 
+            'created_at'
+        ]
 
 class UserAuthSerializer(serializers.ModelSerializer):
     """Сериализатор для аутентификации пользователя"""
@@ -79,13 +118,20 @@ class ActivateInviteSerializer(serializers.Serializer):
     def validate_invite_code(self: Self, value: str):
         if not value:
             raise serializers.ValidationError("Инвайт-код не может быть пустым")
-        return value 
+        return normalize_invite_code(value)
     
-class VerificationCodeResponseSerializer(serializers.Serializer):
-    """Сериализатор для ответа при отправке кода верификации"""
-    message = serializers.CharField()
-    phone_number = serializers.CharField()
-    code = serializers.CharField(required=False) 
+class CodeDeliveryStatusSerializer(serializers.ModelSerializer):
+    """Сериализатор статуса доставки кода верификации"""
+
+    class Meta:
+        model = CodeDelivery
+        fields = [
+            'phone_number',
+            'status',
+            'attempts',
+            'created_at',
+            'sent_at'
+        ]
 
 
 class ErrorSerializer(serializers.Serializer):
@@ -1,3 +1,1162 @@
-from django.test import TestCase
+import os
+import sys
+import json
+import time
+import logging
+import hashlib
+import tempfile
+from io import StringIO
+from unittest import mock, skipUnless
+from pathlib import Path
+from datetime import timedelta
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.cache import caches
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.db.models import F
+from django.test import AsyncClient, Client, RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.urls import path, reverse
+from django.utils import timezone
+from prometheus_client import REGISTRY
+from . import async_views, views
+from .delivery import BaseCodeSender, CodeDispatcher, deliver_code
+from .exceptions import CodeDeliveryError, ReferralCycleError
+from .idempotency import claim_response, get_idempotency_store, idempotency_key
+from .importing import import_batch
+from .invite_codes import InviteCodeEncoder
+from .log_handlers import BackgroundQueueHandler, JsonFormatter
+from .models import User, VerificationCode, ReferralClosure, CodeDelivery, IdempotencyRecord
+from .openapi import get_schema
+from .pagination import ReferralCursorPagination
+from .phone import normalize_phone_number
+from .renderers import dumps
+from .serializers import UserAuthSerializer, UserProfileSerializer, user_auth_data, user_profile_data
 
-# Create your tests here.
+
+class InviteCodeLookupTests(TestCase):
+    """Поиск пользователя по инвайт-коду при активации"""
+
+    def setUp(self):
+        self.inviter = User.objects.create(phone_number='+79990000001', invite_code='a1b2c3')
+
+    def test_invite_code_is_stored_canonical(self):
+        self.inviter.refresh_from_db()
+        self.assertEqual(self.inviter.invite_code, 'A1B2C3')
+
+    def test_lookup_is_case_insensitive(self):
+        self.assertEqual(User.by_invite_code(' a1B2c3 ').get(), self.inviter)
+
+    def test_lookup_uses_index(self):
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+
+        plan = User.by_invite_code('a1b2c3').explain()
+
+        self.assertRegex(plan, r'Index (Only )?Scan|USING (COVERING )?INDEX')
+
+
+class InviteCodeSequenceTests(TestCase):
+    """Режим 'sequence': обратимая перестановка и переход со случайных кодов"""
+
+    def test_permutation_is_bijection(self):
+        for rounds in (3, 4):
+            encoder = InviteCodeEncoder('secret', 'ABC', 5, rounds=rounds)
+            values = range(encoder.domain)
+            with self.subTest(rounds=rounds):
+                self.assertEqual(sorted(encoder.permute(value) for value in values), list(values))
+                for value in values:
+                    self.assertEqual(encoder.unpermute(encoder.permute(value)), value)
+                    self.assertEqual(encoder.decode(encoder.encode(value)), value)
+
+        encoder = InviteCodeEncoder('secret', settings.INVITE_CODE_SETTINGS['charset'], 6)
+        for value in (0, 1, 12345, encoder.domain - 1):
+            self.assertEqual(encoder.decode(encoder.encode(value)), value)
+        self.assertNotEqual(encoder.encode(1), InviteCodeEncoder('other', encoder.charset, 6).encode(1))
+
+    @override_settings(INVITE_CODE_SETTINGS={**settings.INVITE_CODE_SETTINGS, 'mode': 'sequence'})
+    def test_collision_with_legacy_code_is_retried(self):
+        legacy = User.objects.create(phone_number='+79990000801', invite_code='LEGACY')
+
+        with mock.patch('users.models.next_sequence_code', side_effect=['LEGACY', 'SEQ001']):
+            user = User.objects.create(phone_number='+79990000802')
+
+        self.assertEqual(user.invite_code, 'SEQ001')
+        self.assertEqual(User.objects.get(invite_code='LEGACY'), legacy)
+
+    def test_backfill_all_remaps_activated_codes(self):
+        inviter = User.objects.create(phone_number='+79990000803', invite_code='OLD001')
+        invitee = User.objects.create(phone_number='+79990000804', invite_code='OLD002')
+        invitee.activate_invite(inviter)
+
+        call_command('backfill_invite_codes', '--all', '--batch-size', '1', stdout=StringIO())
+
+        inviter.refresh_from_db()
+        invitee.refresh_from_db()
+        self.assertNotIn(inviter.invite_code, ('OLD001', 'OLD002'))
+        self.assertEqual(invitee.activated_invite_code, inviter.invite_code)
+        self.assertEqual(invitee.referred_by, inviter)
+
+
+@override_settings(SESSION_ENGINE='django.contrib.sessions.backends.signed_cookies')
+class VerifyCodeQueryBudgetTests(TestCase):
+    """Бюджет запросов к БД для /api/auth/verify-code/"""
+    phone_number = '+79990000002'
+
+    def verify(self, code):
+        return self.client.post(
+            reverse('verify-code'),
+            {'phone_number': self.phone_number, 'code': code},
+            content_type='application/json'
+        )
+
+    def test_new_user_takes_two_queries(self):
+        code = VerificationCode.create_code(self.phone_number).code
+
+        with self.assertNumQueries(2):
+            response = self.verify(code)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()['is_new_user'])
+        self.assertEqual(self.client.session['user_id'], response.json()['id'])
+
+    def test_existing_user_takes_two_queries(self):
+        user = User.objects.create(phone_number=self.phone_number)
+        code = VerificationCode.create_code(self.phone_number).code
+
+        with self.assertNumQueries(2):
+            response = self.verify(code)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.json()['is_new_user'])
+        self.assertEqual(response.json()['invite_code'], user.invite_code)
+
+    def test_code_can_be_used_once(self):
+        code = VerificationCode.create_code(self.phone_number).code
+
+        self.assertEqual(self.verify(code).status_code, 200)
+
+        with self.assertNumQueries(1):
+            response = self.verify(code)
+        self.assertEqual(response.json()['code'], 'INVALID_CODE')
+
+    def test_expired_code_is_rejected_and_deleted(self):
+        code = VerificationCode.create_code(self.phone_number).code
+        VerificationCode.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+
+        response = self.verify(code)
+
+        self.assertEqual(response.json()['code'], 'CODE_EXPIRED')
+        self.assertFalse(VerificationCode.objects.exists())
+
+
+@override_settings(SESSION_ENGINE='django.contrib.sessions.backends.signed_cookies')
+class SessionRefreshTests(TestCase):
+    """Подписанная cookie сессии переиздается не чаще refresh_interval_seconds"""
+    phone_number = '+79990000003'
+    profile_url = '/api/profile/'
+
+    def test_cookie_is_reissued_once_per_interval(self):
+        code = VerificationCode.create_code(self.phone_number).code
+        response = self.client.post(
+            reverse('verify-code'),
+            {'phone_number': self.phone_number, 'code': code},
+            content_type='application/json'
+        )
+        self.assertIn(settings.SESSION_COOKIE_NAME, response.cookies)
+
+        for _ in range(3):
+            response = self.client.get(self.profile_url)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn(settings.SESSION_COOKIE_NAME, response.cookies)
+
+        later = time.time() + settings.SESSION_SETTINGS['refresh_interval_seconds'] + 1
+        with mock.patch('time.time', return_value=later):
+            response = self.client.get(self.profile_url)
+            self.assertIn(settings.SESSION_COOKIE_NAME, response.cookies)
+            response = self.client.get(self.profile_url)
+            self.assertNotIn(settings.SESSION_COOKIE_NAME, response.cookies)
+
+
+class ResendCodeTests(TestCase):
+    """Повторная отправка кода в режиме resend_mode='reuse'"""
+    phone_number = '+79990000004'
+
+    def test_resend_within_threshold_reuses_code(self):
+        first = VerificationCode.create_code(self.phone_number)
+
+        with self.assertNumQueries(1):
+            second = VerificationCode.create_code(self.phone_number)
+
+        self.assertTrue(second.reused)
+        self.assertEqual(second.code, first.code)
+        self.assertEqual(second.created_at, first.created_at)
+        self.assertGreater(second.expires_at, first.expires_at)
+        self.assertEqual(VerificationCode.objects.count(), 1)
+
+    def test_code_older_than_threshold_is_rotated(self):
+        VerificationCode.create_code(self.phone_number)
+        stale = timezone.now() - timedelta(seconds=settings.VERIFICATION_CODE_SETTINGS['reuse_threshold_seconds'] + 1)
+        VerificationCode.objects.update(created_at=stale)
+
+        second = VerificationCode.create_code(self.phone_number)
+
+        self.assertFalse(second.reused)
+        self.assertGreater(second.created_at, stale)
+        self.assertEqual(VerificationCode.objects.get().code, second.code)
+
+    def test_expired_code_is_rotated(self):
+        VerificationCode.create_code(self.phone_number)
+        VerificationCode.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+
+        second = VerificationCode.create_code(self.phone_number)
+
+        self.assertFalse(second.reused)
+        self.assertGreater(VerificationCode.objects.get().expires_at, timezone.now())
+
+
+class CleanupExpiredCodesTests(TestCase):
+    """Пакетное удаление просроченных кодов и команда cleanup_expired_codes"""
+
+    def setUp(self):
+        expired = timezone.now() - timedelta(minutes=1)
+        VerificationCode.objects.bulk_create([
+            VerificationCode(phone_number=f'+7999000100{i}', code='1234', expires_at=expired) for i in range(5)
+        ])
+        self.valid = VerificationCode.create_code('+79990001010')
+
+    def test_deletes_in_batches_with_throttling(self):
+        with mock.patch('users.cleanup.time.sleep') as sleep:
+            result = VerificationCode.cleanup_expired_codes(batch_size=2, time_budget=0, max_batches_per_second=10)
+
+        self.assertEqual((result.deleted, result.batches, result.complete), (5, 3, True))
+        self.assertEqual(list(VerificationCode.objects.all()), [self.valid])
+        self.assertEqual(sleep.call_count, 2)
+        for call in sleep.call_args_list:
+            self.assertGreater(call.args[0], 0)
+            self.assertLessEqual(call.args[0], 0.1)
+
+    def test_time_budget_stops_early(self):
+        clock = iter(range(100))
+        with mock.patch('users.cleanup.time.monotonic', side_effect=lambda: next(clock)):
+            result = VerificationCode.cleanup_expired_codes(batch_size=2, time_budget=1, max_batches_per_second=0)
+
+        self.assertEqual((result.deleted, result.batches, result.complete), (2, 1, False))
+        self.assertEqual(VerificationCode.objects.count(), 4)
+
+    def test_command_runs_once(self):
+        stdout = StringIO()
+        with mock.patch('users.cleanup.time.sleep'):
+            call_command('cleanup_expired_codes', '--once', '--batch-size', '2', '--time-budget', '60', stdout=stdout)
+
+        self.assertIn('Удалено 5 кодов', stdout.getvalue())
+        self.assertIn('пачек: 3', stdout.getvalue())
+        self.assertEqual(VerificationCode.objects.count(), 1)
+
+
+class RecordingCodeSender(BaseCodeSender):
+    """Провайдер для тестов: запоминает статусы сообщений на момент отправки"""
+
+    def __init__(self, fail=()):
+        self.fail = set(fail)
+        self.seen = []
+
+    def send(self, phone_number, message):
+        if phone_number in self.fail:
+            raise CodeDeliveryError('Шлюз недоступен')
+
+    def send_batch(self, messages):
+        self.seen.append(list(
+            CodeDelivery.objects.order_by('id').values_list('status', 'attempts')
+        ))
+        return super().send_batch(messages)
+
+
+class CodeDeliveryTests(TestCase):
+    """Доставка кодов: outbox, фоновый диспетчер и /api/auth/delivery-status/"""
+
+    def test_outbox_and_sync_modes(self):
+        queued = deliver_code('+79990000701', '1234')
+        self.assertEqual((queued.status, queued.attempts), (CodeDelivery.STATUS_PENDING, 0))
+
+        sync_settings = {**settings.CODE_DELIVERY_SETTINGS, 'mode': 'sync'}
+        with self.settings(CODE_DELIVERY_SETTINGS=sync_settings):
+            sent = deliver_code('+79990000702', '1234', RecordingCodeSender())
+            failed = deliver_code('+79990000703', '1234', RecordingCodeSender(fail={'+79990000703'}))
+
+        self.assertEqual((sent.status, sent.attempts), (CodeDelivery.STATUS_SENT, 1))
+        self.assertIsNotNone(sent.sent_at)
+        self.assertEqual((failed.status, failed.last_error), (CodeDelivery.STATUS_FAILED, 'Шлюз недоступен'))
+
+    def test_batch_is_claimed_before_send_and_failures_retried(self):
+        for i in range(3):
+            deliver_code(f'+7999000071{i}', '1234')
+        sender = RecordingCodeSender(fail={'+79990000711'})
+        dispatcher = CodeDispatcher(sender=sender, batch_size=10, max_attempts=2)
+
+        self.assertEqual(dispatcher.dispatch_batch(), 3)
+        self.assertEqual(sender.seen[0], [(CodeDelivery.STATUS_SENDING, 1)] * 3)
+        self.assertEqual(
+            list(CodeDelivery.objects.order_by('id').values_list('status', 'attempts')),
+            [(CodeDelivery.STATUS_SENT, 1), (CodeDelivery.STATUS_PENDING, 1), (CodeDelivery.STATUS_SENT, 1)]
+        )
+
+        self.assertEqual(dispatcher.run_pending(), 1)
+        self.assertEqual(dispatcher.dispatch_batch(), 0)
+        retried = CodeDelivery.objects.get(phone_number='+79990000711')
+        self.assertEqual((retried.status, retried.attempts), (CodeDelivery.STATUS_FAILED, 2))
+
+    def test_abandoned_claims_are_reclaimed(self):
+        stale = timezone.now() - timedelta(seconds=settings.CODE_DELIVERY_SETTINGS['claim_timeout_seconds'] + 1)
+        for phone_number, attempts in (('+79990000721', 1), ('+79990000722', 3)):
+            CodeDelivery.objects.create(
+                phone_number=phone_number, code='1234', status=CodeDelivery.STATUS_SENDING,
+                attempts=attempts, claimed_at=stale
+            )
+        CodeDelivery.objects.create(
+            phone_number='+79990000723', code='1234', status=CodeDelivery.STATUS_SENDING,
+            attempts=1, claimed_at=timezone.now()
+        )
+
+        self.assertEqual(CodeDispatcher(sender=RecordingCodeSender(), max_attempts=3).dispatch_batch(), 1)
+
+        self.assertEqual(
+            list(CodeDelivery.objects.order_by('id').values_list('status', 'attempts')),
+            [(CodeDelivery.STATUS_SENT, 2), (CodeDelivery.STATUS_FAILED, 3), (CodeDelivery.STATUS_SENDING, 1)]
+        )
+
+    def test_delivery_status_endpoint(self):
+        deliver_code('+79990000731', '1111')
+        deliver_code('+79990000731', '2222')
+        CodeDispatcher(sender=RecordingCodeSender(), batch_size=1).dispatch_batch()
+
+        response = self.client.get(reverse('delivery-status'), {'phone_number': '+7 999 000-07-31'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['status'], CodeDelivery.STATUS_PENDING)
+        self.assertEqual(
+            self.client.get(reverse('delivery-status'), {'phone_number': '+79990000732'}).json()['code'],
+            'DELIVERY_NOT_FOUND'
+        )
+        self.assertEqual(
+            self.client.get(reverse('delivery-status'), {'phone_number': '12345'}).json()['code'],
+            'VALIDATION_ERROR'
+        )
+
+    def test_delivery_status_is_rate_limited_by_ip(self):
+        rate_limit_settings = {
+            **settings.RATE_LIMIT_SETTINGS,
+            'enabled': True,
+            'backend': 'memory',
+            'rates': {**settings.RATE_LIMIT_SETTINGS['rates'], 'delivery_status_ip': '2/m'},
+        }
+        with self.settings(RATE_LIMIT_SETTINGS=rate_limit_settings):
+            for i in range(2):
+                response = self.client.get(reverse('delivery-status'), {'phone_number': f'+7999000074{i}'})
+                self.assertEqual(response.status_code, 404)
+
+            response = self.client.get(reverse('delivery-status'), {'phone_number': '+79990000742'})
+
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.json()['details']['scope'], 'ip')
+
+
+class SyncViewsURLConf:
+    """Горячие эндпоинты API на синхронных представлениях (SERVER_MODE=wsgi)"""
+    urlpatterns = [
+        path('api/auth/send-code/', views.send_code),
+        path('api/auth/verify-code/', views.verify_code),
+        path('api/profile/', views.profile),
+        path('api/profile/activate-invite/', views.activate_invite),
+    ]
+
+
+class AsyncViewsURLConf:
+    """Те же эндпоинты на асинхронных представлениях (SERVER_MODE=asgi)"""
+    urlpatterns = [
+        path('api/auth/send-code/', async_views.send_code),
+        path('api/auth/verify-code/', async_views.verify_code),
+        path('api/profile/', async_views.profile),
+        path('api/profile/activate-invite/', async_views.activate_invite),
+    ]
+
+
+class AsyncViewsTests(TestCase):
+    """Асинхронные представления отвечают так же, как синхронные"""
+    phone_number = '+79990001101'
+    steps = [
+        ('post', '/api/auth/send-code/', {'phone_number': '12345'}),
+        ('post', '/api/auth/send-code/', {'phone_number': '+7 999 000-11-01'}),
+        ('post', '/api/auth/verify-code/', {'phone_number': phone_number, 'code': '0000'}),
+        ('get', '/api/profile/', None),
+        ('post', '/api/profile/activate-invite/', {'invite_code': 'INV001'}),
+        ('post', '/api/auth/verify-code/', {'phone_number': phone_number, 'code': '1234'}),
+        ('get', '/api/profile/', None),
+        ('post', '/api/profile/activate-invite/', {'invite_code': ''}),
+        ('post', '/api/profile/activate-invite/', {'invite_code': 'nope00'}),
+        ('post', '/api/profile/activate-invite/', {'invite_code': 'own001'}),
+        ('post', '/api/profile/activate-invite/', {'invite_code': 'inv001'}),
+        ('post', '/api/profile/activate-invite/', {'invite_code': 'inv001'}),
+        ('get', '/api/profile/', None),
+    ]
+
+    def setUp(self):
+        self.inviter = User.objects.create(phone_number='+79990001100', invite_code='INV001')
+        for patcher in (
+            mock.patch.object(VerificationCode, 'generate_verification_code', return_value='1234'),
+            mock.patch.object(User, 'generate_invite_code', return_value='OWN001'),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def requests(self):
+        for method, url, body in self.steps:
+            yield method.upper(), url, json.dumps(body) if body is not None else ''
+
+    @staticmethod
+    def result(response):
+        # id и время создания зависят от прогона, остальное тело должно совпасть
+        body = response.json()
+        for key in ('id', 'created_at'):
+            body.pop(key, None)
+        return response.status_code, body
+
+    def run_steps(self, urlconf, run):
+        """Шаги в отдельной транзакции, откатываемой после прогона"""
+        with override_settings(ROOT_URLCONF=urlconf), transaction.atomic():
+            results = run()
+            transaction.set_rollback(True)
+        return results
+
+    def test_responses_match_sync_views(self):
+        def sync_run():
+            client = Client()
+            return [
+                self.result(client.generic(*request, content_type='application/json'))
+                for request in self.requests()
+            ]
+
+        async def async_run():
+            client = AsyncClient()
+            return [
+                self.result(await client.generic(*request, content_type='application/json'))
+                for request in self.requests()
+            ]
+
+        expected = self.run_steps(SyncViewsURLConf, sync_run)
+        actual = self.run_steps(AsyncViewsURLConf, async_to_sync(async_run))
+
+        self.assertEqual(
+            [(status, body.get('code', body.get('phone_number'))) for status, body in expected],
+            [
+                (400, 'VALIDATION_ERROR'), (200, '1234'), (400, 'INVALID_CODE'), (401, 'NOT_AUTHENTICATED'),
+                (401, 'NOT_AUTHENTICATED'), (200, self.phone_number), (200, self.phone_number),
+                (400, 'VALIDATION_ERROR'), (400, 'INVALID_INVITE_CODE'), (400, 'SELF_INVITE_NOT_ALLOWED'),
+                (200, self.phone_number), (400, 'INVITE_ALREADY_ACTIVATED'), (200, self.phone_number),
+            ]
+        )
+        for step, expected_result, actual_result in zip(self.steps, expected, actual):
+            with self.subTest(step=step):
+                self.assertEqual(actual_result, expected_result)
+
+
+class ReferralTreeTests(TestCase):
+    """Замыкание дерева рефералов и /api/profile/downline/"""
+
+    def setUp(self):
+        self.root, self.child, self.grandchild, self.leaf = [
+            User.objects.create(phone_number=f'+7999000010{i}') for i in range(4)
+        ]
+        # Поддерево grandchild -> leaf подвешивается к дереву уже готовым
+        self.leaf.activate_invite(self.grandchild)
+        self.child.activate_invite(self.root)
+        self.grandchild.activate_invite(self.child)
+
+    def login(self, user):
+        session = self.client.session
+        session['user_id'] = user.id
+        session.save()
+        self.client.cookies[settings.SESSION_COOKIE_NAME] = session.session_key
+
+    def closure(self):
+        return set(ReferralClosure.objects.values_list('ancestor_id', 'descendant_id', 'depth'))
+
+    def test_downline_by_level(self):
+        self.login(self.root)
+
+        response = self.client.get(reverse('downline'))
+
+        self.assertEqual(response.json(), {
+            'total': 3,
+            'levels': [{'depth': 1, 'count': 1}, {'depth': 2, 'count': 1}, {'depth': 3, 'count': 1}],
+        })
+
+    def test_cycle_is_rejected(self):
+        self.login(self.root)
+
+        response = self.client.post(
+            reverse('activate-invite'),
+            {'invite_code': self.leaf.invite_code},
+            content_type='application/json'
+        )
+
+        self.assertEqual(response.json()['code'], 'REFERRAL_CYCLE_NOT_ALLOWED')
+        self.root.refresh_from_db()
+        self.assertIsNone(self.root.referred_by)
+
+    def test_crossing_activations_lock_both_roots(self):
+        # X активирует код Y из дерева Z, а Z - код W из дерева X: наборы
+        # {пользователь, пригласивший} не пересекаются, но корни X и Z общие
+        x, w, z, y = [User.objects.create(phone_number=f'+7999000011{i}') for i in range(4)]
+        w.activate_invite(x)
+        y.activate_invite(z)
+
+        with transaction.atomic():
+            first = x._lock_activation_rows(y)
+            second = z._lock_activation_rows(w)
+        self.assertEqual(set(first) & set(second), {x.id, z.id})
+
+        self.assertTrue(x.activate_invite(y))
+        with self.assertRaises(ReferralCycleError):
+            z.activate_invite(w)
+        self.assertFalse(ReferralClosure.objects.filter(ancestor_id=F('descendant_id')).exists())
+        self.assertEqual(ReferralClosure.root_of(w.id), z.id)
+
+    def test_rebuild_matches_incremental_links(self):
+        expected = self.closure()
+
+        levels, truncated = ReferralClosure.rebuild()
+
+        self.assertEqual((levels, truncated), (3, False))
+        self.assertEqual(self.closure(), expected)
+
+
+class ReferralListTests(TestCase):
+    """Курсорная пагинация /api/profile/referrals/"""
+
+    def setUp(self):
+        self.inviter = User.objects.create(phone_number='+79990000900')
+        self.phones = []
+        for i in range(1, 6):
+            referral = User.objects.create(phone_number=f'+7999000090{i}')
+            referral.activate_invite(self.inviter)
+            self.phones.append(referral.phone_number)
+        self.phones.reverse()
+        User.objects.create(phone_number='+79990000910')
+
+    def login(self):
+        session = self.client.session
+        session['user_id'] = self.inviter.id
+        session.save()
+        self.client.cookies[settings.SESSION_COOKIE_NAME] = session.session_key
+
+    def phone_numbers(self, response):
+        return [row['phone_number'] for row in response.json()['results']]
+
+    def test_pages_follow_next_cursor(self):
+        self.login()
+
+        response = self.client.get(reverse('referrals'), {'page_size': 2})
+        pages = [self.phone_numbers(response)]
+        while response.json()['next']:
+            response = self.client.get(response.json()['next'])
+            pages.append(self.phone_numbers(response))
+
+        self.assertEqual(pages, [self.phones[:2], self.phones[2:4], self.phones[4:]])
+        self.assertIsNotNone(response.json()['previous'])
+
+    def test_default_and_clamped_page_size(self):
+        self.login()
+
+        self.assertEqual(self.phone_numbers(self.client.get(reverse('referrals'))), self.phones)
+        with mock.patch.object(ReferralCursorPagination, 'max_page_size', 3):
+            response = self.client.get(reverse('referrals'), {'page_size': 1000})
+        self.assertEqual(self.phone_numbers(response), self.phones[:3])
+        self.assertIsNotNone(response.json()['next'])
+
+    def test_requires_authentication(self):
+        response = self.client.get(reverse('referrals'))
+
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.json()['code'], 'NOT_AUTHENTICATED')
+
+
+class LeaderboardTests(TestCase):
+    """Рейтинг /api/leaderboard/ и сверка счетчиков рефералов"""
+
+    def setUp(self):
+        caches[settings.LEADERBOARD_SETTINGS['cache_alias']].clear()
+        self.users = [User.objects.create(phone_number=f'+7999000020{i}') for i in range(7)]
+        first, second, third = self.users[:3]
+        for inviter, invitees in ((first, self.users[3:5]), (second, self.users[5:7])):
+            for invitee in invitees:
+                invitee.activate_invite(inviter)
+        self.third = third
+
+    def test_top_and_my_rank(self):
+        session = self.client.session
+        session['user_id'] = self.third.id
+        session.save()
+        self.client.cookies[settings.SESSION_COOKIE_NAME] = session.session_key
+        User.objects.filter(id=self.third.id).update(referral_count=1)
+
+        response = self.client.get(reverse('leaderboard'), {'limit': 2})
+
+        data = response.json()
+        self.assertEqual([row['rank'] for row in data['top']], [1, 1])
+        self.assertEqual(data['top'][0]['phone_number'], '+7***00')
+        self.assertEqual(data['me'], {'rank': 3, 'referral_count': 1})
+
+    def test_snapshot_is_cached(self):
+        self.client.get(reverse('leaderboard'))
+
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('leaderboard'))
+        self.assertIsNone(response.json()['me'])
+
+    def test_reconcile_fixes_drift(self):
+        User.objects.filter(id=self.users[0].id).update(referral_count=10)
+        User.objects.filter(id=self.third.id).update(referral_count=3)
+
+        self.assertEqual(User.reconcile_referral_counts(batch_size=3), 2)
+        self.assertEqual(
+            list(User.objects.order_by('id').values_list('referral_count', flat=True)[:3]),
+            [2, 2, 0]
+        )
+
+
+class LogHandlerTests(SimpleTestCase):
+    """JSON-формат журнала и фоновая запись через очередь"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+
+    def record(self, message, **extra):
+        return logging.makeLogRecord({
+            'name': 'users.views', 'levelno': logging.WARNING, 'levelname': 'WARNING', 'msg': message, **extra
+        })
+
+    def test_json_formatter(self):
+        try:
+            raise ValueError('сбой')
+        except ValueError:
+            record = self.record('Запрос %s', args=('profile',), view='profile', db_queries=2, exc_info=sys.exc_info())
+
+        line = JsonFormatter().format(record)
+
+        data = json.loads(line)
+        self.assertEqual(
+            {key: data[key] for key in ('level', 'logger', 'message', 'view', 'db_queries')},
+            {'level': 'WARNING', 'logger': 'users.views', 'message': 'Запрос profile', 'view': 'profile', 'db_queries': 2}
+        )
+        self.assertIn('ValueError: сбой', data['exc_info'])
+        self.assertNotIn('args', data)
+        self.assertIn('Запрос', line)
+
+    @skipUnless(hasattr(os, 'fork'), 'нужен os.fork')
+    def test_records_are_written_after_fork(self):
+        handler = BackgroundQueueHandler(str(Path(self.tmp_dir.name) / 'app-{pid}.log'), console=False)
+        self.addCleanup(handler.close)
+        handler.handle(self.record('родитель'))
+
+        pid = os.fork()
+        if pid == 0:
+            try:
+                handler.handle(self.record('потомок'))
+                handler.stop()
+            finally:
+                os._exit(0)
+        os.waitpid(pid, 0)
+        handler.stop()
+
+        def read(process):
+            return (Path(self.tmp_dir.name) / f'app-{process}.log').read_text(encoding='utf-8')
+
+        self.assertIn('родитель', read(os.getpid()))
+        self.assertNotIn('потомок', read(os.getpid()))
+        self.assertIn('потомок', read(pid))
+
+    def test_full_queue_drops_records(self):
+        with mock.patch('users.log_handlers.QueueListener'):
+            handler = BackgroundQueueHandler(console=False, queue_size=2)
+            for i in range(5):
+                handler.handle(self.record(f'запись {i}'))
+            handler.close()
+
+        self.assertEqual(handler.dropped, 3)
+
+
+class PerformanceMiddlewareTests(TestCase):
+    """Замеры PerformanceMiddleware: Server-Timing, поля журнала и бюджет запросов"""
+
+    def setUp(self):
+        # Рейтинг без кеша - ровно два запроса к БД
+        caches[settings.LEADERBOARD_SETTINGS['cache_alias']].clear()
+
+    def perf_settings(self, **overrides):
+        return {**settings.PERFORMANCE_SETTINGS, 'enabled': True, 'sample_rate': 1.0, **overrides}
+
+    def test_server_timing_and_log_fields(self):
+        with self.settings(PERFORMANCE_SETTINGS=self.perf_settings()), \
+                self.assertLogs('users.middleware', 'INFO') as logs:
+            response = self.client.get(reverse('leaderboard'))
+
+        self.assertRegex(response['Server-Timing'], r'^total;dur=[\d.]+, db;dur=[\d.]+;desc="2 queries", render;dur=[\d.]+$')
+        record = logs.records[0]
+        self.assertEqual((record.view, record.db_queries, record.status), ('leaderboard', 2, 200))
+
+    def test_query_budget_warning(self):
+        perf_settings = self.perf_settings(query_budgets={'leaderboard': 1})
+        with self.settings(PERFORMANCE_SETTINGS=perf_settings), \
+                self.assertLogs('users.middleware', 'WARNING') as logs:
+            self.client.get(reverse('leaderboard'))
+
+        self.assertEqual(logs.records[0].query_budget, 1)
+
+    def test_unsampled_request_is_not_instrumented(self):
+        with self.settings(PERFORMANCE_SETTINGS=self.perf_settings(sample_rate=0.0)):
+            response = self.client.get(reverse('leaderboard'))
+
+        self.assertNotIn('Server-Timing', response)
+
+
+class MetricsTests(TestCase):
+    """Счетчики воронки авторизации и эндпоинт /metrics"""
+
+    def metrics_settings(self, **overrides):
+        return {**settings.METRICS_SETTINGS, 'enabled': True, 'multiprocess_dirs': [], **overrides}
+
+    def verifications(self, result):
+        return REGISTRY.get_sample_value('referral_code_verifications_total', {'result': result}) or 0
+
+    def test_verify_failure_counted_by_error_code(self):
+        before = self.verifications('INVALID_CODE')
+        self.client.post(
+            reverse('verify-code'),
+            {'phone_number': '+79990000001', 'code': '0000'},
+            content_type='application/json'
+        )
+
+        self.assertEqual(self.verifications('INVALID_CODE'), before + 1)
+        with self.settings(METRICS_SETTINGS=self.metrics_settings()):
+            response = self.client.get(reverse('metrics'))
+        self.assertIn(b'referral_code_verifications_total{result="INVALID_CODE"}', response.content)
+        self.assertIn(b'referral_request_duration_seconds_bucket{', response.content)
+
+    def test_token_required(self):
+        with self.settings(METRICS_SETTINGS=self.metrics_settings(token='secret')):
+            self.assertEqual(self.client.get(reverse('metrics')).status_code, 401)
+            response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+
+    def test_db_health_requires_token(self):
+        with self.settings(METRICS_SETTINGS=self.metrics_settings(token='secret')):
+            response = self.client.get(reverse('db-health'))
+            self.assertEqual(response.status_code, 401)
+            self.assertNotIn(b'pid', response.content)
+            response = self.client.get(reverse('db-health'), HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()['healthy'])
+
+
+@override_settings(PROFILE_CACHE_SETTINGS={**settings.PROFILE_CACHE_SETTINGS, 'enabled': True})
+class ProfileCacheTests(TestCase):
+    """Кеш профиля с версией, ETag и сброс при активации инвайт-кода"""
+    profile_url = '/api/profile/'
+
+    def setUp(self):
+        caches[settings.PROFILE_CACHE_SETTINGS['cache_alias']].clear()
+        self.inviter = User.objects.create(phone_number='+79990000201')
+        self.invitee = User.objects.create(phone_number='+79990000202')
+        session = self.client.session
+        session['user_id'] = self.inviter.id
+        session.save()
+        self.client.cookies[settings.SESSION_COOKIE_NAME] = session.session_key
+
+    def test_unchanged_profile_is_not_modified_without_queries(self):
+        etag = self.client.get(self.profile_url)['ETag']
+
+        with self.assertNumQueries(0):
+            response = self.client.get(self.profile_url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_activation_of_own_code_invalidates_profile(self):
+        etag = self.client.get(self.profile_url)['ETag']
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.invitee.activate_invite(self.inviter)
+        response = self.client.get(self.profile_url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.json()['referrals'], [self.invitee.phone_number])
+
+
+class OpenAPISchemaTests(TestCase):
+    """Схема OpenAPI из файла с хешем содержимого или из памяти процесса"""
+
+    def test_build_writes_content_hashed_schema(self):
+        with tempfile.TemporaryDirectory() as static_root:
+            call_command('build_openapi_schema', static_root=static_root, stdout=StringIO())
+
+            manifest = json.loads((Path(static_root) / 'openapi' / 'manifest.json').read_text())
+            content = (Path(static_root) / manifest['schema']).read_bytes()
+
+        self.assertIn(hashlib.sha256(content).hexdigest()[:12], manifest['schema'])
+        self.assertIn('/profile/referrals/', json.loads(content)['paths'])
+
+    def test_fallback_serves_schema_from_memory(self):
+        response = self.client.get(reverse('openapi-schema'))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('/leaderboard/', response.json()['paths'])
+
+    @override_settings(ASYNC_VIEWS=True, ROOT_URLCONF=AsyncViewsURLConf)
+    def test_schema_lists_hot_endpoints_under_asgi(self):
+        with mock.patch('users.openapi._schema', None):
+            paths = get_schema()['paths']
+
+        self.assertEqual(sorted(paths), [
+            '/auth/delivery-status/', '/auth/send-code/', '/auth/verify-code/', '/health/db/', '/leaderboard/',
+            '/profile/', '/profile/activate-invite/', '/profile/downline/', '/profile/referrals/',
+        ])
+
+
+class RenderingTests(TestCase):
+    """Ответы горячих эндпоинтов без DRF-сериализаторов совпадают с ними по формату"""
+
+    def test_plain_dicts_match_serializers(self):
+        inviter = User.objects.create(phone_number='+79990000301')
+        User.objects.create(phone_number='+79990000302').activate_invite(inviter)
+        inviter.refresh_from_db()
+
+        self.assertEqual(user_auth_data(inviter), UserAuthSerializer(inviter).data)
+        self.assertEqual(
+            user_profile_data(inviter, list(inviter.referral_preview())),
+            UserProfileSerializer(inviter).data
+        )
+
+    def test_fallback_encoder_matches_orjson(self):
+        data = {'message': 'Код истек', 'created_at': timezone.now(), 'details': {'limit': 10}}
+
+        with mock.patch('users.renderers.orjson', None):
+            fallback = dumps(data)
+
+        self.assertEqual(dumps(data), fallback)
+        self.assertTrue(fallback.decode().endswith('Z","details":{"limit":10}}'))
+
+
+class PhoneNormalizationTests(TestCase):
+    """Номера телефонов в канонической форме E.164"""
+
+    def test_normalizes_and_rejects_before_queries(self):
+        self.assertEqual(normalize_phone_number(' +7 (999) 123-45-67 '), '+79991234567')
+        self.assertEqual(normalize_phone_number('+44 20 7946 0958'), '+442079460958')
+        for value in ('79991234567', '+7999123456', '+7 999 123 45 678', '+0123456789', '+7999abc4567'):
+            with self.subTest(value=value), self.assertRaises(ValidationError):
+                normalize_phone_number(value)
+
+        with self.assertNumQueries(0):
+            response = self.client.post(
+                reverse('send-code'), {'phone_number': '+2591234567'}, content_type='application/json'
+            )
+        self.assertEqual(response.status_code, 400)
+
+    def test_formatted_number_verifies_canonical_user(self):
+        user = User.objects.create(phone_number='+79990000401')
+        code = self.client.post(
+            reverse('send-code'), {'phone_number': '+7 999 000-04-01'}, content_type='application/json'
+        ).json()['code']
+
+        response = self.client.post(
+            reverse('verify-code'),
+            {'phone_number': '+7 (999) 000-04-01', 'code': code},
+            content_type='application/json'
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['id'], user.id)
+        self.assertEqual(User.objects.get(phone_key=79990000401), user)
+
+
+class IdempotencyKeyTests(TestCase):
+    """Повтор запросов с заголовком Idempotency-Key"""
+
+    def send(self, phone_number, key):
+        return self.client.post(
+            reverse('send-code'), {'phone_number': phone_number},
+            content_type='application/json', HTTP_IDEMPOTENCY_KEY=key
+        )
+
+    def test_retried_send_code_replays_response_with_one_query(self):
+        first = self.send('+79990000501', 'retry-1')
+
+        with self.assertNumQueries(1):
+            retry = self.send('+7 999 000-05-01', 'retry-1')
+
+        self.assertEqual(retry.status_code, 200)
+        self.assertEqual(retry.content, first.content)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertNotEqual(self.send('+79990000502', 'retry-1').json()['phone_number'], '+79990000501')
+
+    @override_settings(IDEMPOTENCY_SETTINGS={**settings.IDEMPOTENCY_SETTINGS, 'backend': 'memory'})
+    def test_retried_activation_replays_success(self):
+        inviter = User.objects.create(phone_number='+79990000503')
+        user = User.objects.create(phone_number='+79990000504')
+        session = self.client.session
+        session['user_id'] = user.id
+        session.save()
+        self.client.cookies[settings.SESSION_COOKIE_NAME] = session.session_key
+
+        def activate(**headers):
+            return self.client.post(
+                '/api/profile/activate-invite/', {'invite_code': inviter.invite_code},
+                content_type='application/json', **headers
+            )
+
+        first = activate(HTTP_IDEMPOTENCY_KEY='activate-1')
+        with self.assertNumQueries(0):
+            retry = activate(HTTP_IDEMPOTENCY_KEY='activate-1')
+
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(retry.content, first.content)
+        self.assertEqual(activate().json()['code'], 'INVITE_ALREADY_ACTIVATED')
+
+    def test_key_in_use_returns_conflict(self):
+        request = RequestFactory().post('/', HTTP_IDEMPOTENCY_KEY='retry-2')
+        key = idempotency_key(request, 'send_code', '+79990000505')
+        for backend in ('db', 'memory'):
+            with self.settings(IDEMPOTENCY_SETTINGS={**settings.IDEMPOTENCY_SETTINGS, 'backend': backend}):
+                # Ключ зарезервирован запросом, который еще выполняется
+                self.assertIsNone(get_idempotency_store().claim(key, 60))
+
+                response = self.send('+79990000505', 'retry-2')
+
+                self.assertEqual(response.status_code, 409)
+                self.assertEqual(response.json()['code'], 'IDEMPOTENCY_KEY_IN_USE')
+                self.assertEqual(response['Retry-After'], '1')
+                self.assertFalse(VerificationCode.objects.filter(phone_number='+79990000505').exists())
+
+    def test_abandoned_reservation_expires_before_response_ttl(self):
+        request = RequestFactory().post('/', HTTP_IDEMPOTENCY_KEY='retry-5')
+        key = idempotency_key(request, 'send_code', '+79990000508')
+        for backend in ('db', 'memory'):
+            with self.settings(IDEMPOTENCY_SETTINGS={
+                **settings.IDEMPOTENCY_SETTINGS, 'backend': backend, 'pending_ttl_seconds': 0
+            }):
+                # Воркер зарезервировал ключ и упал, не сохранив ответ
+                self.assertIsNone(claim_response(key))
+
+                response = self.send('+79990000508', 'retry-5')
+
+                self.assertEqual(response.status_code, 200)
+                self.assertNotIn('Idempotent-Replayed', response)
+                self.assertEqual(self.send('+79990000508', 'retry-5')['Idempotent-Replayed'], 'true')
+
+    def test_failed_request_releases_key(self):
+        rate_limit_settings = {
+            **settings.RATE_LIMIT_SETTINGS,
+            'enabled': True,
+            'backend': 'memory',
+            'rates': {'send_code_phone': '1/m', 'send_code_ip': '100/m'},
+        }
+        with self.settings(RATE_LIMIT_SETTINGS=rate_limit_settings):
+            self.assertEqual(self.send('+79990000506', 'first').status_code, 200)
+            self.assertEqual(self.send('+79990000506', 'retry-3').status_code, 429)
+
+        self.assertFalse(IdempotencyRecord.objects.filter(status=0).exists())
+        retry = self.send('+79990000506', 'retry-3')
+        self.assertEqual(retry.status_code, 200)
+        self.assertNotIn('Idempotent-Replayed', retry)
+
+    @override_settings(IDEMPOTENCY_SETTINGS={**settings.IDEMPOTENCY_SETTINGS, 'ttl_seconds': 600})
+    def test_ttl_is_capped_at_code_lifetime_and_expired_key_is_reused(self):
+        request = RequestFactory().post('/', HTTP_IDEMPOTENCY_KEY='retry-4')
+        key = idempotency_key(request, 'send_code', '+79990000507')
+        IdempotencyRecord.objects.create(
+            key=key, status=200, content=b'{}', expires_at=timezone.now() - timedelta(seconds=1)
+        )
+
+        response = self.send('+79990000507', 'retry-4')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('Idempotent-Replayed', response)
+        record = IdempotencyRecord.objects.get(key=key)
+        self.assertEqual(bytes(record.content), response.content)
+        lifetime = settings.VERIFICATION_CODE_SETTINGS['expiration_minutes'] * 60
+        self.assertLessEqual(record.expires_at, timezone.now() + timedelta(seconds=lifetime))
+
+
+@override_settings(INVITE_CODE_CACHE_SETTINGS={**settings.INVITE_CODE_CACHE_SETTINGS, 'enabled': True, 'max_size': 2})
+class InviteCodeCacheTests(TestCase):
+    """Кеш инвайт-код -> id пользователя в памяти воркера"""
+
+    def test_lru_with_negative_entries_invalidated_on_save(self):
+        with self.assertNumQueries(1):
+            self.assertIsNone(User.inviter_id_by_code('zz9zz9'))
+        with self.assertNumQueries(0):
+            self.assertIsNone(User.inviter_id_by_code('ZZ9ZZ9'))
+
+        user = User.objects.create(phone_number='+79990000601', invite_code='ZZ9ZZ9')
+        self.assertEqual(User.inviter_id_by_code('ZZ9ZZ9'), user.id)
+
+        User.inviter_id_by_code('AA1AA1')
+        User.inviter_id_by_code('ZZ9ZZ9')
+        User.inviter_id_by_code('BB2BB2')
+        with self.assertNumQueries(0):
+            self.assertEqual(User.inviter_id_by_code('ZZ9ZZ9'), user.id)
+        with self.assertNumQueries(1):
+            User.inviter_id_by_code('AA1AA1')
+
+    def test_stale_entry_is_rejected_on_activation(self):
+        inviter = User.objects.create(phone_number='+79990000602')
+        user = User.objects.create(phone_number='+79990000603')
+        code = inviter.invite_code
+        self.assertEqual(User.inviter_id_by_code(code), inviter.id)
+        User.objects.filter(id=inviter.id).update(invite_code='CC3CC3')
+        session = self.client.session
+        session['user_id'] = user.id
+        session.save()
+        self.client.cookies[settings.SESSION_COOKIE_NAME] = session.session_key
+
+        response = self.client.post(
+            '/api/profile/activate-invite/', {'invite_code': code}, content_type='application/json'
+        )
+
+        self.assertEqual(response.json()['code'], 'INVALID_INVITE_CODE')
+        self.assertIsNone(User.inviter_id_by_code(code))
+        user.refresh_from_db()
+        self.assertIsNone(user.referred_by)
+
+
+class SendCodeRateLimitTests(TestCase):
+    """Лимиты частоты /api/auth/send-code/ по номеру телефона и IP"""
+
+    def send(self, phone_number):
+        return self.client.post(
+            reverse('send-code'),
+            {'phone_number': phone_number},
+            content_type='application/json'
+        )
+
+    def rate_limit_settings(self, backend='memory', phone_rate='2/m', ip_rate='100/m'):
+        return {
+            **settings.RATE_LIMIT_SETTINGS,
+            'enabled': True,
+            'backend': backend,
+            'rates': {'send_code_phone': phone_rate, 'send_code_ip': ip_rate},
+        }
+
+    def assertRateLimited(self, response, scope):
+        self.assertEqual(response.status_code, 429)
+        self.assertGreaterEqual(int(response['Retry-After']), 1)
+        self.assertEqual(response.json()['code'], 'RATE_LIMITED')
+        self.assertEqual(response.json()['details']['scope'], scope)
+
+    def test_phone_limit(self):
+        with self.settings(RATE_LIMIT_SETTINGS=self.rate_limit_settings()):
+            self.assertEqual(self.send('+79990000011').status_code, 200)
+            self.assertEqual(self.send('+79990000011').status_code, 200)
+
+            self.assertRateLimited(self.send('+79990000011'), 'phone')
+            self.assertEqual(self.send('+79990000012').status_code, 200)
+
+    def test_ip_limit(self):
+        with self.settings(RATE_LIMIT_SETTINGS=self.rate_limit_settings(ip_rate='2/m')):
+            self.assertEqual(self.send('+79990000021').status_code, 200)
+            self.assertEqual(self.send('+79990000022').status_code, 200)
+
+            self.assertRateLimited(self.send('+79990000023'), 'ip')
+
+    def test_cache_backend(self):
+        with self.settings(RATE_LIMIT_SETTINGS=self.rate_limit_settings(backend='cache')):
+            self.assertEqual(self.send('+79990000031').status_code, 200)
+            self.assertEqual(self.send('+79990000031').status_code, 200)
+
+            self.assertRateLimited(self.send('+79990000031'), 'phone')
+            self.assertEqual(VerificationCode.objects.filter(phone_number='+79990000031').count(), 1)
+
+    def test_phone_rejections_do_not_spend_ip_limit(self):
+        for backend in ('memory', 'cache'):
+            caches[settings.RATE_LIMIT_SETTINGS['cache_alias']].clear()
+            with self.subTest(backend=backend), self.settings(
+                RATE_LIMIT_SETTINGS=self.rate_limit_settings(backend=backend, phone_rate='1/m', ip_rate='3/m')
+            ):
+                self.assertEqual(self.send('+79990000041').status_code, 200)
+                for _ in range(5):
+                    self.assertRateLimited(self.send('+79990000041'), 'phone')
+
+                self.assertEqual(self.send('+79990000042').status_code, 200)
+                self.assertEqual(self.send('+79990000043').status_code, 200)
+                self.assertRateLimited(self.send('+79990000044'), 'ip')
+
+
+class ImportUsersTests(TestCase):
+    """Команда import_users"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.path = Path(self.tmp_dir.name) / 'users.csv'
+        self.path.write_text(
+            'phone_number,invite_code,activated_invite_code\n'
+            '+79991110001,legacy1,\n'
+            '+79991110002,,LEGACY1\n'
+            '79991110003,,\n'
+            '+79991110002,,\n'
+            '+79991110004,,legacy1\n',
+            encoding='utf-8'
+        )
+
+    def run_import(self, *args):
+        call_command('import_users', str(self.path), '--batch-size', '2', *args, stdout=StringIO())
+
+    def test_imports_users_and_referral_links(self):
+        User.objects.create(phone_number='+79991110004')
+
+        self.run_import()
+
+        inviter = User.objects.get(phone_number='+79991110001')
+        self.assertEqual(inviter.invite_code, 'LEGACY1')
+        self.assertEqual(inviter.referral_count, 1)
+        self.assertEqual(User.objects.get(phone_number='+79991110002').referred_by, inviter)
+        self.assertFalse(User.objects.filter(phone_number='79991110003').exists())
+        self.assertIsNone(User.objects.get(phone_number='+79991110004').referred_by)
+        self.assertTrue(User.objects.get(phone_number='+79991110002').invite_code)
+
+        checkpoint = json.loads(Path(f'{self.path}.checkpoint').read_text(encoding='utf-8'))
+        self.assertEqual(checkpoint, {'processed': 5, 'inserted': 2, 'skipped': 2, 'invalid': 1})
+
+    def test_resume_skips_imported_records(self):
+        Path(f'{self.path}.checkpoint').write_text(
+            json.dumps({'processed': 2, 'inserted': 0, 'skipped': 0, 'invalid': 0}),
+            encoding='utf-8'
+        )
+
+        self.run_import('--resume')
+
+        self.assertEqual(
+            list(User.objects.order_by('phone_number').values_list('phone_number', flat=True)),
+            ['+79991110002', '+79991110004']
+        )
+
+    def test_bulk_insert_counts_rows_lost_to_conflicts_as_skipped(self):
+        records = [{'phone_number': '+79991110011'}, {'phone_number': '+79991110012'}]
+        # Номер добавлен другим процессом после проверки существующих
+        with mock.patch('users.importing._exclude_existing', lambda users, result: [user for _, user in users]):
+            User.objects.create(phone_number='+79991110012')
+            result = import_batch(records, 1, method='bulk')
+
+        self.assertEqual((result.inserted, result.skipped), (1, 1))
+
+    @override_settings(REFERRAL_SETTINGS={**settings.REFERRAL_SETTINGS, 'max_tree_depth': 1})
+    def test_truncated_closure_fails_the_import(self):
+        with self.assertRaisesMessage(CommandError, 'остановлена на глубине 1'):
+            self.run_import()
+
+        self.assertEqual(User.objects.get(phone_number='+79991110002').referred_by.phone_number, '+79991110001')
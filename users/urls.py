@@ -1,9 +1,26 @@
+from django.conf import settings
 from django.urls import path
-from . import views
-
-urlpatterns = [
-    path('auth/send-code/', views.send_code, name='send-code'),
-    path('auth/verify-code/', views.verify_code, name='verify-code'),
-    path('profile/', views.profile, name='profile'),
-    path('profile/activate-invite/', views.activate_invite, name='activate-invite'),
-]
\ No newline at end of file
+from . import views, async_views
+
+
+def build_urlpatterns(endpoints):
+    """Маршруты API с горячими эндпоинтами из модуля endpoints"""
+    return [
+        path('auth/send-code/', endpoints.send_code, name='send-code'),
+        path('auth/delivery-status/', views.delivery_status, name='delivery-status'),
+        path('auth/verify-code/', endpoints.verify_code, name='verify-code'),
+        path('profile/', endpoints.profile, name='profile'),
+        path('profile/referrals/', views.referrals, name='referrals'),
+        path('profile/downline/', views.downline, name='downline'),
+        path('profile/activate-invite/', endpoints.activate_invite, name='activate-invite'),
+        path('leaderboard/', views.leaderboard, name='leaderboard'),
+        path('health/db/', views.db_health, name='db-health'),
+    ]
+
+
+# Под ASGI (SERVER_MODE=asgi) горячие эндпоинты обслуживаются асинхронными представлениями
+urlpatterns = build_urlpatterns(async_views if settings.ASYNC_VIEWS else views)
+
+# Схема OpenAPI строится по DRF-представлениям при любом SERVER_MODE:
+# асинхронные представления вне DRF drf_yasg не видит
+schema_urlpatterns = build_urlpatterns(views)
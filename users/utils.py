@@ -1,20 +1,36 @@
-from .serializers import ErrorSerializer
-from rest_framework.response import Response
+from functools import lru_cache
+from django.http import HttpResponse
+from .renderers import dumps
 
-def create_error_response(status_code, message, code=None, details=None):
+def build_error_data(message, code=None, details=None):
     """
-    Создает стандартизированный ответ об ошибке
+    Формирует тело стандартизированного ответа об ошибке
     """
     error_data = {
         'status': 'error',
         'message': message
     }
-    
+
     if code:
         error_data['code'] = code
-    
+
     if details:
         error_data['details'] = details
-    
-    serializer = ErrorSerializer(error_data)
-    return Response(serializer.data, status=status_code)
\ No newline at end of file
+
+    return error_data
+
+@lru_cache(maxsize=256)
+def encode_error(message, code=None):
+    """
+    Тело ошибки без деталей: сообщения и коды ошибок фиксированы,
+    поэтому каждое тело кодируется один раз на процесс
+    """
+    return dumps(build_error_data(message, code))
+
+def create_error_response(status_code, message, code=None, details=None):
+    """
+    Создает стандартизированный ответ об ошибке. Формат описан ErrorSerializer,
+    но тело кодируется напрямую, без сериализатора и рендерера DRF.
+    """
+    body = dumps(build_error_data(message, code, details)) if details else encode_error(message, code)
+    return HttpResponse(body, status=status_code, content_type='application/json')
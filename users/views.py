@@ -1,28 +1,57 @@
-import random
-import time
 import logging
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from rest_framework import status
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseRedirect
 from django.utils import timezone
+from django.utils.crypto import constant_time_compare
 from django.core.exceptions import ObjectDoesNotExist
 from django.db import IntegrityError
 from drf_yasg.utils import swagger_auto_schema
 from drf_yasg import openapi
-from .models import User, VerificationCode, CodeGenerationError
+from prometheus_client import CONTENT_TYPE_LATEST
+from .models import User, VerificationCode, CodeDelivery, CodeGenerationError, ReferralCycleError, ReferralClosure
+from .delivery import deliver_code
 from .serializers import (
     PhoneSerializer, 
     CodeSerializer, 
     UserProfileSerializer, 
+    ReferralSerializer, 
     UserAuthSerializer, 
     ActivateInviteSerializer,
-    VerificationCodeResponseSerializer,
-    ErrorSerializer 
+    CodeDeliveryStatusSerializer,
+    ErrorSerializer,
+    user_auth_data,
+    user_profile_data,
 )
+from .pagination import ReferralCursorPagination
+from .profile_cache import etag_matches, get_profile, profile_cache_headers, profile_etag, profile_version, set_profile
+from .db import database_status
+from .idempotency import IDEMPOTENCY_HEADER, claim_response, idempotency_key, run_idempotent
+from .invite_cache import invalidate_invite_codes
+from .leaderboard import leaderboard_data
+from .openapi import get_schema_json, get_schema_static_url
+from .metrics import CODES_SENT, CODE_VERIFICATIONS, INVITE_ACTIVATIONS, render_metrics
+from .ratelimit import check_delivery_status_rate, check_send_code_rate
 from .utils import create_error_response
 
 logger = logging.getLogger(__name__)
 
+
+def profile_data(user):
+    """Данные профиля: без рефералов превью не запрашивается"""
+    return user_profile_data(user, list(user.referral_preview()) if user.referral_count else [])
+
+
+idempotency_key_param = openapi.Parameter(
+    IDEMPOTENCY_HEADER,
+    openapi.IN_HEADER,
+    description="Ключ идемпотентности: повтор запроса с тем же ключом возвращает сохраненный ответ",
+    type=openapi.TYPE_STRING,
+    required=False
+)
+
 phone_number_param = openapi.Parameter(
     'phone_number', 
     openapi.IN_QUERY, 
@@ -35,7 +64,7 @@ send_code_request = openapi.Schema(
     properties={
         'phone_number': openapi.Schema(
             type=openapi.TYPE_STRING, 
-            description='Номер телефона в международном формате (начинается с +)',
+            description='Номер телефона в международном формате (начинается с +, допускаются пробелы, дефисы и скобки)',
             example='+79991234567'
         )
     },
@@ -46,8 +75,9 @@ send_code_response = openapi.Schema(
     type=openapi.TYPE_OBJECT,
     properties={
         'message': openapi.Schema(type=openapi.TYPE_STRING, description='Сообщение о результате'),
-        'phone_number': openapi.Schema(type=openapi.TYPE_STRING, description='Номер телефона'),
-        'code': openapi.Schema(type=openapi.TYPE_STRING, description='Код верификации (только для тестирования)')
+        'phone_number': openapi.Schema(type=openapi.TYPE_STRING, description='Номер телефона в форме E.164'),
+        'code': openapi.Schema(type=openapi.TYPE_STRING, description='Код верификации (только для тестирования)'),
+        'delivery_status': openapi.Schema(type=openapi.TYPE_STRING, description='Статус доставки кода (pending, sending, sent, failed)')
     }
 )
 
@@ -68,6 +98,92 @@ verify_code_request = openapi.Schema(
     required=['phone_number', 'code']
 )
 
+referrals_response = openapi.Schema(
+    type=openapi.TYPE_OBJECT,
+    properties={
+        'next': openapi.Schema(type=openapi.TYPE_STRING, description='Ссылка на следующую страницу', x_nullable=True),
+        'previous': openapi.Schema(type=openapi.TYPE_STRING, description='Ссылка на предыдущую страницу', x_nullable=True),
+        'results': openapi.Schema(
+            type=openapi.TYPE_ARRAY,
+            items=openapi.Schema(
+                type=openapi.TYPE_OBJECT,
+                properties={
+                    'phone_number': openapi.Schema(type=openapi.TYPE_STRING, description='Номер телефона реферала'),
+                    'created_at': openapi.Schema(type=openapi.TYPE_STRING, format=openapi.FORMAT_DATETIME, description='Дата регистрации'),
+                }
+            )
+        )
+    }
+)
+
+referrals_params = [
+    openapi.Parameter('cursor', openapi.IN_QUERY, description="Курсор страницы", type=openapi.TYPE_STRING),
+    openapi.Parameter('page_size', openapi.IN_QUERY, description="Размер страницы", type=openapi.TYPE_INTEGER),
+]
+
+db_health_response = openapi.Schema(
+    type=openapi.TYPE_OBJECT,
+    properties={
+        'pid': openapi.Schema(type=openapi.TYPE_INTEGER, description='PID воркера, ответившего на запрос'),
+        'vendor': openapi.Schema(type=openapi.TYPE_STRING, description='СУБД'),
+        'connection_mode': openapi.Schema(type=openapi.TYPE_STRING, description='Режим соединений (persistent, pool)'),
+        'conn_max_age': openapi.Schema(type=openapi.TYPE_INTEGER, description='Время жизни постоянного соединения, секунды'),
+        'health_checks': openapi.Schema(type=openapi.TYPE_BOOLEAN, description='Проверка соединения перед переиспользованием'),
+        'reused_connection': openapi.Schema(type=openapi.TYPE_BOOLEAN, description='Запрос обслужен уже открытым соединением'),
+        'healthy': openapi.Schema(type=openapi.TYPE_BOOLEAN, description='БД ответила на SELECT 1'),
+        'latency_ms': openapi.Schema(type=openapi.TYPE_NUMBER, description='Задержка SELECT 1, мс'),
+        'pool': openapi.Schema(type=openapi.TYPE_OBJECT, description='Статистика пула psycopg (только в режиме pool)'),
+    }
+)
+
+downline_response = openapi.Schema(
+    type=openapi.TYPE_OBJECT,
+    properties={
+        'total': openapi.Schema(type=openapi.TYPE_INTEGER, description='Размер дерева рефералов на всех уровнях'),
+        'levels': openapi.Schema(
+            type=openapi.TYPE_ARRAY,
+            items=openapi.Schema(
+                type=openapi.TYPE_OBJECT,
+                properties={
+                    'depth': openapi.Schema(type=openapi.TYPE_INTEGER, description='Уровень (1 - прямые рефералы)'),
+                    'count': openapi.Schema(type=openapi.TYPE_INTEGER, description='Число рефералов на уровне'),
+                }
+            )
+        )
+    }
+)
+
+leaderboard_params = [
+    openapi.Parameter('limit', openapi.IN_QUERY, description="Размер топа (по умолчанию 10, максимум 100)", type=openapi.TYPE_INTEGER),
+]
+
+leaderboard_response = openapi.Schema(
+    type=openapi.TYPE_OBJECT,
+    properties={
+        'top': openapi.Schema(
+            type=openapi.TYPE_ARRAY,
+            items=openapi.Schema(
+                type=openapi.TYPE_OBJECT,
+                properties={
+                    'rank': openapi.Schema(type=openapi.TYPE_INTEGER, description='Место (одинаковые счетчики делят место)'),
+                    'phone_number': openapi.Schema(type=openapi.TYPE_STRING, description='Номер телефона со скрытыми цифрами'),
+                    'referral_count': openapi.Schema(type=openapi.TYPE_INTEGER, description='Число рефералов'),
+                    'is_me': openapi.Schema(type=openapi.TYPE_BOOLEAN, description='Строка текущего пользователя'),
+                }
+            )
+        ),
+        'me': openapi.Schema(
+            type=openapi.TYPE_OBJECT,
+            x_nullable=True,
+            description='Место текущего пользователя (null без аутентификации)',
+            properties={
+                'rank': openapi.Schema(type=openapi.TYPE_INTEGER, description='Место или null без рефералов', x_nullable=True),
+                'referral_count': openapi.Schema(type=openapi.TYPE_INTEGER, description='Число рефералов'),
+            }
+        ),
+    }
+)
+
 activate_invite_request = openapi.Schema(
     type=openapi.TYPE_OBJECT,
     properties={
@@ -80,14 +196,38 @@ activate_invite_request = openapi.Schema(
     required=['invite_code']
 )
 
+def _send_code(request, phone_number):
+    """Выдача и доставка кода для проверенного номера"""
+    check_send_code_rate(request, phone_number)
+    
+    verification_code = VerificationCode.create_code(phone_number)
+    CODES_SENT.labels('reused' if verification_code.reused else 'created').inc()
+    logger.info(
+        "%s код верификации %s для номера %s",
+        "Повторно отправлен" if verification_code.reused else "Создан",
+        verification_code.code, phone_number
+    )
+    
+    delivery = deliver_code(phone_number, verification_code.code)
+    logger.debug("Доставка кода для %s: %s", phone_number, delivery.status)
+    
+    return Response({
+        'message': 'Код успешно отправлен',
+        'phone_number': phone_number,
+        'code': verification_code.code,
+        'delivery_status': delivery.status
+    })
+
 @swagger_auto_schema(
     method='post',
     operation_description="Отправка кода верификации на номер телефона",
     request_body=send_code_request,
+    manual_parameters=[idempotency_key_param],
     responses={
         200: send_code_response,
         400: openapi.Response(description="Ошибка валидации", schema=ErrorSerializer()),
-        500: openapi.Response(description="Ошибка сервера", schema=ErrorSerializer())
+        409: openapi.Response(description="Запрос с этим ключом идемпотентности еще выполняется", schema=ErrorSerializer()),
+        429: openapi.Response(description="Превышен лимит запросов (см. заголовок Retry-After)", schema=ErrorSerializer())
     }
 )
 @api_view(['POST'])
@@ -96,32 +236,61 @@ def send_code(request):
     Отправка кода верификации на номер телефона
     """
     serializer = PhoneSerializer(data=request.data)
+    if serializer.is_valid():
+        phone_number = serializer.validated_data['phone_number']
+        idempotency = idempotency_key(request, 'send_code', phone_number)
+        replay = claim_response(idempotency)
+        if replay is not None:
+            logger.info("Повтор запроса кода для %s по ключу идемпотентности", phone_number)
+            return replay
+        return run_idempotent(idempotency, _send_code, request, phone_number)
+    
+    logger.warning("Невалидные данные при отправке кода: %s", serializer.errors)
+    error_details = {}
+    for field, errors in serializer.errors.items():
+        error_details[field] = errors[0] if isinstance(errors, list) and errors else str(errors)
+
+    return create_error_response(
+        status.HTTP_400_BAD_REQUEST,
+        'Неверные данные запроса',
+        'VALIDATION_ERROR',
+        error_details
+    )
+
+@swagger_auto_schema(
+    method='get',
+    operation_description="Статус доставки последнего кода верификации",
+    manual_parameters=[phone_number_param],
+    responses={
+        200: openapi.Response(
+            description="Статус доставки",
+            schema=CodeDeliveryStatusSerializer
+        ),
+        400: openapi.Response(description="Ошибка валидации", schema=ErrorSerializer()),
+        404: openapi.Response(description="Доставка не найдена", schema=ErrorSerializer()),
+        429: openapi.Response(description="Превышен лимит запросов (см. заголовок Retry-After)", schema=ErrorSerializer())
+    }
+)
+@api_view(['GET'])
+def delivery_status(request):
+    """
+    Статус доставки последнего кода верификации
+    """
+    check_delivery_status_rate(request)
+    serializer = PhoneSerializer(data=request.query_params)
     if serializer.is_valid():
         phone_number = serializer.validated_data['phone_number']
         
-        try:
-            verification_code = VerificationCode.create_code(phone_number)
-            logger.info(f"Создан код верификации {verification_code.code} для номера {phone_number}")
-        except CodeGenerationError as e:
-            logger.error(f"Ошибка генерации кода для {phone_number}: {str(e)}")
+        delivery = CodeDelivery.latest_for_phone(phone_number)
+        if delivery is None:
             return create_error_response(
-                status.HTTP_500_INTERNAL_SERVER_ERROR,
-                str(e),
-                'CODE_GENERATION_ERROR'
+                status.HTTP_404_NOT_FOUND,
+                'Доставка кода не найдена',
+                'DELIVERY_NOT_FOUND'
             )
         
-        delay = random.uniform(1, 2)
-        time.sleep(delay)
-        logger.debug(f"Задержка отправки кода: {delay:.2f} секунд")
-        
-        response_serializer = VerificationCodeResponseSerializer({
-            'message': 'Код успешно отправлен',
-            'phone_number': phone_number,
-            'code': verification_code.code
-        })
-        return Response(response_serializer.data)
+        return Response(CodeDeliveryStatusSerializer(delivery).data)
     
-    logger.warning(f"Невалидные данные при отправке кода: {serializer.errors}")
     error_details = {}
     for field, errors in serializer.errors.items():
         error_details[field] = errors[0] if isinstance(errors, list) and errors else str(errors)
@@ -166,57 +335,54 @@ def verify_code(request):
         phone_number = serializer.validated_data['phone_number']
         code = serializer.validated_data['code']
         
-        try:
-            verification_code = VerificationCode.objects.get(
-                phone_number=phone_number,
-                code=code
-            )
-            
-            if not verification_code.is_valid():
-                verification_code.delete()
-                logger.warning(f"Попытка использования просроченного кода для {phone_number}")
-                return create_error_response(
-                    status.HTTP_400_BAD_REQUEST,
-                    'Код истек',
-                    'CODE_EXPIRED'
-                )
-            
-            verification_code.delete()
-            logger.info(f"Код верификации успешно использован для {phone_number}")
-            
-            try:
-                user, created = User.objects.get_or_create(phone_number=phone_number)
-                if created:
-                    logger.info(f"Создан новый пользователь: {phone_number}")
-                else:
-                    logger.info(f"Аутентификация существующего пользователя: {phone_number}")
-            except IntegrityError as e:
-                logger.error(f"Ошибка создания пользователя {phone_number}: {str(e)}")
-                return create_error_response(
-                    status.HTTP_500_INTERNAL_SERVER_ERROR,
-                    'Ошибка создания пользователя',
-                    'USER_CREATION_ERROR',
-                    {'error_details': str(e)}
-                )
-            
-            request.session['user_id'] = user.id
-            logger.debug(f"Пользователь {user.id} аутентифицирован, ID сохранен в сессии")
-            
-            user_serializer = UserAuthSerializer(user)
-            response_data = user_serializer.data
-            response_data['is_new_user'] = created
-            
-            return Response(response_data)
-            
-        except VerificationCode.DoesNotExist:
-            logger.warning(f"Попытка использования неверного кода для {phone_number}")
+        consumed = VerificationCode.consume(phone_number, code)
+        if consumed is None:
+            logger.warning("Попытка использования неверного кода для %s", phone_number)
+            CODE_VERIFICATIONS.labels('INVALID_CODE').inc()
             return create_error_response(
                 status.HTTP_400_BAD_REQUEST,
                 'Неверный код',
                 'INVALID_CODE'
             )
+        
+        if not consumed:
+            logger.warning("Попытка использования просроченного кода для %s", phone_number)
+            CODE_VERIFICATIONS.labels('CODE_EXPIRED').inc()
+            return create_error_response(
+                status.HTTP_400_BAD_REQUEST,
+                'Код истек',
+                'CODE_EXPIRED'
+            )
+        
+        logger.info("Код верификации успешно использован для %s", phone_number)
+        
+        try:
+            user, created = User.get_or_create_by_phone(phone_number)
+            if created:
+                logger.info("Создан новый пользователь: %s", phone_number)
+            else:
+                logger.info("Аутентификация существующего пользователя: %s", phone_number)
+        except (IntegrityError, CodeGenerationError) as e:
+            logger.error("Ошибка создания пользователя %s: %s", phone_number, e)
+            CODE_VERIFICATIONS.labels('USER_CREATION_ERROR').inc()
+            return create_error_response(
+                status.HTTP_500_INTERNAL_SERVER_ERROR,
+                'Ошибка создания пользователя',
+                'USER_CREATION_ERROR',
+                {'error_details': str(e)}
+            )
+        
+        request.session['user_id'] = user.id
+        CODE_VERIFICATIONS.labels('success').inc()
+        logger.debug("Пользователь %s аутентифицирован, ID сохранен в сессии", user.id)
+        
+        response_data = user_auth_data(user)
+        response_data['is_new_user'] = created
+        
+        return Response(response_data)
     
-    logger.warning(f"Невалидные данные при верификации кода: {serializer.errors}")
+    logger.warning("Невалидные данные при верификации кода: %s", serializer.errors)
+    CODE_VERIFICATIONS.labels('VALIDATION_ERROR').inc()
     error_details = {}
     for field, errors in serializer.errors.items():
         error_details[field] = errors[0] if isinstance(errors, list) and errors else str(errors)
@@ -260,61 +426,149 @@ def profile(request):
             'NOT_AUTHENTICATED'
         )
     
-    try:
-        user = User.objects.get(id=user_id)
-        logger.debug(f"Получен профиль пользователя {user_id}")
-        serializer = UserProfileSerializer(user)
-        return Response(serializer.data)
-    except User.DoesNotExist:
-        logger.error(f"Пользователь с ID {user_id} не найден")
-        return create_error_response(
-            status.HTTP_404_NOT_FOUND,
-            'Пользователь не найден',
-            'USER_NOT_FOUND'
-        )
+    etag = data = None
+    if settings.PROFILE_CACHE_SETTINGS['enabled']:
+        version = profile_version(user_id)
+        etag = profile_etag(user_id, version)
+        if etag_matches(request, etag):
+            logger.debug("Профиль пользователя %s не изменился", user_id)
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers=profile_cache_headers(etag))
+        data = get_profile(user_id, version)
+    
+    if data is None:
+        try:
+            user = User.objects.get(id=user_id)
+        except User.DoesNotExist:
+            logger.error("Пользователь с ID %s не найден", user_id)
+            return create_error_response(
+                status.HTTP_404_NOT_FOUND,
+                'Пользователь не найден',
+                'USER_NOT_FOUND'
+            )
+        logger.debug("Получен профиль пользователя %s", user_id)
+        data = profile_data(user)
+        if etag:
+            set_profile(user_id, version, data)
+    
+    return Response(data, headers=profile_cache_headers(etag))
 
 @swagger_auto_schema(
-    method='post',
-    operation_description="Активация инвайт-кода",
-    request_body=activate_invite_request,
+    method='get',
+    operation_description="Список рефералов пользователя с курсорной пагинацией",
+    manual_parameters=referrals_params,
     responses={
         200: openapi.Response(
-            description="Инвайт-код успешно активирован",
-            schema=UserProfileSerializer
-        ),
-        400: openapi.Response(
-            description="Ошибка активации",
-            schema=ErrorSerializer()
+            description="Страница рефералов",
+            schema=referrals_response
         ),
         401: openapi.Response(
             description="Не авторизован",
             schema=ErrorSerializer()
+        )
+    }
+)
+@api_view(['GET'])
+def referrals(request):
+    """
+    Список рефералов пользователя с курсорной пагинацией
+    """
+    user_id = request.session.get('user_id')
+    if not user_id:
+        logger.warning("Попытка доступа к рефералам неаутентифицированного пользователя")
+        return create_error_response(
+            status.HTTP_401_UNAUTHORIZED,
+            'Необходима аутентификация',
+            'NOT_AUTHENTICATED'
+        )
+    
+    paginator = ReferralCursorPagination()
+    queryset = User.objects.filter(referred_by_id=user_id).only('id', 'phone_number', 'created_at')
+    page = paginator.paginate_queryset(queryset, request)
+    serializer = ReferralSerializer(page, many=True)
+    return paginator.get_paginated_response(serializer.data)
+
+@swagger_auto_schema(
+    method='get',
+    operation_description="Размер дерева рефералов пользователя по уровням",
+    responses={
+        200: openapi.Response(
+            description="Число рефералов на каждом уровне",
+            schema=downline_response
         ),
-        404: openapi.Response(
-            description="Пользователь не найден",
+        401: openapi.Response(
+            description="Не авторизован",
             schema=ErrorSerializer()
         )
     }
 )
-@api_view(['POST'])
-def activate_invite(request):
+@api_view(['GET'])
+def downline(request):
     """
-    Активация инвайт-кода
+    Размер дерева рефералов пользователя по уровням
     """
     user_id = request.session.get('user_id')
     if not user_id:
-        logger.warning("Попытка активации инвайт-кода неаутентифицированным пользователем")
+        logger.warning("Попытка доступа к дереву рефералов неаутентифицированного пользователя")
         return create_error_response(
             status.HTTP_401_UNAUTHORIZED,
             'Необходима аутентификация',
             'NOT_AUTHENTICATED'
         )
     
+    levels = ReferralClosure.downline_levels(user_id)
+    return Response({
+        'total': sum(count for _, count in levels),
+        'levels': [{'depth': depth, 'count': count} for depth, count in levels],
+    })
+
+@swagger_auto_schema(
+    method='get',
+    operation_description="Рейтинг пользователей по числу рефералов и место текущего пользователя",
+    manual_parameters=leaderboard_params,
+    responses={
+        200: openapi.Response(
+            description="Рейтинг",
+            schema=leaderboard_response
+        ),
+        400: openapi.Response(
+            description="Неверный параметр limit",
+            schema=ErrorSerializer()
+        )
+    }
+)
+@api_view(['GET'])
+def leaderboard(request):
+    """
+    Рейтинг пользователей по числу рефералов и место текущего пользователя
+    """
+    leaderboard_settings = settings.LEADERBOARD_SETTINGS
+    try:
+        limit = int(request.query_params.get('limit', leaderboard_settings['default_limit']))
+    except ValueError:
+        limit = 0
+    if not 1 <= limit <= leaderboard_settings['max_limit']:
+        return create_error_response(
+            status.HTTP_400_BAD_REQUEST,
+            'Неверные данные запроса',
+            'VALIDATION_ERROR',
+            {'limit': f"Ожидается число от 1 до {leaderboard_settings['max_limit']}"}
+        )
+    
+    user = None
+    user_id = request.session.get('user_id')
+    if user_id:
+        user = User.objects.only('id', 'referral_count').filter(id=user_id).first()
+    
+    return Response(leaderboard_data(limit, user))
+
+def _activate_invite(request, user_id):
+    """Активация инвайт-кода аутентифицированным пользователем"""
     try:
         user = User.objects.get(id=user_id)
-        logger.debug(f"Пользователь {user_id} инициировал активацию инвайт-кода")
+        logger.debug("Пользователь %s инициировал активацию инвайт-кода", user_id)
     except User.DoesNotExist:
-        logger.error(f"Пользователь с ID {user_id} не найден при активации инвайт-кода")
+        logger.error("Пользователь с ID %s не найден при активации инвайт-кода", user_id)
+        INVITE_ACTIVATIONS.labels('USER_NOT_FOUND').inc()
         return create_error_response(
             status.HTTP_404_NOT_FOUND,
             'Пользователь не найден',
@@ -322,7 +576,8 @@ def activate_invite(request):
         )
     
     if user.activated_invite_code:
-        logger.warning(f"Пользователь {user_id} пытается активировать второй инвайт-код")
+        logger.warning("Пользователь %s пытается активировать второй инвайт-код", user_id)
+        INVITE_ACTIVATIONS.labels('INVITE_ALREADY_ACTIVATED').inc()
         return create_error_response(
             status.HTTP_400_BAD_REQUEST,
             'Инвайт-код уже активирован',
@@ -333,32 +588,62 @@ def activate_invite(request):
     if serializer.is_valid():
         invite_code = serializer.validated_data['invite_code']
         
-        try:
-            invited_user = User.objects.get(invite_code__iexact=invite_code)
-        except User.DoesNotExist:
-            logger.warning(f"Попытка активации несуществующего инвайт-кода: {invite_code}")
+        inviter_id = User.inviter_id_by_code(invite_code)
+        if inviter_id is None:
+            logger.warning("Попытка активации несуществующего инвайт-кода: %s", invite_code)
+            INVITE_ACTIVATIONS.labels('INVALID_INVITE_CODE').inc()
             return create_error_response(
                 status.HTTP_400_BAD_REQUEST,
                 'Неверный инвайт-код',
                 'INVALID_INVITE_CODE'
             )
         
-        if invited_user.id == user.id:
-            logger.warning(f"Пользователь {user_id} пытается использовать свой собственный инвайт-код")
+        if inviter_id == user.id:
+            logger.warning("Пользователь %s пытается использовать свой собственный инвайт-код", user_id)
+            INVITE_ACTIVATIONS.labels('SELF_INVITE_NOT_ALLOWED').inc()
             return create_error_response(
                 status.HTTP_400_BAD_REQUEST,
                 'Нельзя использовать свой собственный инвайт-код',
                 'SELF_INVITE_NOT_ALLOWED'
             )
         
-        user.activated_invite_code = invited_user.invite_code 
-        user.save()
-        logger.info(f"Пользователь {user_id} успешно активировал инвайт-код {invite_code}")
+        # Пригласивший известен по id и коду, activate_invite сверяет код под блокировкой строки
+        invited_user = User(id=inviter_id, invite_code=invite_code)
+        try:
+            activated = user.activate_invite(invited_user)
+        except ReferralCycleError:
+            logger.warning("Пользователь %s пытается активировать код из своего дерева рефералов: %s", user_id, invite_code)
+            INVITE_ACTIVATIONS.labels('REFERRAL_CYCLE_NOT_ALLOWED').inc()
+            return create_error_response(
+                status.HTTP_400_BAD_REQUEST,
+                'Нельзя использовать инвайт-код своего реферала',
+                'REFERRAL_CYCLE_NOT_ALLOWED'
+            )
+        except User.DoesNotExist:
+            # Запись кеша устарела: код удален или сменился
+            invalidate_invite_codes([invite_code])
+            logger.warning("Инвайт-код %s больше не принадлежит пользователю %s", invite_code, inviter_id)
+            INVITE_ACTIVATIONS.labels('INVALID_INVITE_CODE').inc()
+            return create_error_response(
+                status.HTTP_400_BAD_REQUEST,
+                'Неверный инвайт-код',
+                'INVALID_INVITE_CODE'
+            )
+        if not activated:
+            logger.warning("Пользователь %s пытается активировать второй инвайт-код", user_id)
+            INVITE_ACTIVATIONS.labels('INVITE_ALREADY_ACTIVATED').inc()
+            return create_error_response(
+                status.HTTP_400_BAD_REQUEST,
+                'Инвайт-код уже активирован',
+                'INVITE_ALREADY_ACTIVATED'
+            )
+        logger.info("Пользователь %s успешно активировал инвайт-код %s", user_id, invite_code)
+        INVITE_ACTIVATIONS.labels('success').inc()
         
-        updated_serializer = UserProfileSerializer(user)
-        return Response(updated_serializer.data)
+        return Response(profile_data(user))
     
-    logger.warning(f"Невалидные данные при активации инвайт-кода: {serializer.errors}")
+    logger.warning("Невалидные данные при активации инвайт-кода: %s", serializer.errors)
+    INVITE_ACTIVATIONS.labels('VALIDATION_ERROR').inc()
     error_details = {}
     for field, errors in serializer.errors.items():
         error_details[field] = errors[0] if isinstance(errors, list) and errors else str(errors)
@@ -368,4 +653,108 @@ def activate_invite(request):
         'Неверные данные запроса',
         'VALIDATION_ERROR',
         error_details
-    )
\ No newline at end of file
+    )
+
+@swagger_auto_schema(
+    method='post',
+    operation_description="Активация инвайт-кода",
+    request_body=activate_invite_request,
+    manual_parameters=[idempotency_key_param],
+    responses={
+        200: openapi.Response(
+            description="Инвайт-код успешно активирован",
+            schema=UserProfileSerializer
+        ),
+        400: openapi.Response(
+            description="Ошибка активации",
+            schema=ErrorSerializer()
+        ),
+        401: openapi.Response(
+            description="Не авторизован",
+            schema=ErrorSerializer()
+        ),
+        404: openapi.Response(
+            description="Пользователь не найден",
+            schema=ErrorSerializer()
+        ),
+        409: openapi.Response(
+            description="Запрос с этим ключом идемпотентности еще выполняется",
+            schema=ErrorSerializer()
+        )
+    }
+)
+@api_view(['POST'])
+def activate_invite(request):
+    """
+    Активация инвайт-кода
+    """
+    user_id = request.session.get('user_id')
+    if not user_id:
+        logger.warning("Попытка активации инвайт-кода неаутентифицированным пользователем")
+        INVITE_ACTIVATIONS.labels('NOT_AUTHENTICATED').inc()
+        return create_error_response(
+            status.HTTP_401_UNAUTHORIZED,
+            'Необходима аутентификация',
+            'NOT_AUTHENTICATED'
+        )
+    
+    idempotency = idempotency_key(request, 'activate_invite', user_id)
+    replay = claim_response(idempotency)
+    if replay is not None:
+        logger.info("Повтор активации инвайт-кода пользователем %s по ключу идемпотентности", user_id)
+        return replay
+    return run_idempotent(idempotency, _activate_invite, request, user_id)
+
+def internal_token_error(request, message):
+    """
+    Служебные эндпоинты (/metrics, /api/health/db/) закрыты токеном METRICS_TOKEN:
+    ответ 401, если токен задан и запрос пришел без него, иначе None
+    """
+    token = settings.METRICS_SETTINGS['token']
+    if token and not constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return create_error_response(status.HTTP_401_UNAUTHORIZED, message, 'NOT_AUTHENTICATED')
+    return None
+
+@swagger_auto_schema(
+    method='get',
+    operation_description="Состояние соединений с БД текущего воркера и статистика пула (служебный эндпоинт)",
+    responses={
+        200: openapi.Response(description="БД доступна", schema=db_health_response),
+        401: openapi.Response(description="Неверный токен", schema=ErrorSerializer()),
+        503: openapi.Response(description="БД недоступна", schema=db_health_response)
+    }
+)
+@api_view(['GET'])
+def db_health(request):
+    """
+    Состояние соединений с БД текущего воркера и статистика пула
+    """
+    error = internal_token_error(request, 'Неверный служебный токен')
+    if error is not None:
+        return error
+    db_status = database_status()
+    if not db_status['healthy']:
+        logger.error("БД недоступна: %s", db_status.get('error'))
+        return Response(db_status, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+    return Response(db_status)
+
+def metrics(request):
+    """
+    Метрики в текстовом формате Prometheus (вне DRF: формат ответа фиксирован)
+    """
+    if not settings.METRICS_SETTINGS['enabled']:
+        return create_error_response(status.HTTP_404_NOT_FOUND, 'Метрики отключены', 'METRICS_DISABLED')
+    error = internal_token_error(request, 'Неверный токен метрик')
+    if error is not None:
+        return error
+    return HttpResponse(render_metrics(), content_type=CONTENT_TYPE_LATEST)
+
+def openapi_schema(request):
+    """
+    Схема OpenAPI для Swagger UI и ReDoc (SPEC_URL): файл с хешем из статики,
+    собранный при деплое, или копия из памяти процесса
+    """
+    static_url = get_schema_static_url()
+    if static_url:
+        return HttpResponseRedirect(static_url)
+    return HttpResponse(get_schema_json(), content_type='application/json')